@@ -0,0 +1,946 @@
+"""
+Performance benchmarks for the Smart Goggles software.
+
+Run on the Pi itself to get meaningful numbers:
+
+    python benchmark.py                 # lists the available benchmarks
+    python benchmark.py <name> [args]   # runs one of them
+
+None of the benchmarks need the display, keypad or a live GPS.
+"""
+import sys
+import os
+import io
+import contextlib
+import math
+import time
+import queue
+import threading
+import tempfile
+
+import gps_handler
+import gps_sources
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    """Registers a benchmark under its function name."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+# --- Synthetic Data ---
+class SyntheticSkiDaySource:
+    """
+    Generates a plausible ski day: laps of a straight lift up followed by a
+    zig-zagging run down, at the requested fix rate. Deterministic, so runs are
+    comparable between benchmarks.
+    """
+    live = False
+
+    def __init__(self, hours=6.0, rate_hz=1.0, start_time=1700000000.0, lat=39.6, lon=-106.0):
+        self.hours = hours
+        self.rate_hz = rate_hz
+        self.start_time = start_time
+        self.lat, self.lon = lat, lon
+
+    def __iter__(self):
+        step = 1.0 / self.rate_hz
+        lift_s, run_s = 480.0, 240.0
+        lap_s = lift_s + run_s
+        m_per_deg_lat = 111320.0
+        m_per_deg_lon = m_per_deg_lat * math.cos(math.radians(self.lat))
+        t = 0.0
+        while t < self.hours * 3600:
+            phase = t % lap_s
+            if phase < lift_s:
+                progress = phase / lift_s
+                north, east, speed = 2000.0 * progress, 0.0, 2000.0 / lift_s
+            else:
+                progress = (phase - lift_s) / run_s
+                north = 2000.0 * (1 - progress)
+                east = 60.0 * math.sin(progress * 40 * math.pi)
+                speed = 12.0 + 4.0 * math.sin(progress * 40 * math.pi)
+            yield {
+                'time': self.start_time + t, 'mode': 3,
+                'lat': self.lat + north / m_per_deg_lat,
+                'lon': self.lon + east / m_per_deg_lon,
+                'alt_m': 2500.0 + north * 0.3,
+                'speed_mps': speed,
+            }
+            t += step
+
+def _timed(func, repeat):
+    """Returns the mean wall time of func() in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat): func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+# --- Benchmarks ---
+@benchmark
+def replay(replay_file=None, speed='0', rate_hz=None):
+    """Replays a track (or a synthetic 6 h day) through the GPS and logging pipeline."""
+    import trip_logger
+    rate_hz = float(rate_hz) if rate_hz else None
+    source = gps_sources.open_source(replay_file, float(speed), rate_hz) if replay_file \
+        else gps_sources.ReplaySource(SyntheticSkiDaySource(), float(speed), rate_hz)
+
+    broadcaster = gps_handler.GpsBroadcaster()
+    display_queue = broadcaster.subscribe('display', maxsize=100, lossless=True)
+    logger_queue = broadcaster.subscribe('logger', maxsize=100, lossless=True)
+    stop_event = threading.Event()
+    trip_logger.LOG_DIRECTORY = tempfile.mkdtemp(prefix='sg_bench_')
+    threading.Thread(target=trip_logger.trip_logger_thread, args=(logger_queue, stop_event), daemon=True).start()
+
+    poller = threading.Thread(target=gps_handler.gps_poller, args=(broadcaster, source), daemon=True)
+    start = time.perf_counter()
+    poller.start()
+    packets, first_time, last_time = 0, None, None
+    while poller.is_alive() or not display_queue.empty():
+        try:
+            packet = display_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if packet.get('fix'):
+            packets += 1
+            first_time = first_time or packet['time']
+            last_time = packet['time']
+    elapsed = time.perf_counter() - start
+    while not logger_queue.empty(): time.sleep(0.05)
+    stop_event.set()
+
+    track_seconds = (last_time - first_time) if packets else 0
+    print(f"Replayed {packets} fixes ({track_seconds / 3600:.2f} h of skiing) in {elapsed:.1f} s")
+    print(f"  {packets / elapsed:.0f} fixes/s, {track_seconds / elapsed:.0f}x real time")
+    print(f"  feeds: {broadcaster.stats()}")
+
+class _Iterable:
+    """Adapts a generator function into a (non-live) GPS source."""
+    live = False
+    def __init__(self, generator): self.generator = generator
+    def __iter__(self): return self.generator()
+
+class _NullDisplay:
+    """Headless stand-in for the OLED so rendering cost can be measured off the goggles."""
+    width, height = 128, 64
+    def getbuffer(self, image): return image.tobytes()
+    def ShowImage(self, buffer): pass
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+@benchmark
+def high_rate(seconds='60', rate_hz='10'):
+    """Real-time 10 Hz replay through poller, display loop and logger; reports lag and drops."""
+    import trip_logger
+    seconds, rate_hz = float(seconds), float(rate_hz)
+    try:
+        from ui_manager import UIManager
+        ui = UIManager(_NullDisplay())
+    except ImportError:
+        ui = None
+        print("(Pillow not installed: rendering is not included in this run)")
+
+    replay = gps_sources.ReplaySource(SyntheticSkiDaySource(hours=seconds / 3600, rate_hz=rate_hz), speed=1.0)
+    schedule = [] # (wall time, track time) of the first fix, to know when each fix was due
+    final_stats = [] # Feed counters once the last fix was published, before the poller's end-of-replay packet
+
+    def source():
+        for fix in replay:
+            if not schedule: schedule.append((time.monotonic(), fix['time']))
+            yield fix
+        final_stats.append(broadcaster.stats())
+
+    broadcaster = gps_handler.GpsBroadcaster()
+    display_queue = broadcaster.subscribe('display', rate_hz) # The screen keeps up with the GPS
+    logger_queue = broadcaster.subscribe('logger', maxsize=trip_logger.FEED_QUEUE_SIZE)
+    stop_event = threading.Event()
+    trip_logger.LOG_DIRECTORY = tempfile.mkdtemp(prefix='sg_bench_')
+    threading.Thread(target=trip_logger.trip_logger_thread, args=(logger_queue, stop_event), daemon=True).start()
+    poller = threading.Thread(target=gps_handler.gps_poller, args=(broadcaster, _Iterable(source)), daemon=True)
+
+    # Mirrors main_app's loop: drain the feed, redraw, short sleep.
+    lags, frames = [], 0
+    start = time.perf_counter()
+    poller.start()
+    while poller.is_alive():
+        newest = None
+        while True:
+            try:
+                newest = display_queue.get_nowait()
+            except queue.Empty:
+                break
+        if newest and newest.get('fix'):
+            wall_start, track_start = schedule[0]
+            lags.append(time.monotonic() - (wall_start + newest['time'] - track_start))
+            if ui: ui.display_home_screen(newest['speed_kph'], newest['alt_m'], True, "12:00", False, newest['incline_deg'], None)
+            frames += 1
+        time.sleep(0.02)
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+
+    stats = final_stats[0] if final_stats else broadcaster.stats()
+    period = 1.0 / rate_hz
+    p95 = _percentile(lags, 0.95)
+    print(f"{rate_hz:.0f} Hz for {elapsed:.0f} s: {frames / elapsed:.1f} display updates/s")
+    print(f"  fix-to-display lag: p50 {_percentile(lags, 0.5) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, max {max(lags or [0]) * 1000:.1f} ms")
+    print(f"  feeds: {stats}")
+    drop_rate = stats['display']['dropped'] / max(1, stats['display']['delivered'])
+    verdict = "SUSTAINED" if p95 < period and drop_rate < 0.01 else "FALLING BEHIND"
+    print(f"  {verdict} (p95 lag must stay under one fix period, {period * 1000:.0f} ms, with <1% display packets dropped)")
+
+@benchmark
+def geo_kernels(points='5000'):
+    """Compares haversine against the local projection and the vectorized kernels."""
+    import random
+    import geo
+    points = int(points)
+    rng = random.Random(1)
+    origin = {'lat': 45.0, 'lon': 7.0}
+    projection = geo.LocalProjection(origin['lat'], origin['lon'])
+    targets = [{'lat': 45.0 + rng.uniform(-0.05, 0.05), 'lon': 7.0 + rng.uniform(-0.07, 0.07)} for _ in range(points)]
+    xs, ys = projection.to_xy_arrays([p['lat'] for p in targets], [p['lon'] for p in targets])
+
+    haversine_ms = _timed(lambda: [geo.haversine_distance(origin, p) for p in targets], 5)
+    planar_ms = _timed(lambda: [projection.distance(origin, p) for p in targets], 5)
+    vector_ms = _timed(lambda: geo.one_to_many(0.0, 0.0, xs, ys), 20)
+    exact = geo.haversine_one_to_many(origin['lat'], origin['lon'], [p['lat'] for p in targets], [p['lon'] for p in targets])
+    worst = max(abs(projection.distance(origin, p) - d) / d for p, d in zip(targets, exact) if d > 1)
+
+    print(f"One-to-{points} distances:")
+    print(f"  haversine loop   {haversine_ms:8.2f} ms")
+    print(f"  projection loop  {planar_ms:8.2f} ms")
+    print(f"  vectorized       {vector_ms:8.2f} ms")
+    print(f"  worst relative error vs haversine within ~5.5 km: {worst * 100:.3f}%")
+
+@benchmark
+def profiler_overhead(frames='100000'):
+    """Measures the per-frame cost of main_app's stage instrumentation."""
+    import profiler
+    frames = int(frames)
+    loop_profiler = profiler.StageProfiler(('gps', 'position', 'input', 'db', 'render', 'flush', 'idle', 'frame'))
+
+    def instrumented_frame():
+        # Same calls main_app makes per loop iteration.
+        frame_start = stage_start = time.perf_counter()
+        stage_start = loop_profiler.lap('gps', stage_start)
+        stage_start = loop_profiler.lap('position', stage_start)
+        idle_end = time.perf_counter()
+        idle_seconds, stage_start = idle_end - stage_start, idle_end
+        stage_start = loop_profiler.lap('input', stage_start)
+        stage_start = loop_profiler.lap('render', stage_start, 0.0)
+        loop_profiler.record('flush', 0.0)
+        loop_end = time.perf_counter()
+        loop_profiler.record('idle', idle_seconds + loop_end - stage_start)
+        loop_profiler.record('frame', loop_end - frame_start)
+
+    per_frame_ms = _timed(instrumented_frame, frames)
+    nominal_frame_ms = 70.0 # 50 ms select timeout + 20 ms sleep, the fastest main_app loop
+    print(f"Instrumentation: {per_frame_ms * 1000:.1f} us per frame, "
+          f"{per_frame_ms / nominal_frame_ms * 100:.3f}% of a {nominal_frame_ms:.0f} ms loop (budget 1%)")
+    print(f"Summary of the synthetic frames: {loop_profiler.summary()['frame']}")
+
+def _synthetic_resort_db(path, waypoints=400, runs=60, route_runs=6):
+    """Writes a resort DB with the given number of waypoints, runs and one route per run window."""
+    import random
+    import db_manager
+    rng = random.Random(7)
+    saved_db_file = db_manager.DB_FILE
+    db_manager.DB_FILE = path
+    try:
+        db_manager.setup_database()
+        with db_manager.transaction(path) as conn:
+            for i in range(waypoints):
+                conn.execute("INSERT INTO waypoints (name, lat, lon, alt) VALUES (?, ?, ?, ?)",
+                             (f"WP {i}", 39.6 + rng.uniform(-0.02, 0.02), -106.0 + rng.uniform(-0.03, 0.03), 2500 + rng.uniform(0, 900)))
+        per_run = max(2, waypoints // runs)
+        for r in range(runs):
+            ids = list(range(r * per_run + 1, min(waypoints, (r + 1) * per_run + 1) + 1))
+            db_manager.add_run_lift(f"Run {r}", ids, 'Lift' if r % 4 == 0 else 'Run', ['Green', 'Blue', 'Black'][r % 3])
+        for r in range(0, runs - route_runs + 1, route_runs):
+            db_manager.add_route(f"Route {r}", list(range(r + 1, r + route_runs + 1)), 'N/A', 'Black')
+    finally:
+        db_manager.DB_FILE = saved_db_file
+
+@benchmark
+def db_latency(repeat='2000', db_path=None):
+    """Query latency: connect-per-query (old execute_query) vs persistent WAL connections."""
+    import sqlite3
+    import db_manager
+    repeat = int(repeat)
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='sg_bench_'), 'skidata.db')
+        _synthetic_resort_db(db_path)
+
+    def connect_per_query(query, params):
+        conn = sqlite3.connect(db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            return conn.execute(query, params).fetchone()
+        finally:
+            conn.close()
+
+    point_query = ("SELECT * FROM waypoints WHERE id = ?", (42,))
+    scan_query = ("SELECT COUNT(*) FROM run_lift WHERE type = ?", ('Run',))
+    print(f"Mean latency over {repeat} queries on {db_path}:")
+    for label, (query, params) in (('point lookup', point_query), ('small scan', scan_query)):
+        before = _timed(lambda: connect_per_query(query, params), repeat)
+        after = _timed(lambda: db_manager.execute_query(db_path, query, params, fetchone=True), repeat)
+        print(f"  {label:<13} before {before * 1000:7.1f} us   after {after * 1000:7.1f} us   ({before / after:.0f}x)")
+    write = lambda: db_manager.execute_query(db_path, "UPDATE waypoints SET alt = alt WHERE id = ?", (42,), commit=True)
+    print(f"  committed write (WAL, synchronous=NORMAL) {_timed(write, max(1, repeat // 10)) * 1000:7.1f} us")
+
+@benchmark
+def route_start(waypoints='800', runs='100', route_runs='6'):
+    """Route expansion on a large synthetic resort: old N+1 queries vs the single-join expansion."""
+    import sqlite3
+    import db_manager
+    db_path = os.path.join(tempfile.mkdtemp(prefix='sg_bench_'), 'skidata.db')
+    _synthetic_resort_db(db_path, int(waypoints), int(runs), int(route_runs))
+    db_manager.DB_FILE = db_path
+    route_id = db_manager.get_all_routes_structured()[0]['id']
+
+    def query_per_call(query, params, fetchall=False):
+        conn = sqlite3.connect(db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(query, params)
+            return cursor.fetchall() if fetchall else cursor.fetchone()
+        finally:
+            conn.close()
+
+    def n_plus_one():
+        # The original get_waypoints_for_route: one connection and query per route, run and waypoint.
+        final_waypoints, processed_wp_ids = [], set()
+        for run_id in [row['run_id'] for row in query_per_call("SELECT run_id FROM route_runs WHERE route_id = ? ORDER BY seq", (route_id,), True)]:
+            run_rows = query_per_call("SELECT waypoint_id FROM run_waypoints WHERE run_id = ? ORDER BY seq", (run_id,), True)
+            for wp_id in [row['waypoint_id'] for row in run_rows]:
+                if wp_id not in processed_wp_ids:
+                    final_waypoints.append(dict(query_per_call("SELECT * FROM waypoints WHERE id = ?", (wp_id,)))); processed_wp_ids.add(wp_id)
+        return final_waypoints
+
+    expected = n_plus_one()
+    assert [wp['id'] for wp in db_manager.get_waypoints_for_route(route_id)] == [wp['id'] for wp in expected]
+    before = _timed(n_plus_one, 20)
+    after = _timed(lambda: db_manager.get_route_with_waypoints(route_id), 200)
+    print(f"Route of {route_runs} runs / {len(expected)} waypoints on a {waypoints}-waypoint resort:")
+    print(f"  before (N+1, {1 + int(route_runs) + len(expected)} queries) {before:7.2f} ms")
+    print(f"  after  (route + 1 join)  {after:7.2f} ms   ({before / after:.0f}x)")
+
+@benchmark
+def track_sampling(replay_file=None, rate_hz='10', hours='1', noise_m='0', noise_corr_s='0'):
+    """Stored rows and reconstruction error: fixed 5 s logging vs the TrackSampler, on a replayed track."""
+    import math
+    import random
+    import numpy as np
+    import geo
+    import trip_logger
+    rate_hz = float(rate_hz)
+    source = gps_sources.open_source(replay_file, 0, rate_hz) if replay_file \
+        else SyntheticSkiDaySource(hours=float(hours), rate_hz=rate_hz)
+    noise_m, noise_corr_s, rng = float(noise_m), float(noise_corr_s), random.Random(1)
+    # Synthetic GPS noise of noise_m metres per axis: white, or a random walk pulled back with noise_corr_s time constant
+    decay = math.exp(-1.0 / (rate_hz * noise_corr_s)) if noise_corr_s else 0.0
+    drift = math.sqrt(1.0 - decay * decay)
+    north = east = 0.0
+    history, fixes, truth = [], [], [] # truth: positions before any added noise
+    for fix in source:
+        clean = fix
+        if noise_m and fix.get('lat') is not None:
+            north = decay * north + drift * rng.gauss(0, noise_m)
+            east = decay * east + drift * rng.gauss(0, noise_m)
+            fix = dict(fix, lat=fix['lat'] + north / 111320.0, lon=fix['lon'] + east / 85000.0)
+        packet = gps_handler.build_packet(fix, history)
+        if packet['fix'] and packet['time'] is not None:
+            history = (history + [packet])[-gps_handler.HISTORY_LENGTH:]
+            fixes.append(packet)
+            truth.append((clean['lat'], clean['lon']))
+    if not fixes: print("No fixes to replay."); return
+
+    def fixed_interval():
+        # The previous policy: one point every 5 s (the logger feed's rate) while moving faster than 1 m/s.
+        kept, last_time = [], None
+        for packet in fixes:
+            if last_time is not None and packet['time'] - last_time < 5.0: continue
+            last_time = packet['time']
+            if packet['speed_mps'] > trip_logger.MIN_SPEED_MPS: kept.append(packet)
+        return kept
+
+    def sampled():
+        sampler = trip_logger.TrackSampler()
+        kept = []
+        for packet in fixes: kept.extend(sampler.add(packet))
+        return kept + sampler.finish()
+
+    projection = geo.LocalProjection(fixes[0]['lat'], fixes[0]['lon'])
+    times = np.array([p['time'] for p in fixes])
+    xs, ys = projection.to_xy_arrays([lat for lat, _ in truth], [lon for _, lon in truth])
+    alts = np.array([p['alt_m'] for p in fixes])
+    hours_logged = (times[-1] - times[0]) / 3600
+    print(f"{len(fixes)} fixes at {rate_hz:g} Hz ({hours_logged:.2f} h). Error of the track rebuilt from the stored rows{' vs the noise-free track' if noise_m else ''}:")
+    for label, policy in (('every 5 s', fixed_interval), ('TrackSampler', sampled)):
+        started = time.perf_counter()
+        kept = policy()
+        elapsed = time.perf_counter() - started
+        kept_times = np.array([p['time'] for p in kept])
+        kept_xs, kept_ys = projection.to_xy_arrays([p['lat'] for p in kept], [p['lon'] for p in kept])
+        errors = np.hypot(np.interp(times, kept_times, kept_xs) - xs, np.interp(times, kept_times, kept_ys) - ys)
+        alt_errors = np.abs(np.interp(times, kept_times, [p['alt_m'] for p in kept]) - alts)
+        print(f"  {label:<13} {len(kept):6d} rows ({len(kept) / hours_logged:5.0f}/h)   position mean {errors.mean():5.2f} m,"
+              f" p95 {np.percentile(errors, 95):6.2f} m, max {errors.max():6.1f} m   altitude p95 {np.percentile(alt_errors, 95):5.2f} m"
+              f"   {elapsed / len(fixes) * 1e6:.0f} us/fix")
+
+@benchmark
+def track_storage(hours='7', rate_hz='1', noise_m='1.5'):
+    """Daily track size and full-day read time: trip_log rows vs track_codec chunks, with a lossless round-trip check."""
+    import random
+    import sqlite3
+    import numpy as np
+    import db_manager
+    import track_codec
+    import trip_logger
+    rng = random.Random(1)
+    noise_m = float(noise_m)
+    points = [(fix['time'], fix['lat'] + rng.gauss(0, noise_m) / 111320.0, fix['lon'] + rng.gauss(0, noise_m) / 85000.0,
+               fix['alt_m'] + rng.gauss(0, noise_m), fix['speed_mps'])
+              for fix in SyntheticSkiDaySource(hours=float(hours), rate_hz=float(rate_hz))]
+    directory = tempfile.mkdtemp(prefix='sg_bench_')
+
+    def write(name, store):
+        path = os.path.join(directory, f"{name}.db")
+        conn = sqlite3.connect(path)
+        table = 'trip_log' if name == 'rows' else 'track_chunks'
+        conn.execute(next(statement for statement in db_manager.DAILY_LOG_SCHEMA if f"EXISTS {table} (" in statement))
+        with conn:
+            for start in range(0, len(points), trip_logger.FLUSH_BATCH_SIZE): # As the writer flushes them
+                store(conn, points[start:start + trip_logger.FLUSH_BATCH_SIZE])
+        conn.execute("VACUUM")
+        conn.close()
+        return path
+
+    rows_path = write('rows', lambda conn, batch: conn.executemany(
+        "INSERT INTO trip_log (timestamp, lat, lon, alt, speed) VALUES (?, ?, ?, ?, ?)",
+        ((trip_logger._utc_timestamp(p[0]),) + p[1:] for p in batch)))
+    chunks_path = write('chunks', track_codec.ChunkAppender().write)
+
+    def read_dicts():
+        # The viewer's previous read: every row as a dict.
+        conn = sqlite3.connect(rows_path)
+        conn.row_factory = sqlite3.Row
+        rows = [dict(row) for row in conn.execute("SELECT timestamp, lat, lon, alt, speed FROM trip_log ORDER BY timestamp ASC")]
+        conn.close()
+        return rows
+
+    def read_with(path, reader):
+        conn = sqlite3.connect(path)
+        result = reader(conn)
+        conn.close()
+        return result
+
+    # Lossless at the format's precision: decoding gives back the quantized
+    # input exactly, and re-encoding every stored chunk gives the same bytes.
+    expected = track_codec.dequantize(track_codec.quantize(points))
+    decoded = read_with(chunks_path, track_codec.load_track)
+    streamed = read_with(chunks_path, lambda conn: np.concatenate(list(track_codec.iter_track(conn))))
+    conn = sqlite3.connect(chunks_path)
+    same_bytes = all(track_codec.encode_chunk(track_codec.decode_chunk(blob)) == blob
+                     for (blob,) in conn.execute("SELECT data FROM track_chunks"))
+    conn.close()
+    from_rows = read_with(rows_path, track_codec.load_track)
+    print(f"{len(points)} points ({hours} h at {rate_hz} Hz, {noise_m:g} m GPS noise)."
+          f"  Round trip: {'OK' if np.array_equal(decoded, expected) and np.array_equal(streamed, expected) and same_bytes else 'FAILED'}"
+          f" (max difference from the trip_log rows: {', '.join(f'{name} {diff:.2g}' for name, diff in zip(track_codec.COLUMNS, np.abs(decoded - from_rows).max(axis=0)))})")
+    rows_size, chunks_size = os.path.getsize(rows_path), os.path.getsize(chunks_path)
+    print(f"  trip_log rows  {rows_size / 1024:8.0f} KiB  ({rows_size / len(points):5.1f} B/point)")
+    print(f"  track_chunks   {chunks_size / 1024:8.0f} KiB  ({chunks_size / len(points):5.1f} B/point, {rows_size / chunks_size:.1f}x smaller)")
+    print("Full-day read:")
+    for label, func in (('rows as dicts', read_dicts),
+                        ('rows -> arrays', lambda: read_with(rows_path, track_codec.load_track)),
+                        ('chunks -> arrays', lambda: read_with(chunks_path, track_codec.load_track)),
+                        ('chunks -> records', lambda: read_with(chunks_path, lambda conn: list(track_codec.iter_records(conn))))):
+        print(f"  {label:<18} {_timed(func, 5):8.1f} ms")
+
+def _synthetic_resort_model(nodes, seed=3):
+    """
+    An in-memory ResortModel of about `nodes` waypoints: a jittered grid
+    falling away to the south, with two-waypoint runs of random difficulty
+    from each point to its downhill neighbours and a lift up every 8th column.
+    """
+    import random
+    import resort_model
+    rng = random.Random(seed)
+    side = max(2, math.ceil(math.sqrt(nodes)))
+    spacing = 50.0
+    m_per_deg_lat, m_per_deg_lon = 111320.0, 111320.0 * math.cos(math.radians(39.6))
+    waypoints = []
+    for row in range(side):
+        for col in range(side):
+            north, east = -row * spacing + rng.uniform(-15, 15), col * spacing + rng.uniform(-15, 15)
+            waypoints.append({'id': row * side + col + 1, 'name': f"WP {row}/{col}", 'type': 'junction',
+                              'lat': 39.6 + north / m_per_deg_lat, 'lon': -106.0 + east / m_per_deg_lon, 'alt': 3500 + north * 0.3})
+    runs = []
+    def add_run(kind, difficulty, ids):
+        runs.append({'id': len(runs) + 1, 'name': f"{kind} {len(runs) + 1}", 'type': kind, 'difficulty': difficulty, 'waypoints_list': ids})
+    for row in range(side - 1):
+        for col in range(side):
+            for next_col in (col - 1, col, col + 1):
+                if 0 <= next_col < side and (next_col == col or rng.random() < 0.5):
+                    add_run('Run', rng.choice(('Green', 'Green', 'Blue', 'Black')), [row * side + col + 1, (row + 1) * side + next_col + 1])
+            if col + 1 < side:
+                for a, b in ((col, col + 1), (col + 1, col)): # Cat tracks across the hill
+                    if rng.random() < 0.3: add_run('Run', 'Green', [row * side + a + 1, row * side + b + 1])
+    for col in range(0, side, 8):
+        add_run('Lift', 'Lift', [(side - 1) * side + col + 1, col + 1])
+    return resort_model.ResortModel(waypoints, runs, [])
+
+def _dict_a_star(nodes, graph, start_node_id, end_node_id):
+    # The A* search before the routing engine: dict state over every node per
+    # call, a distance computation per push, no closed set, dicts returned.
+    import heapq
+    import mapper
+    open_set = [(0, start_node_id)]
+    came_from = {}
+    g_score = {node_id: float('inf') for node_id in nodes}
+    g_score[start_node_id] = 0
+    f_score = {node_id: float('inf') for node_id in nodes}
+    f_score[start_node_id] = mapper.distance_m(nodes[start_node_id], nodes[end_node_id])
+    while open_set:
+        _, current_id = heapq.heappop(open_set)
+        if current_id == end_node_id:
+            path = []
+            while current_id in came_from:
+                path.append(nodes[current_id]); current_id = came_from[current_id]
+            path.append(nodes[start_node_id]); return path[::-1]
+        for neighbor_id, cost in graph.get(current_id, {}).items():
+            tentative_g_score = g_score[current_id] + cost
+            if tentative_g_score < g_score[neighbor_id]:
+                came_from[neighbor_id] = current_id; g_score[neighbor_id] = tentative_g_score
+                f_score[neighbor_id] = tentative_g_score + mapper.distance_m(nodes[neighbor_id], nodes[end_node_id])
+                heapq.heappush(open_set, (f_score[neighbor_id], neighbor_id))
+    return None
+
+@benchmark
+def routing(sizes='100,1000,10000', queries='200', difficulty='Blue'):
+    """Point-to-point routing on synthetic resorts: dict-based A* vs the compiled graph + RoutingEngine."""
+    import random
+    import router
+    print(f"Mean time per {difficulty} query over {queries} random start/goal pairs:")
+    for size in (int(n) for n in sizes.split(',')):
+        started = time.perf_counter()
+        model = _synthetic_resort_model(size)
+        engine = router.engine_for(model, difficulty)
+        graph = engine.graph
+        build_ms = (time.perf_counter() - started) * 1000
+        # The dict-of-dicts graph the old search ran on
+        dict_graph = {wp_id: {} for wp_id in model.waypoints_by_id}
+        for start_id, edges in model.adjacency.items():
+            for end_id, length, run in edges:
+                if model.run_allowed(run, difficulty): dict_graph[start_id][end_id] = length
+        rng = random.Random(size)
+        pairs = [(rng.choice(graph.ids), rng.choice(graph.ids)) for _ in range(int(queries))]
+
+        edge_costs = {(graph.ids[start], graph.ids[end]): cost
+                      for start in range(graph.node_count) for end, cost in graph.edges(start)}
+        def path_cost(path):
+            return round(sum(edge_costs[a['id'], b['id']] for a, b in zip(path, path[1:])), 6) if path else None
+
+        def engine_path(a, b):
+            result = engine.shortest_path(graph.index[a], graph.index[b])
+            return graph.path_waypoints(result[1]) if result else None
+
+        before_costs = [path_cost(_dict_a_star(model.waypoints_by_id, dict_graph, a, b)) for a, b in pairs]
+        after_costs = [path_cost(engine_path(a, b)) for a, b in pairs]
+        mismatches = sum(1 for x, y in zip(before_costs, after_costs) if x != y)
+        before = _timed(lambda: [_dict_a_star(model.waypoints_by_id, dict_graph, a, b) for a, b in pairs], 1) / len(pairs)
+        after = _timed(lambda: [engine.shortest_path(graph.index[a], graph.index[b]) for a, b in pairs], 1) / len(pairs)
+        found = sum(1 for cost in after_costs if cost is not None)
+        print(f"  {graph.node_count:6d} nodes {graph.edge_count:6d} edges  compile {build_ms:7.1f} ms   before {before * 1000:9.1f} us"
+              f"   after {after * 1000:8.1f} us ({before / after:4.1f}x)   {found}/{len(pairs)} reachable,"
+              f" {'same costs' if not mismatches else f'{mismatches} cost mismatches'}")
+
+@benchmark
+def route_lookup(sizes='100,1000,3000', queries='200', difficulty='Blue'):
+    """Precomputed all-pairs route tables: build/load time, and lookups vs A* per query."""
+    import random
+    import router
+    import route_tables
+    directory = tempfile.mkdtemp(prefix='sg_bench_')
+    print(f"{difficulty} tables on synthetic resorts, {queries} random start/goal pairs:")
+    for size in (int(n) for n in sizes.split(',')):
+        model = _synthetic_resort_model(size)
+        graph = model.graph(difficulty)
+        engine = router.engine_for(model, difficulty)
+        db_path = os.path.join(directory, f"resort{size}.db")
+        started = time.perf_counter()
+        table = route_tables.build_table(graph, db_path=db_path)
+        build_s = time.perf_counter() - started
+        path = route_tables.table_path(graph, db_path)
+        load_ms = _timed(lambda: route_tables.RouteTable.load(path, graph), 3)
+        rng = random.Random(size)
+        pairs = [(rng.randrange(graph.node_count), rng.randrange(graph.node_count)) for _ in range(int(queries))]
+        mismatches = 0
+        for a, b in pairs:
+            result = engine.shortest_path(a, b)
+            table_path = table.path(a, b)
+            if (result is None) != (table_path is None) or (result and abs(result[0] - sum(
+                    dict(graph.edges(x))[y] for x, y in zip(table_path, table_path[1:]))) > 1e-6):
+                mismatches += 1
+        a_star = _timed(lambda: [engine.shortest_path(a, b) for a, b in pairs], 1) / len(pairs)
+        walk = _timed(lambda: [table.path(a, b) for a, b in pairs], 1) / len(pairs)
+        check_search = _timed(lambda: [engine.shortest_path(a, b) is not None for a, b in pairs], 1) / len(pairs)
+        check_table = _timed(lambda: [table.reachable(a, b) for a, b in pairs], 1) / len(pairs)
+        menu = _timed(lambda: [table.reachable_from(a).nonzero() for a, _ in pairs], 1) / len(pairs)
+        print(f"  {graph.node_count:5d} nodes: build {build_s:6.2f} s, file {os.path.getsize(path) / 1e6:6.1f} MB, load {load_ms:6.1f} ms"
+              f"{'' if not mismatches else f'   {mismatches} MISMATCHES'}")
+        print(f"      route       A* {a_star * 1000:8.1f} us   table walk {walk * 1000:6.1f} us ({a_star / walk:5.0f}x)")
+        print(f"      reachable?  A* {check_search * 1000:8.1f} us   table      {check_table * 1000:6.2f} us ({check_search / check_table:5.0f}x)"
+              f"   whole destination menu {menu * 1000:5.1f} us")
+
+@benchmark
+def route_alternatives(sizes='100,1000', queries='100', k='3', difficulty='Blue'):
+    """Directions with alternatives: old per-first-run A* + random pick vs deterministic diverse K shortest paths."""
+    import random
+    import router
+    k = int(k)
+    print(f"{difficulty} directions for {queries} random reachable start/goal pairs, k = {k}:")
+    for size in (int(n) for n in sizes.split(',')):
+        model = _synthetic_resort_model(size)
+        graph = model.graph(difficulty)
+        engine = router.engine_for(model, difficulty)
+        rng = random.Random(size)
+        pairs = []
+        while len(pairs) < int(queries):
+            a, b = rng.randrange(graph.node_count), rng.randrange(graph.node_count)
+            if a != b and engine.shortest_path(a, b): pairs.append((a, b))
+
+        def old_smart_route(a, b):
+            # One A* from the end of every run leaving the start, then a random pick among the results.
+            routes = []
+            for run in model.runs_starting_at.get(graph.ids[a], []):
+                if not model.run_allowed(run, difficulty): continue
+                first_step = [graph.index[wp_id] for wp_id in run['waypoints_list']]
+                rest = engine.shortest_path(first_step[-1], b) if first_step[-1] != b else (0.0, [b])
+                if rest: routes.append(first_step + rest[1][1:])
+            random.shuffle(routes)
+            return random.choice(routes[:5]) if routes else None
+
+        def new_routes(a, b):
+            return engine.k_shortest_paths(a, b, k, router.tree_to(model, difficulty, b).cost)
+
+        old_ms = _timed(lambda: [old_smart_route(a, b) for a, b in pairs], 1) / len(pairs)
+        new_ms = _timed(lambda: [new_routes(a, b) for a, b in pairs], 1) / len(pairs)
+        results = [new_routes(a, b) for a, b in pairs]
+        deterministic = results == [new_routes(a, b) for a, b in pairs]
+        worse, missing = 0, 0
+        for (a, b), routes in zip(pairs, results):
+            old = old_smart_route(a, b)
+            if old is None: missing += 1
+            elif graph.path_cost(old) > routes[0][0] + 1e-6: worse += 1
+        found = [len(routes) for routes in results]
+        extra = [cost / routes[0][0] for routes in results for cost, _ in routes[1:]]
+        print(f"  {graph.node_count:5d} nodes: old {old_ms * 1000:8.1f} us/request, picked a longer route {worse}/{len(pairs)},"
+              f" no route {missing}/{len(pairs)}")
+        print(f"               new {new_ms * 1000:8.1f} us/request, {sum(found) / len(found):.2f} routes found on average,"
+              f" alternatives {(sum(extra) / len(extra) - 1) * 100 if extra else 0:.0f}% longer on average,"
+              f" {'deterministic' if deterministic else 'NOT deterministic'}")
+
+@benchmark
+def rerouting(sizes='100,1000,10000', navigations='50', rate_hz='10', difficulty='Blue'):
+    """Per-fix cost of navigation with off-route detection and rerouting up the destination tree, at the GPS rate."""
+    import random
+    import mapper
+    import router
+    mapper.audio_handler.speak = lambda text: None # No voice prompts while benchmarking
+    rate_hz, speed_mps = float(rate_hz), 12.0
+    print(f"{difficulty} navigations where the skier leaves the route at the first junction, fixes at {rate_hz:g} Hz:")
+    for size in (int(n) for n in sizes.split(',')):
+        model = _synthetic_resort_model(size)
+        graph = model.graph(difficulty)
+        engine = router.engine_for(model, difficulty)
+        rng = random.Random(size)
+        tree_ms, fix_s, reroute_s, search_s = [], [], [], []
+        arrived = attempts = 0
+        while len(tree_ms) < int(navigations) and attempts < int(navigations) * 20:
+            attempts += 1
+            start, goal = rng.randrange(graph.node_count), rng.randrange(graph.node_count)
+            started = time.perf_counter()
+            tree = router.tree_to(model, difficulty, goal)
+            elapsed = (time.perf_counter() - started) * 1000
+            planned = tree.path_from(start)
+            # The skier takes a different first segment, then the best way on from there.
+            detours = [end for end, _ in graph.edges(start) if len(planned or []) > 2 and end != planned[1] and tree.reachable(end)]
+            if not detours: continue
+            tree_ms.append(elapsed)
+            skied = [start] + tree.path_from(rng.choice(detours))
+            route = {'waypoints': graph.path_waypoints(planned), 'current_wp_index': 0, 'is_smart_route': True, 'tree': tree, 'off_route_fixes': 0}
+            for a, b in zip(skied, skied[1:]):
+                steps = max(1, int(math.hypot(graph.xs[b] - graph.xs[a], graph.ys[b] - graph.ys[a]) / speed_mps * rate_hz))
+                for step in range(steps):
+                    lat, lon = graph.projection.to_latlon(graph.xs[a] + (graph.xs[b] - graph.xs[a]) * step / steps,
+                                                          graph.ys[a] + (graph.ys[b] - graph.ys[a]) * step / steps)
+                    started = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()): # The "rerouting" log lines
+                        result = mapper.update_position(route, {'lat': lat, 'lon': lon, 'alt_m': 0})
+                    elapsed = time.perf_counter() - started
+                    fix_s.append(elapsed)
+                    if result and result.get('rerouted'):
+                        reroute_s.append(elapsed)
+                        from_node = graph.index[route['waypoints'][0]['id']]
+                        started = time.perf_counter()
+                        engine.shortest_path(from_node, goal)
+                        search_s.append(time.perf_counter() - started)
+                    if result is None: break
+                if result is None: break
+            lat, lon = graph.projection.to_latlon(graph.xs[goal], graph.ys[goal])
+            if result is not None and mapper.update_position(route, {'lat': lat, 'lon': lon, 'alt_m': 0}) is None: result = None
+            arrived += result is None
+        budget_ms = 1000 / rate_hz
+        print(f"  {graph.node_count:5d} nodes: tree per navigation {sum(tree_ms) / max(len(tree_ms), 1):6.2f} ms,"
+              f" {len(reroute_s)} reroutes, {arrived}/{len(tree_ms)} navigations reached the destination")
+        print(f"      per fix  p50 {_percentile(fix_s, 0.5) * 1e6:7.1f} us  p99 {_percentile(fix_s, 0.99) * 1e6:7.1f} us"
+              f"  max {max(fix_s or [0]) * 1e6:8.1f} us  ({max(fix_s or [0]) * 1000 / budget_ms * 100:.1f}% of the {budget_ms:.0f} ms fix interval)")
+        if reroute_s:
+            print(f"      rerouting fix p50 {_percentile(reroute_s, 0.5) * 1e6:7.1f} us (a fresh A* from the same point instead:"
+                  f" p50 {_percentile(search_s, 0.5) * 1e6:7.1f} us)")
+
+def _linear_nearest(waypoints, lat, lon, k):
+    # The nearest-waypoint search before the spatial index: project and measure every waypoint, then sort them all.
+    import numpy as np
+    import geo
+    projection = geo.get_projection(lat, lon)
+    xs, ys = projection.to_xy_arrays([wp['lat'] for wp in waypoints], [wp['lon'] for wp in waypoints])
+    distances = geo.one_to_many(*projection.to_xy(lat, lon), xs, ys)
+    return [(float(distances[i]), waypoints[i]) for i in np.argsort(distances, kind='stable')[:k]]
+
+@benchmark
+def spatial_queries(sizes='1000,10000,100000', queries='500', k='5', radius_m='150'):
+    """Nearest waypoints, closest POI and radius queries: linear scan + sort vs the spatial_index grid."""
+    import random
+    import spatial_index
+    k, radius_m = int(k), float(radius_m)
+    types = ('junction',) * 8 + ('lift', 'restaurant')
+    print(f"Mean time per query over {queries} random positions (k = {k}, radius {radius_m:g} m):")
+    for size in (int(n) for n in sizes.split(',')):
+        rng = random.Random(size)
+        side_m = math.sqrt(size) * 60.0 # Keeps the density of a real resort as it grows
+        m_per_deg_lat, m_per_deg_lon = 111320.0, 111320.0 * math.cos(math.radians(39.6))
+        waypoints = [{'id': i + 1, 'name': f"WP {i}", 'type': rng.choice(types),
+                      'lat': 39.6 + rng.uniform(0, side_m) / m_per_deg_lat, 'lon': -106.0 + rng.uniform(0, side_m) / m_per_deg_lon}
+                     for i in range(size)]
+        started = time.perf_counter()
+        index = spatial_index.WaypointIndex(waypoints)
+        build_ms = (time.perf_counter() - started) * 1000
+        positions = [(39.6 + rng.uniform(0, side_m) / m_per_deg_lat, -106.0 + rng.uniform(0, side_m) / m_per_deg_lon)
+                     for _ in range(int(queries))]
+        lifts = [wp for wp in waypoints if wp['type'] == 'lift']
+
+        mismatches = 0 # Both sides measure on slightly different projections (cm apart), so near-ties may swap
+        for lat, lon in positions[:100]:
+            for old, new in ((_linear_nearest(waypoints, lat, lon, k), index.nearest(lat, lon, k)),
+                             (_linear_nearest(lifts, lat, lon, 1), index.nearest(lat, lon, 1, 'lift'))):
+                if len(old) != len(new) or any(abs(a - b) > 0.1 + a * 0.001 for (a, _), (b, _) in zip(old, new)): mismatches += 1
+            in_radius = {wp['id'] for d, wp in _linear_nearest(waypoints, lat, lon, size) if d <= radius_m - 0.1}
+            near_radius = {wp['id'] for d, wp in _linear_nearest(waypoints, lat, lon, size) if d <= radius_m + 0.1}
+            if not in_radius <= {wp['id'] for _, wp in index.within(lat, lon, radius_m)} <= near_radius: mismatches += 1
+
+        linear_knn = _timed(lambda: [_linear_nearest(waypoints, lat, lon, k) for lat, lon in positions], 1) / len(positions)
+        grid_knn = _timed(lambda: [index.nearest(lat, lon, k) for lat, lon in positions], 1) / len(positions)
+        linear_poi = _timed(lambda: [_linear_nearest(lifts, lat, lon, 1) for lat, lon in positions], 1) / len(positions)
+        grid_poi = _timed(lambda: [index.nearest(lat, lon, 1, 'lift') for lat, lon in positions], 1) / len(positions)
+        grid_radius = _timed(lambda: [index.within(lat, lon, radius_m) for lat, lon in positions], 1) / len(positions)
+        started = time.perf_counter()
+        for i in range(100):
+            index.add({'id': size + i + 1, 'name': f"New {i}", 'type': 'junction', 'lat': positions[i % len(positions)][0],
+                       'lon': positions[i % len(positions)][1]})
+        add_us = (time.perf_counter() - started) * 1e6 / 100
+        print(f"  {size:6d} waypoints: build {build_ms:7.1f} ms, add {add_us:5.1f} us/waypoint"
+              f"{'' if not mismatches else f'   {mismatches} MISMATCHES'}")
+        print(f"      {k} nearest   linear {linear_knn * 1000:8.1f} us   grid {grid_knn * 1000:6.1f} us ({linear_knn / grid_knn:5.0f}x)")
+        print(f"      closest lift linear {linear_poi * 1000:8.1f} us   grid {grid_poi * 1000:6.1f} us ({linear_poi / grid_poi:5.0f}x)")
+        print(f"      within radius       {'':8s}      grid {grid_radius * 1000:6.1f} us")
+
+@benchmark
+def map_matching(sizes='100,1000,10000', legs='60', noise_m='4', rate_hz='10'):
+    """Online HMM map matching of a noisy ride through synthetic resorts: per-fix time and accuracy."""
+    import random
+    import map_matcher
+    noise_m, rate_hz, speed_mps = float(noise_m), float(rate_hz), 12.0
+    print(f"{legs} runs/lifts ridden at {speed_mps:g} m/s, fixes at {rate_hz:g} Hz with {noise_m:g} m of GPS noise:")
+    for size in (int(n) for n in sizes.split(',')):
+        model = _synthetic_resort_model(size)
+        started = time.perf_counter()
+        projection = map_matcher.get_segments(model).projection
+        build_ms = (time.perf_counter() - started) * 1000
+        rng = random.Random(size)
+        fixes, truth = [], []
+        at = rng.choice([run for run in model.runs if run['type'] == 'Lift'])['waypoints_list'][0]
+        for _ in range(int(legs)):
+            if not model.runs_starting_at.get(at): break
+            run = rng.choice(model.runs_starting_at[at])
+            for a, b in zip(run['waypoints_list'], run['waypoints_list'][1:]):
+                x0, y0 = projection.to_xy(model.waypoints_by_id[a]['lat'], model.waypoints_by_id[a]['lon'])
+                x1, y1 = projection.to_xy(model.waypoints_by_id[b]['lat'], model.waypoints_by_id[b]['lon'])
+                steps = max(1, int(math.hypot(x1 - x0, y1 - y0) / speed_mps * rate_hz))
+                for step in range(steps):
+                    lat, lon = projection.to_latlon(x0 + (x1 - x0) * step / steps + rng.gauss(0, noise_m),
+                                                    y0 + (y1 - y0) * step / steps + rng.gauss(0, noise_m))
+                    fixes.append({'lat': lat, 'lon': lon}); truth.append(run['id'])
+            at = run['waypoints_list'][-1]
+        matcher = map_matcher.MapMatcher()
+        per_fix, matches = [], []
+        for fix in fixes:
+            started = time.perf_counter()
+            matches.append(matcher.update(fix, model))
+            per_fix.append(time.perf_counter() - started)
+        confident = [(match['run']['id'], run_id) for match, run_id in zip(matches, truth)
+                     if match and match['confidence'] >= map_matcher.MIN_CONFIDENCE]
+        correct = sum(1 for matched, run_id in confident if matched == run_id)
+        print(f"  {size:6d} waypoints: segment index {build_ms:6.1f} ms, per fix p50 {_percentile(per_fix, 0.5) * 1e6:6.1f} us"
+              f"  p99 {_percentile(per_fix, 0.99) * 1e6:6.1f} us;  confident on {len(confident) / max(len(fixes), 1) * 100:4.1f}% of"
+              f" {len(fixes)} fixes, right {correct / max(len(confident), 1) * 100:5.1f}% of those")
+
+@benchmark
+def route_progress(sizes='1000', routes='50', noise_m='8', rate_hz='1', difficulty='Blue'):
+    """Navigation with noisy GPS: proximity-only waypoint arrival vs along-track progress, and the per-fix cost."""
+    import random
+    import mapper
+    import router
+    mapper.audio_handler.speak = lambda text: None # No voice prompts while benchmarking
+    noise_m, rate_hz, speed_mps = float(noise_m), float(rate_hz), 12.0
+    print(f"{routes} routes skied at {speed_mps:g} m/s, fixes at {rate_hz:g} Hz with {noise_m:g} m of GPS noise:")
+    for size in (int(n) for n in sizes.split(',')):
+        model = _synthetic_resort_model(size)
+        graph = model.graph(difficulty)
+        engine = router.engine_for(model, difficulty)
+        rng = random.Random(size)
+        old_finished = new_finished = 0
+        old_stuck, per_fix, eta_errors = [], [], []
+        for _ in range(int(routes)):
+            while True:
+                result = engine.shortest_path(rng.randrange(graph.node_count), rng.randrange(graph.node_count))
+                if result and len(result[1]) > 3: break
+            waypoints = graph.path_waypoints(result[1])
+            fixes = []
+            for a, b in zip(result[1], result[1][1:]):
+                steps = max(1, int(math.hypot(graph.xs[b] - graph.xs[a], graph.ys[b] - graph.ys[a]) / speed_mps * rate_hz))
+                for step in range(steps):
+                    fixes.append(graph.projection.to_latlon(graph.xs[a] + (graph.xs[b] - graph.xs[a]) * step / steps + rng.gauss(0, noise_m),
+                                                            graph.ys[a] + (graph.ys[b] - graph.ys[a]) * step / steps + rng.gauss(0, noise_m)))
+            fixes.append(graph.projection.to_latlon(graph.xs[result[1][-1]], graph.ys[result[1][-1]]))
+            fixes = [{'lat': lat, 'lon': lon, 'time': 1e9 + i / rate_hz} for i, (lat, lon) in enumerate(fixes)]
+
+            # Before: the next waypoint only counts once a fix lands within the proximity radius.
+            index = 0
+            for fix in fixes:
+                if index < len(waypoints) and mapper.distance_m(fix, waypoints[index]) < mapper.PROXIMITY_RADIUS_METERS: index += 1
+            old_finished += index >= len(waypoints)
+            if index < len(waypoints): old_stuck.append(index / len(waypoints))
+
+            route = {'waypoints': waypoints, 'current_wp_index': 0}
+            for i, fix in enumerate(fixes):
+                started = time.perf_counter()
+                update = mapper.update_position(route, fix)
+                per_fix.append(time.perf_counter() - started)
+                if update is None: new_finished += 1; break
+                eta = update['waypoint_info'].get('eta_seconds')
+                remaining_s = (len(fixes) - 1 - i) / rate_hz
+                if eta is not None and i > len(fixes) // 4 and remaining_s > 0: eta_errors.append(abs(eta - remaining_s) / remaining_s)
+        print(f"  {size:5d} waypoints: proximity only finished {old_finished}/{routes} routes"
+              f"{f' (the rest stalled {sum(old_stuck) / len(old_stuck) * 100:.0f}% of the way on average)' if old_stuck else ''};"
+              f" with progress tracking {new_finished}/{routes}")
+        print(f"      per fix p50 {_percentile(per_fix, 0.5) * 1e6:6.1f} us  p99 {_percentile(per_fix, 0.99) * 1e6:6.1f} us;"
+              f"  ETA error after the first quarter of the route: median {_percentile(eta_errors, 0.5) * 100:.0f}%")
+
+# Simulated slow disk: an LD_PRELOAD shim that counts (and delays) every
+# fsync/fdatasync SQLite makes. Needs Linux and a C compiler.
+_SLOW_DISK_SHIM = r"""
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stdlib.h>
+#include <unistd.h>
+static long syncs = 0;
+static void slow(void) {
+    const char *ms = getenv("SLOWDISK_SYNC_MS");
+    syncs++;
+    if (ms) usleep(atoi(ms) * 1000);
+}
+int fsync(int fd) { static int (*real)(int); if (!real) real = dlsym(RTLD_NEXT, "fsync"); slow(); return real(fd); }
+int fdatasync(int fd) { static int (*real)(int); if (!real) real = dlsym(RTLD_NEXT, "fdatasync"); slow(); return real(fd); }
+long slowdisk_syncs(void) { return syncs; }
+"""
+
+def _slow_disk_counter(sync_ms):
+    """
+    Returns a function giving the number of syncs so far. The first call
+    re-executes the benchmark under the shim; returns None if that's impossible.
+    """
+    import ctypes
+    import shutil
+    import subprocess
+    try:
+        counter = ctypes.CDLL(None).slowdisk_syncs
+        counter.restype = ctypes.c_long
+        return counter
+    except AttributeError:
+        pass
+    if 'SLOWDISK_SYNC_MS' in os.environ or not shutil.which('cc'):
+        return None
+    build_dir = tempfile.mkdtemp(prefix='sg_bench_')
+    source, library = os.path.join(build_dir, 'slowdisk.c'), os.path.join(build_dir, 'slowdisk.so')
+    with open(source, 'w') as f: f.write(_SLOW_DISK_SHIM)
+    if subprocess.call(['cc', '-shared', '-fPIC', '-O2', '-o', library, source, '-ldl']) != 0:
+        return None
+    env = dict(os.environ, LD_PRELOAD=library, SLOWDISK_SYNC_MS=str(sync_ms))
+    os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+@benchmark
+def trip_log_writes(points='1200', rate_hz='10', sync_ms='10'):
+    """Trip log write throughput and fsyncs: commit per point vs batched WAL writer, on a slow disk."""
+    import sqlite3
+    import trip_logger
+    points, rate_hz = int(points), float(rate_hz)
+    count_syncs = _slow_disk_counter(sync_ms)
+    if count_syncs is None:
+        print("(Slow disk shim unavailable: timings are for this disk and fsyncs are not counted)")
+        count_syncs = lambda: 0
+    fixes = [gps_handler.build_packet(fix, []) for fix, _ in zip(SyntheticSkiDaySource(rate_hz=rate_hz), range(points))]
+    for packet in fixes: packet['speed_mps'] = max(packet['speed_mps'], 5.0)
+    log_minutes = points / rate_hz / 60
+    directory = tempfile.mkdtemp(prefix='sg_bench_')
+
+    def per_point_commit():
+        # The original trip logger: default rollback journal (synchronous=FULL), one commit per point.
+        conn = sqlite3.connect(os.path.join(directory, 'before.db'))
+        trip_logger.setup_daily_db(conn)
+        conn.commit()
+        for packet in fixes:
+            conn.execute("INSERT INTO trip_log (lat, lon, alt, speed) VALUES (?, ?, ?, ?)",
+                         (packet['lat'], packet['lon'], packet['alt_m'], packet['speed_mps']))
+            conn.commit()
+        conn.close()
+
+    def batched():
+        clock = [fixes[0]['time']] # Flush/checkpoint timers follow track time, as they would live
+        writer = trip_logger.TripLogWriter(os.path.join(directory, 'after.db'), clock=lambda: clock[0])
+        for packet in fixes:
+            clock[0] = packet['time']
+            writer.add(packet)
+            writer.flush_if_due()
+        writer.close()
+        return writer
+
+    print(f"{points} points at {rate_hz:g} Hz ({log_minutes:.1f} min of logging), {sync_ms} ms per fsync:")
+    for label, func in (('per-point commit', per_point_commit), ('batched WAL', batched)):
+        syncs_before, start = count_syncs(), time.perf_counter()
+        result = func()
+        elapsed, syncs = time.perf_counter() - start, count_syncs() - syncs_before
+        print(f"  {label:<17} {points / elapsed:9.0f} points/s   {syncs:6d} fsyncs ({syncs / log_minutes:7.1f}/min)"
+              + (f"   {result.flushes} flushes" if result else ""))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Available benchmarks:")
+        for name, func in BENCHMARKS.items():
+            print(f"  {name:<20} {func.__doc__}")
+        sys.exit(0 if len(sys.argv) < 2 else 1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
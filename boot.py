@@ -2,7 +2,6 @@ import os
 import sys
 import threading
 import time
-import queue
 
 # Add the local library path for the Waveshare driver
 sys.path.append(os.path.join(os.path.dirname(__file__), 'waveshare_OLED'))
@@ -11,13 +10,19 @@ from waveshare_OLED import OLED_1in51
 # Import project modules
 import db_manager
 import gps_handler
+import gps_sources
 import trip_logger
 import main_app
 import weather_handler
+import variables
 from ui_manager import UIManager # Import UIManager to use the splash screen
 
-# --- Shared Data, Lock, and Queue ---
-gps_queue = queue.Queue()
+# --- Shared Data, Lock, and GPS Feeds ---
+# Each consumer gets its own feed, decimated to the rate it can use.
+gps_broadcaster = gps_handler.GpsBroadcaster()
+gps_queue = gps_broadcaster.subscribe('display', main_app.DISPLAY_RATE_HZ)
+logger_gps_queue = gps_broadcaster.subscribe('logger', maxsize=trip_logger.FEED_QUEUE_SIZE) # Full rate, for the track sampler
+recorder_gps_queue = gps_broadcaster.subscribe('recorder', main_app.RECORDER_RATE_HZ)
 gps_data = {}
 data_lock = threading.Lock()
 # Create a list to hold all stop events for clean shutdown
@@ -45,17 +50,20 @@ if __name__ == '__main__':
             db_manager.setup_database()
             print("BOOT: Database created.")
 
+        db_manager.RESORT_DB_IMMUTABLE = variables.RESORT_DB_IMMUTABLE
+
         # --- Start Background Threads ---
         print("BOOT: Starting background threads...")
         
-        # GPS Poller Thread
-        gps_thread = threading.Thread(target=gps_handler.gps_poller, args=(gps_queue,), daemon=True)
+        # GPS Poller Thread (live gpsd, or a recorded track if one is configured)
+        gps_source = gps_sources.open_source(variables.GPS_REPLAY_FILE, variables.GPS_REPLAY_SPEED, variables.GPS_RATE_HZ)
+        gps_thread = threading.Thread(target=gps_handler.gps_poller, args=(gps_broadcaster, gps_source), daemon=True)
         gps_thread.start()
         
         # Trip Logger Thread
         trip_logger_stop_event = threading.Event()
         stop_events.append(trip_logger_stop_event)
-        logger_thread = threading.Thread(target=trip_logger.trip_logger_thread, args=(gps_data, data_lock, trip_logger_stop_event), daemon=True)
+        logger_thread = threading.Thread(target=trip_logger.trip_logger_thread, args=(logger_gps_queue, trip_logger_stop_event), daemon=True)
         logger_thread.start()
         
         # Weather Handler Thread
@@ -67,7 +75,7 @@ if __name__ == '__main__':
         # --- Hand off to Main Application ---
         print("BOOT: Starting main application...")
         # Pass the already-initialized UI manager to the main app
-        main_app.main(disp, gps_queue, gps_data, data_lock, ui)
+        main_app.main(disp, gps_queue, gps_data, data_lock, ui, recorder_gps_queue)
 
     except IOError as e:
         print(f"FATAL: Could not initialize display. Check wiring. Error: {e}")
@@ -1,7 +1,8 @@
 import os
 import sqlite3
 from flask import Flask, render_template_string, request, abort
-from datetime import datetime
+from datetime import datetime, timezone
+import track_codec
 
 # --- Configuration ---
 LOG_DIRECTORY = 'daily_logs'
@@ -29,31 +30,27 @@ def get_available_logs():
     return sorted(log_files, key=lambda x: x['date'], reverse=True)
 
 def get_log_data(db_filename):
-    """Fetches all trip log entries from a specific daily database file."""
+    """Fetches a daily database's whole track as TrackPoint records (either storage format)."""
     db_path = os.path.join(LOG_DIRECTORY, db_filename)
     if not os.path.exists(db_path):
         return None
 
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Check if the table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='trip_log'")
-        if cursor.fetchone() is None:
-            return [] # Return empty list if table doesn't exist
-
-        cursor.execute("SELECT timestamp, lat, lon, alt, speed FROM trip_log ORDER BY timestamp ASC")
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
-    except sqlite3.Error as e:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        return [track_codec.TrackPoint(*row) for row in track_codec.load_track(conn).tolist()]
+    except (sqlite3.Error, track_codec.TrackFormatError) as e:
         print(f"Database error reading {db_filename}: {e}")
         return None
     finally:
         if conn:
             conn.close()
 
+@app.template_filter('utc_time')
+def utc_time(fix_time):
+    """Formats a track point's Unix time the way trip_log stores it (UTC)."""
+    return datetime.fromtimestamp(fix_time, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
 # --- HTML Template ---
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -108,7 +105,7 @@ HTML_TEMPLATE = """
                 <tbody>
                 {% for entry in selected_log_data %}
                     <tr>
-                        <td>{{ entry.timestamp.split('.')[0] }}</td>
+                        <td>{{ entry.time|utc_time }}</td>
                         <td>{{ "%.5f"|format(entry.lat) }}</td>
                         <td>{{ "%.5f"|format(entry.lon) }}</td>
                         <td>{{ "%.1f"|format(entry.alt) }}</td>
@@ -1,152 +1,608 @@
 import sqlite3
 import os
+import time
+import threading
+from contextlib import contextmanager
 from datetime import date
 
 # --- Configuration ---
 DB_FILE = 'skidata.db'
 LOG_DIRECTORY = 'daily_logs'
+# Open the resort DB with SQLite's immutable flag for reads (no locking or
+# change detection at all). Only safe when nothing else (e.g. web_manager)
+# edits skidata.db while the goggles are running; boot.py sets this from
+# variables.RESORT_DB_IMMUTABLE.
+RESORT_DB_IMMUTABLE = False
+STATEMENT_CACHE_SIZE = 256 # Prepared statements kept per connection
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",       # Readers never block the writer (and vice versa)
+    "PRAGMA synchronous=NORMAL",     # Durable at checkpoints; WAL keeps the DB consistent
+    "PRAGMA cache_size=-8000",       # 8 MB page cache
+    "PRAGMA mmap_size=67108864",     # Read through a 64 MB memory map instead of read()
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",        # Enforce the join tables' references (and their cascades)
+)
 
-# --- Helper Functions ---
-def execute_query(db_path, query, params=(), fetchone=False, fetchall=False, commit=False):
-    """A centralized function to execute database queries against a specific DB file."""
-    conn = sqlite3.connect(db_path, timeout=10)
+# --- Connection Management ---
+# Each thread keeps one persistent connection per DB file (sqlite3 connections
+# must not be shared between threads). Python's sqlite3 module caches the
+# prepared statement for every SQL string it sees on a connection, so keeping
+# connections open also gives us statement caching for free.
+_local = threading.local()
+_resort_generation = 0 # Bumped after every resort write (immutable readers reopen, ResortModel reloads)
+
+def _open_connection(db_path, read_only):
+    if read_only:
+        conn = sqlite3.connect(f"file:{db_path}?immutable=1", uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        conn = sqlite3.connect(db_path, timeout=10, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    return conn
+
+def get_connection(db_path, read_only=False):
+    """Returns this thread's persistent connection to db_path, opening it on first use."""
+    connections = _local.__dict__.setdefault('connections', {})
+    read_only = read_only and RESORT_DB_IMMUTABLE and db_path == DB_FILE
+    key = (db_path, read_only)
+    entry = connections.get(key)
+    if entry and (not read_only or entry[1] == _resort_generation):
+        return entry[0]
+    if entry: entry[0].close()
+    conn = _open_connection(db_path, read_only)
+    connections[key] = (conn, _resort_generation)
+    return conn
+
+def close_thread_connections():
+    """Closes every connection opened by the calling thread."""
+    for conn, _ in _local.__dict__.pop('connections', {}).values():
+        conn.close()
+
+def _after_resort_write(conn):
+    global _resort_generation
+    if RESORT_DB_IMMUTABLE:
+        # Immutable readers ignore the WAL, so fold it into the main file first.
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    _resort_generation += 1
+
+def get_resort_generation():
+    """Counts this process's writes to skidata.db."""
+    return _resort_generation
+
+_version_connection = None # (db_path, connection) used only for PRAGMA data_version
+_version_lock = threading.Lock()
+
+def get_resort_data_version():
+    """
+    SQLite's data_version for skidata.db as seen by one dedicated connection.
+    It changes whenever any other connection commits, including other
+    processes such as web_manager.
+    """
+    global _version_connection
+    with _version_lock:
+        if _version_connection is None or _version_connection[0] != DB_FILE:
+            if _version_connection: _version_connection[1].close()
+            _version_connection = (DB_FILE, sqlite3.connect(DB_FILE, check_same_thread=False))
+        return _version_connection[1].execute("PRAGMA data_version").fetchone()[0]
+
+@contextmanager
+def transaction(db_path):
+    """
+    Runs several statements as one transaction on this thread's connection:
+
+        with db_manager.transaction(db_manager.DB_FILE) as conn:
+            conn.execute(...)
+
+    Commits on success and rolls back on any exception. execute_query calls
+    made inside the block join the transaction instead of committing.
+    """
+    open_transactions = _local.__dict__.setdefault('transactions', set())
+    conn = get_connection(db_path)
+    if db_path in open_transactions: # Nested: join the outer transaction
+        yield conn
+        return
+    open_transactions.add(db_path)
     try:
-        cursor.execute(query, params)
-        if commit: conn.commit()
-        result = None
-        if fetchone: result = cursor.fetchone()
-        elif fetchall: result = cursor.fetchall()
-        return result
+        conn.execute("BEGIN")
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
     finally:
-        conn.close()
+        open_transactions.discard(db_path)
+    if db_path == DB_FILE: _after_resort_write(conn)
+
+# --- Helper Functions ---
+def execute_query(db_path, query, params=(), fetchone=False, fetchall=False, commit=False):
+    """A centralized function to execute database queries against a specific DB file."""
+    in_transaction = db_path in _local.__dict__.get('transactions', ())
+    conn = get_connection(db_path, read_only=not commit and not in_transaction)
+    cursor = conn.execute(query, params)
+    if not in_transaction:
+        if commit:
+            conn.commit()
+            if db_path == DB_FILE: _after_resort_write(conn)
+        elif conn.in_transaction:
+            conn.rollback() # Uncommitted writes were never kept; don't leave them pending
+    result = None
+    if fetchone: result = cursor.fetchone()
+    elif fetchall: result = cursor.fetchall()
+    return result
 
 # --- Main DB (skidata.db) Functions ---
-def setup_database():
-    """Sets up the initial database schema for the main, persistent resort data."""
-    # trip_log table creation is removed from this central database.
-    execute_query(DB_FILE, '''
-    CREATE TABLE IF NOT EXISTS waypoints (
+# The ordered contents of runs and routes live in join tables rather than in
+# comma-separated TEXT columns, so SQLite can index and join on them. Deleting a
+# waypoint removes it from every run, and deleting a run removes it from every
+# route, through the ON DELETE CASCADE references.
+RUN_LIFT_COLUMNS = "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, type TEXT NOT NULL, difficulty TEXT NOT NULL"
+ROUTES_COLUMNS = "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, end_area TEXT, difficulty TEXT"
+RESORT_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS waypoints (
         id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE,
         lat REAL, lon REAL, alt REAL NOT NULL, type TEXT DEFAULT 'junction'
-    )''')
-    execute_query(DB_FILE, '''
-    CREATE TABLE IF NOT EXISTS run_lift (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE,
-        waypoints TEXT NOT NULL, type TEXT NOT NULL, difficulty TEXT NOT NULL
-    )''')
-    execute_query(DB_FILE, '''
-    CREATE TABLE IF NOT EXISTS routes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE,
-        runs TEXT NOT NULL, end_area TEXT, difficulty TEXT
-    )''')
-    execute_query(DB_FILE, '''
-    CREATE TABLE IF NOT EXISTS personal_bests (
-        run_id INTEGER PRIMARY KEY, best_time_seconds REAL NOT NULL,
-        FOREIGN KEY (run_id) REFERENCES run_lift (id)
-    )''')
+    )""",
+    f"CREATE TABLE IF NOT EXISTS run_lift ({RUN_LIFT_COLUMNS})",
+    f"CREATE TABLE IF NOT EXISTS routes ({ROUTES_COLUMNS})",
+    """CREATE TABLE IF NOT EXISTS run_waypoints (
+        run_id INTEGER NOT NULL REFERENCES run_lift (id) ON DELETE CASCADE,
+        seq INTEGER NOT NULL,
+        waypoint_id INTEGER NOT NULL REFERENCES waypoints (id) ON DELETE CASCADE,
+        PRIMARY KEY (run_id, seq)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_run_waypoints_waypoint ON run_waypoints (waypoint_id)",
+    """CREATE TABLE IF NOT EXISTS route_runs (
+        route_id INTEGER NOT NULL REFERENCES routes (id) ON DELETE CASCADE,
+        seq INTEGER NOT NULL,
+        run_id INTEGER NOT NULL REFERENCES run_lift (id) ON DELETE CASCADE,
+        PRIMARY KEY (route_id, seq)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_route_runs_run ON route_runs (run_id)",
+)
+
+def _table_columns(conn, table):
+    return {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _move_id_list_column(conn, table, columns, list_column, join_table, owner_column, item_column, valid_ids):
+    """
+    Copies a legacy comma-separated id column into its join table, then rebuilds
+    the table without it (SQLite's create/copy/drop/rename procedure). Ids that
+    no longer exist are dropped; returns (rows written, ids dropped).
+    """
+    written, dropped = 0, 0
+    for row in conn.execute(f"SELECT id, {list_column} FROM {table}").fetchall():
+        item_ids = [int(item_id) for item_id in (row[list_column] or '').split(',') if item_id.strip()]
+        kept = [item_id for item_id in item_ids if item_id in valid_ids]
+        dropped += len(item_ids) - len(kept)
+        conn.executemany(f"INSERT OR REPLACE INTO {join_table} ({owner_column}, seq, {item_column}) VALUES (?, ?, ?)",
+                         [(row['id'], seq, item_id) for seq, item_id in enumerate(kept)])
+        written += len(kept)
+
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    keep = ', '.join(column.split()[0] for column in columns.split(', '))
+    conn.execute(f"CREATE TABLE {table}_new ({columns})")
+    conn.execute(f"INSERT INTO {table}_new ({keep}) SELECT {keep} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    if sequence: # Don't hand out ids of deleted rows again
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence['seq'], table))
+    return written, dropped
+
+def migrate_resort_schema(db_path=None):
+    """
+    Creates any missing resort tables and migrates a skidata.db in place from
+    the old layout (comma-separated run_lift.waypoints / routes.runs columns,
+    no waypoints.type, a personal_bests table, now moved to the personal bests
+    database). Safe to run on every start; returns True if anything had to be
+    migrated.
+    """
+    db_path = db_path or DB_FILE
+    conn = get_connection(db_path)
+    conn.execute("PRAGMA foreign_keys=OFF") # Required while tables are rebuilt; can't change inside a transaction
+    try:
+        with transaction(db_path) as conn:
+            legacy_runs = 'waypoints' in _table_columns(conn, 'run_lift')
+            legacy_routes = 'runs' in _table_columns(conn, 'routes')
+            waypoint_columns = _table_columns(conn, 'waypoints')
+            missing_type = bool(waypoint_columns) and 'type' not in waypoint_columns
+            legacy_bests = bool(_table_columns(conn, 'personal_bests'))
+            for statement in RESORT_SCHEMA:
+                conn.execute(statement)
+            if missing_type:
+                conn.execute("ALTER TABLE waypoints ADD COLUMN type TEXT DEFAULT 'junction'")
+            if legacy_runs:
+                waypoint_ids = {row['id'] for row in conn.execute("SELECT id FROM waypoints")}
+                written, dropped = _move_id_list_column(conn, 'run_lift', RUN_LIFT_COLUMNS, 'waypoints', 'run_waypoints', 'run_id', 'waypoint_id', waypoint_ids)
+                print(f"DB_MANAGER: Migrated {written} run waypoints to run_waypoints ({dropped} unknown ids dropped).")
+            if legacy_routes:
+                run_ids = {row['id'] for row in conn.execute("SELECT id FROM run_lift")}
+                written, dropped = _move_id_list_column(conn, 'routes', ROUTES_COLUMNS, 'runs', 'route_runs', 'route_id', 'run_id', run_ids)
+                print(f"DB_MANAGER: Migrated {written} route runs to route_runs ({dropped} unknown ids dropped).")
+            if legacy_bests:
+                # Copied before the drop commits, so an interrupted migration copies again (bests already there win).
+                rows = [tuple(row) for row in conn.execute("SELECT run_id, best_time_seconds FROM personal_bests")]
+                with transaction(_ensure_personal_bests_db(db_path)) as bests:
+                    bests.executemany("INSERT OR IGNORE INTO personal_bests (run_id, best_time_seconds) VALUES (?, ?)", rows)
+                conn.execute("DROP TABLE personal_bests")
+                print(f"DB_MANAGER: Moved {len(rows)} personal bests to {get_personal_bests_path(db_path)}.")
+            violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise sqlite3.IntegrityError(f"Migration left {len(violations)} broken references, e.g. {tuple(violations[0])}")
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+    return legacy_runs or legacy_routes or missing_type or legacy_bests
+
+def setup_database():
+    """Sets up (or migrates) the schema for the main, persistent resort data."""
+    migrate_resort_schema(DB_FILE)
+    _ensure_personal_bests_db()
     print("DB_MANAGER: Main database setup/verification complete.")
 
 def add_waypoint(name, lat, lon, alt):
     execute_query(DB_FILE, "INSERT INTO waypoints (name, lat, lon, alt) VALUES (?, ?, ?, ?)", (name, lat, lon, alt), commit=True)
-# ... (All other functions that modify skidata.db remain the same, but now pass DB_FILE)
 def add_run_lift(name, waypoint_ids, run_type, difficulty):
-    waypoints_str = ','.join(map(str, waypoint_ids))
-    execute_query(DB_FILE, "INSERT INTO run_lift (name, waypoints, type, difficulty) VALUES (?, ?, ?, ?)", (name, waypoints_str, run_type, difficulty), commit=True)
+    with transaction(DB_FILE) as conn:
+        run_id = conn.execute("INSERT INTO run_lift (name, type, difficulty) VALUES (?, ?, ?)", (name, run_type, difficulty)).lastrowid
+        conn.executemany("INSERT INTO run_waypoints (run_id, seq, waypoint_id) VALUES (?, ?, ?)",
+                         [(run_id, seq, wp_id) for seq, wp_id in enumerate(waypoint_ids)])
+    return run_id
 def add_route(name, run_ids, end_area, difficulty):
-    runs_str = ','.join(map(str, run_ids))
-    execute_query(DB_FILE, "INSERT INTO routes (name, runs, end_area, difficulty) VALUES (?, ?, ?, ?)", (name, runs_str, end_area, difficulty), commit=True)
+    with transaction(DB_FILE) as conn:
+        route_id = conn.execute("INSERT INTO routes (name, end_area, difficulty) VALUES (?, ?, ?)", (name, end_area, difficulty)).lastrowid
+        conn.executemany("INSERT INTO route_runs (route_id, seq, run_id) VALUES (?, ?, ?)",
+                         [(route_id, seq, run_id) for seq, run_id in enumerate(run_ids)])
+    return route_id
 def delete_waypoint(wp_id):
     execute_query(DB_FILE, "DELETE FROM waypoints WHERE id = ?", (wp_id,), commit=True)
 def delete_run_lift(run_id):
     execute_query(DB_FILE, "DELETE FROM run_lift WHERE id = ?", (run_id,), commit=True)
-    execute_query(DB_FILE, "DELETE FROM personal_bests WHERE run_id = ?", (run_id,), commit=True)
+    execute_query(_ensure_personal_bests_db(), "DELETE FROM personal_bests WHERE run_id = ?", (run_id,), commit=True)
 def delete_route(route_id):
     execute_query(DB_FILE, "DELETE FROM routes WHERE id = ?", (route_id,), commit=True)
 def update_waypoint(wp_id, name, lat, lon, alt):
     execute_query(DB_FILE, "UPDATE waypoints SET name=?, lat=?, lon=?, alt=? WHERE id=?", (name, lat, lon, alt, wp_id), commit=True)
-def get_personal_best(run_id):
-    result = execute_query(DB_FILE, "SELECT best_time_seconds FROM personal_bests WHERE run_id = ?", (run_id,), fetchone=True)
-    return result['best_time_seconds'] if result else None
-def update_personal_best(run_id, new_time):
-    execute_query(DB_FILE, "INSERT OR REPLACE INTO personal_bests (run_id, best_time_seconds) VALUES (?, ?)", (run_id, new_time), commit=True)
 def get_all_waypoints():
     rows = execute_query(DB_FILE, "SELECT * FROM waypoints ORDER BY name", fetchall=True)
     return [dict(row) for row in rows]
+
+def _ordered_lists(query, params=()):
+    """Groups (owner id, item) rows, already ordered by owner and seq, into {owner id: [items]}."""
+    lists = {}
+    for owner_id, item in execute_query(DB_FILE, query, params, fetchall=True):
+        lists.setdefault(owner_id, []).append(item)
+    return lists
+
 def get_all_runs_structured():
     rows = execute_query(DB_FILE, "SELECT * FROM run_lift ORDER BY name", fetchall=True)
+    waypoint_lists = _ordered_lists("SELECT run_id, waypoint_id FROM run_waypoints ORDER BY run_id, seq")
     runs = [dict(row) for row in rows]
-    for run in runs: run['waypoints_list'] = [int(wp_id) for wp_id in run['waypoints'].split(',') if wp_id]
+    for run in runs: run['waypoints_list'] = waypoint_lists.get(run['id'], [])
     return runs
 def get_all_routes_structured():
     rows = execute_query(DB_FILE, "SELECT * FROM routes ORDER BY name", fetchall=True)
+    run_lists = _ordered_lists("SELECT route_id, run_id FROM route_runs ORDER BY route_id, seq")
     routes = [dict(row) for row in rows]
-    for route in routes: route['runs_list'] = [int(r_id) for r_id in route['runs'].split(',') if r_id]
+    for route in routes: route['runs_list'] = run_lists.get(route['id'], [])
     return routes
+
 def get_route_by_id(route_id):
     row = execute_query(DB_FILE, "SELECT * FROM routes WHERE id = ?", (route_id,), fetchone=True)
-    return dict(row) if row else None
-def get_waypoints_for_route(route_id):
-    route_row = execute_query(DB_FILE, "SELECT runs FROM routes WHERE id = ?", (route_id,), fetchone=True)
-    if not route_row: return []
-    run_ids_ordered = [int(rid) for rid in route_row['runs'].split(',')]
+    if not row: return None
+    route = dict(row)
+    route['runs_list'] = _ordered_lists("SELECT route_id, run_id FROM route_runs WHERE route_id = ? ORDER BY seq", (route['id'],)).get(route['id'], [])
+    return route
+
+def get_route_with_waypoints(route_id):
+    """
+    Returns (route, ordered waypoint dicts) using two queries: the route, and
+    one join over route_runs -> run_waypoints -> waypoints. Waypoints shared by
+    consecutive runs appear once.
+    """
+    route = get_route_by_id(route_id)
+    if not route: return None, []
+    rows = execute_query(DB_FILE, """
+        SELECT w.* FROM route_runs rr
+        JOIN run_waypoints rw ON rw.run_id = rr.run_id
+        JOIN waypoints w ON w.id = rw.waypoint_id
+        WHERE rr.route_id = ? ORDER BY rr.seq, rw.seq""", (route_id,), fetchall=True)
+
     final_waypoints = []
     processed_wp_ids = set()
-    for run_id in run_ids_ordered:
-        run_row = execute_query(DB_FILE, "SELECT waypoints FROM run_lift WHERE id = ?", (run_id,), fetchone=True)
-        if not run_row: continue
-        waypoint_ids_ordered = [int(wp_id) for wp_id in run_row['waypoints'].split(',')]
-        for wp_id in waypoint_ids_ordered:
-            if wp_id not in processed_wp_ids:
-                wp_row = execute_query(DB_FILE, "SELECT * FROM waypoints WHERE id = ?", (wp_id,), fetchone=True)
-                if wp_row: final_waypoints.append(dict(wp_row)); processed_wp_ids.add(wp_id)
-    return final_waypoints
+    for row in rows:
+        if row['id'] not in processed_wp_ids:
+            final_waypoints.append(dict(row)); processed_wp_ids.add(row['id'])
+    return route, final_waypoints
+
+def get_waypoints_for_route(route_id):
+    return get_route_with_waypoints(route_id)[1]
+
+def get_runs_using_waypoint(wp_id):
+    rows = execute_query(DB_FILE, """
+        SELECT DISTINCT r.* FROM run_waypoints rw JOIN run_lift r ON r.id = rw.run_id
+        WHERE rw.waypoint_id = ? ORDER BY r.name""", (wp_id,), fetchall=True)
+    return [dict(row) for row in rows]
+
+def get_routes_using_run(run_id):
+    rows = execute_query(DB_FILE, """
+        SELECT DISTINCT ro.* FROM route_runs rr JOIN routes ro ON ro.id = rr.route_id
+        WHERE rr.run_id = ? ORDER BY ro.name""", (run_id,), fetchall=True)
+    return [dict(row) for row in rows]
 
+def get_run_waypoint_names():
+    """{run id: [waypoint names in order]} for every run."""
+    return _ordered_lists("""
+        SELECT rw.run_id, w.name FROM run_waypoints rw JOIN waypoints w ON w.id = rw.waypoint_id
+        ORDER BY rw.run_id, rw.seq""")
+
+def get_route_run_names():
+    """{route id: [run names in order]} for every route."""
+    return _ordered_lists("""
+        SELECT rr.route_id, r.name FROM route_runs rr JOIN run_lift r ON r.id = rr.run_id
+        ORDER BY rr.route_id, rr.seq""")
+
+def get_route_start_waypoint_names():
+    """{route id: name of the first waypoint of its first run}."""
+    rows = execute_query(DB_FILE, """
+        SELECT rr.route_id, w.name FROM route_runs rr
+        JOIN run_waypoints rw ON rw.run_id = rr.run_id
+        JOIN waypoints w ON w.id = rw.waypoint_id
+        WHERE rr.seq = (SELECT MIN(seq) FROM route_runs WHERE route_id = rr.route_id)
+          AND rw.seq = (SELECT MIN(seq) FROM run_waypoints WHERE run_id = rr.run_id)""", fetchall=True)
+    return {route_id: name for route_id, name in rows}
+
+def get_run_names_by_segment():
+    """{(waypoint id, next waypoint id): run name} for every consecutive pair of waypoints in a run."""
+    rows = execute_query(DB_FILE, """
+        SELECT waypoint_id, next_id, name FROM (
+            SELECT rw.waypoint_id, r.name,
+                   LEAD(rw.waypoint_id) OVER (PARTITION BY rw.run_id ORDER BY rw.seq) AS next_id
+            FROM run_waypoints rw JOIN run_lift r ON r.id = rw.run_id
+        ) WHERE next_id IS NOT NULL""", fetchall=True)
+    return {(wp_id, next_id): name for wp_id, next_id, name in rows}
+
+
+# --- Personal Bests DB ---
+# Personal bests (and the best run's track, for ghost racing; see ghost.py)
+# are written in the middle of a ski day, so they're kept out of skidata.db:
+# any commit there counts as a resort edit (bumping the generation and
+# SQLite's data_version) and reloads the ResortModel with all its derived
+# data. They live beside it in skidata.bests.db instead, keyed on run id.
+PERSONAL_BESTS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS personal_bests (
+        run_id INTEGER PRIMARY KEY, best_time_seconds REAL NOT NULL,
+        track BLOB -- The best run's track (a track_codec chunk)
+    )""",
+)
+_personal_bests_set_up = set()
+
+def get_personal_bests_path(resort_db_path=None):
+    return f"{os.path.splitext(resort_db_path or DB_FILE)[0]}.bests.db"
+
+def _ensure_personal_bests_db(resort_db_path=None):
+    """Creates the personal bests database beside a resort database on first use; returns its path."""
+    db_path = get_personal_bests_path(resort_db_path)
+    if db_path in _personal_bests_set_up: return db_path
+    with transaction(db_path) as conn:
+        for statement in PERSONAL_BESTS_SCHEMA:
+            conn.execute(statement)
+    _personal_bests_set_up.add(db_path)
+    return db_path
+
+def get_personal_best(run_id):
+    result = execute_query(_ensure_personal_bests_db(), "SELECT best_time_seconds FROM personal_bests WHERE run_id = ?", (run_id,), fetchone=True)
+    return result['best_time_seconds'] if result else None
+def get_personal_best_track(run_id):
+    """(best time in seconds, track BLOB or None) for a run, or None if it has no personal best yet."""
+    result = execute_query(_ensure_personal_bests_db(), "SELECT best_time_seconds, track FROM personal_bests WHERE run_id = ?", (run_id,), fetchone=True)
+    return (result['best_time_seconds'], result['track']) if result else None
+def update_personal_best(run_id, new_time, track=None):
+    execute_query(_ensure_personal_bests_db(), "INSERT OR REPLACE INTO personal_bests (run_id, best_time_seconds, track) VALUES (?, ?, ?)",
+                  (run_id, new_time, track), commit=True)
+def clear_personal_bests():
+    """Forgets every personal best (run ids change when the resort is re-imported)."""
+    execute_query(_ensure_personal_bests_db(), "DELETE FROM personal_bests", commit=True)
 
 # --- Daily Log DB Functions ---
+# Writers to today's log (trip logger, run logging) bump this version so that
+# readers such as screen_cache know when their copies are stale.
+_daily_log_version = 0
+_daily_log_changed = threading.Condition()
+
+def notify_daily_log_changed():
+    """Call after committing new data to a daily log DB."""
+    global _daily_log_version
+    with _daily_log_changed:
+        _daily_log_version += 1
+        _daily_log_changed.notify_all()
+
+def get_daily_log_version():
+    return _daily_log_version
+
+def wait_for_daily_log_change(known_version, timeout):
+    """Blocks until the daily log version differs from known_version (or timeout), then returns it."""
+    with _daily_log_changed:
+        _daily_log_changed.wait_for(lambda: _daily_log_version != known_version, timeout)
+        return _daily_log_version
+
 def get_daily_db_path():
     """Returns the path for today's database file."""
     today_str = date.today().strftime('%Y-%m-%d')
     return os.path.join(LOG_DIRECTORY, f"{today_str}.db")
 
-def get_performance_profile_from_log():
-    """Calculates the time spent in different speed zones from today's log."""
-    db_path = get_daily_db_path()
-    if not os.path.exists(db_path): return {}
-    
-    # Speed is in m/s in the log. 15kph ~= 4.2m/s, 40kph ~= 11.1m/s
-    query = """
-    SELECT
-        SUM(CASE WHEN speed < 4.2 THEN 5 ELSE 0 END) AS relaxed_time,
-        SUM(CASE WHEN speed >= 4.2 AND speed < 11.1 THEN 5 ELSE 0 END) AS cruising_time,
-        SUM(CASE WHEN speed >= 11.1 THEN 5 ELSE 0 END) AS aggressive_time
-    FROM trip_log
+# Completed runs go into run_log. day_summary holds a single row (id = 1)
+# that is updated in the same transaction as every run_log insert, so the
+# ACHIEVEMENTS, STATS and LOGBOOK pages read a fixed number of rows instead of
+# aggregating over tables that grow all day. trip_summary is the same idea
+# for the trip logger's running totals (see trip_logger.TripAggregates),
+# including the state needed to carry on after a restart.
+DAILY_LOG_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS trip_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        alt REAL NOT NULL,
+        speed REAL NOT NULL
+    )""",
+    # The chunked alternative to trip_log (see track_codec), one row per minute.
+    """CREATE TABLE IF NOT EXISTS track_chunks (
+        minute INTEGER PRIMARY KEY,
+        point_count INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS run_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id INTEGER, run_name TEXT NOT NULL,
+        start_time REAL, end_time REAL NOT NULL,
+        duration_seconds REAL NOT NULL, vertical_m REAL NOT NULL, top_speed_kph REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS day_summary (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        run_count INTEGER NOT NULL DEFAULT 0,
+        total_run_seconds REAL NOT NULL DEFAULT 0,
+        total_run_vertical_m REAL NOT NULL DEFAULT 0,
+        top_speed_kph REAL NOT NULL DEFAULT 0,
+        longest_run_id INTEGER REFERENCES run_log (id),
+        biggest_vertical_run_id INTEGER REFERENCES run_log (id),
+        fastest_run_id INTEGER REFERENCES run_log (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS trip_summary (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        descent_m REAL NOT NULL DEFAULT 0,
+        distance_m REAL NOT NULL DEFAULT 0,
+        top_speed_mps REAL NOT NULL DEFAULT 0,
+        moving_seconds REAL NOT NULL DEFAULT 0,
+        relaxed_seconds REAL NOT NULL DEFAULT 0,
+        cruising_seconds REAL NOT NULL DEFAULT 0,
+        aggressive_seconds REAL NOT NULL DEFAULT 0,
+        last_time REAL, last_lat REAL, last_lon REAL, last_alt REAL, last_speed REAL, reference_alt REAL
+    )""",
+)
+_daily_dbs_set_up = set()
+
+def setup_daily_db(cursor):
+    """Creates the daily log tables on a cursor or connection to a daily database."""
+    for statement in DAILY_LOG_SCHEMA:
+        cursor.execute(statement)
+
+def _ensure_daily_db(db_path):
+    if db_path in _daily_dbs_set_up: return
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    with transaction(db_path) as conn:
+        setup_daily_db(conn)
+    _daily_dbs_set_up.add(db_path)
+
+def _has_daily_table(db_path, table):
+    """True if today's log exists and has the table (older logs only have trip_log)."""
+    if not os.path.exists(db_path): return False
+    return execute_query(db_path, "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,), fetchone=True) is not None
+
+def log_completed_run(analytics):
+    """
+    Appends a completed run (the analytics dict from mapper.update_position) to
+    today's run_log and folds it into day_summary, in one transaction.
     """
-    profile = execute_query(db_path, query, fetchone=True)
-    return dict(profile) if profile else {}
-
-def get_bests_from_daily_log():
-    """Finds the day's best stats from the 'run_log' table in the daily DB."""
-    # This requires that run analytics are also logged to the daily DB.
-    # We will need to add a run_log table to the daily DB schema.
-    # For now, this is a placeholder. A more complete implementation is needed
-    # in mapper.py and trip_logger.py to log completed runs.
-    return {
-        'longest_run': {'run_name': 'Placeholder', 'duration_seconds': 185},
-        'biggest_drop': {'run_name': 'Placeholder', 'vertical_m': 250},
-        'fastest_run': {'run_name': 'Placeholder', 'top_speed_kph': 65.2},
+    db_path = get_daily_db_path()
+    _ensure_daily_db(db_path)
+    record = {
+        'run_id': analytics.get('run_id'), 'run_name': analytics.get('run_name') or 'Run',
+        'start_time': analytics.get('start_time'), 'end_time': analytics.get('end_time') or time.time(),
+        'duration_seconds': analytics.get('duration_seconds') or 0.0,
+        'vertical_m': analytics.get('vertical_m') or 0.0,
+        'top_speed_kph': analytics.get('top_speed_kph') or 0.0,
     }
+    with transaction(db_path) as conn:
+        record['id'] = conn.execute("""
+            INSERT INTO run_log (run_id, run_name, start_time, end_time, duration_seconds, vertical_m, top_speed_kph)
+            VALUES (:run_id, :run_name, :start_time, :end_time, :duration_seconds, :vertical_m, :top_speed_kph)""", record).lastrowid
+        conn.execute("""
+            INSERT INTO day_summary (id, run_count, total_run_seconds, total_run_vertical_m, top_speed_kph,
+                                     longest_run_id, biggest_vertical_run_id, fastest_run_id)
+            VALUES (1, 1, :duration_seconds, :vertical_m, :top_speed_kph, :id, :id, :id)
+            ON CONFLICT (id) DO UPDATE SET
+                run_count = run_count + 1,
+                total_run_seconds = total_run_seconds + excluded.total_run_seconds,
+                total_run_vertical_m = total_run_vertical_m + excluded.total_run_vertical_m,
+                top_speed_kph = MAX(top_speed_kph, excluded.top_speed_kph),
+                longest_run_id = CASE WHEN :duration_seconds > COALESCE((SELECT duration_seconds FROM run_log WHERE id = longest_run_id), -1)
+                                      THEN :id ELSE longest_run_id END,
+                biggest_vertical_run_id = CASE WHEN :vertical_m > COALESCE((SELECT vertical_m FROM run_log WHERE id = biggest_vertical_run_id), -1)
+                                               THEN :id ELSE biggest_vertical_run_id END,
+                fastest_run_id = CASE WHEN :top_speed_kph > COALESCE((SELECT top_speed_kph FROM run_log WHERE id = fastest_run_id), -1)
+                                      THEN :id ELSE fastest_run_id END""", record)
+    notify_daily_log_changed()
+    return record['id']
+
+def _trip_summary_row(db_path):
+    if not _has_daily_table(db_path, 'trip_summary'): return None
+    return execute_query(db_path, "SELECT * FROM trip_summary WHERE id = 1", fetchone=True)
+
+def get_performance_profile_from_log():
+    """Time in seconds spent in each speed zone today (relaxed < 15 kph <= cruising < 40 kph <= aggressive)."""
+    row = _trip_summary_row(get_daily_db_path())
+    if not row: return {}
+    return {'relaxed_time': row['relaxed_seconds'], 'cruising_time': row['cruising_seconds'], 'aggressive_time': row['aggressive_seconds']}
+
+# --- Screen Data (used by the ACHIEVEMENTS, STATS and LOGBOOK pages via screen_cache) ---
+def get_days_bests():
+    """Today's longest, biggest-vertical and fastest runs, each None until a run is logged."""
+    bests = {'longest_run': None, 'biggest_vertical': None, 'fastest_run': None}
+    db_path = get_daily_db_path()
+    if not _has_daily_table(db_path, 'day_summary'): return bests
+    row = execute_query(db_path, """
+        SELECT l.run_name AS longest_name, l.duration_seconds,
+               v.run_name AS vertical_name, v.vertical_m,
+               f.run_name AS fastest_name, f.top_speed_kph
+        FROM day_summary s
+        LEFT JOIN run_log l ON l.id = s.longest_run_id
+        LEFT JOIN run_log v ON v.id = s.biggest_vertical_run_id
+        LEFT JOIN run_log f ON f.id = s.fastest_run_id
+        WHERE s.id = 1""", fetchone=True)
+    if row:
+        if row['longest_name'] is not None:
+            bests['longest_run'] = {'run_name': row['longest_name'], 'duration_seconds': row['duration_seconds']}
+        if row['vertical_name'] is not None:
+            bests['biggest_vertical'] = {'run_name': row['vertical_name'], 'vertical_m': row['vertical_m']}
+        if row['fastest_name'] is not None:
+            bests['fastest_run'] = {'run_name': row['fastest_name'], 'top_speed_kph': row['top_speed_kph']}
+    return bests
 
-def get_todays_stats_from_daily_log():
-    """Calculates summary stats from today's trip_log."""
+def get_trip_summary():
+    """
+    Today's totals: vertical descended, distance, moving time and top speed
+    from the trip logger's trip_summary, plus run count and run time from
+    day_summary.
+    """
+    summary = {'run_count': 0, 'total_run_seconds': 0, 'total_vertical_m': 0, 'top_speed_kph': 0,
+               'distance_km': 0, 'moving_seconds': 0}
     db_path = get_daily_db_path()
-    if not os.path.exists(db_path): return {'total_vertical_m': 0, 'top_speed_kph': 0}
-    
-    min_alt, max_alt = execute_query(db_path, "SELECT MIN(alt), MAX(alt) FROM trip_log", fetchone=True) or (0,0)
-    total_vertical_m = (max_alt - min_alt) if max_alt is not None and min_alt is not None else 0
-    top_speed_mps = (execute_query(db_path, "SELECT MAX(speed) FROM trip_log", fetchone=True) or [0])[0] or 0
-    top_speed_kph = top_speed_mps * 3.6
-    return {'total_vertical_m': total_vertical_m, 'top_speed_kph': top_speed_kph}
+    if _has_daily_table(db_path, 'day_summary'):
+        row = execute_query(db_path, "SELECT * FROM day_summary WHERE id = 1", fetchone=True)
+        if row:
+            summary.update({'run_count': row['run_count'], 'total_run_seconds': row['total_run_seconds'],
+                            'total_vertical_m': row['total_run_vertical_m'], 'top_speed_kph': row['top_speed_kph']})
+    trip = _trip_summary_row(db_path)
+    if trip:
+        summary['total_vertical_m'] = max(summary['total_vertical_m'], trip['descent_m'])
+        summary['top_speed_kph'] = max(summary['top_speed_kph'], trip['top_speed_mps'] * 3.6)
+        summary['distance_km'] = trip['distance_m'] / 1000
+        summary['moving_seconds'] = trip['moving_seconds']
+    return summary
 
+def get_run_log_entries():
+    """Returns today's completed runs, newest first, or [] if none have been logged."""
+    db_path = get_daily_db_path()
+    if not _has_daily_table(db_path, 'run_log'): return []
+    rows = execute_query(db_path, """
+        SELECT *, strftime('%H:%M', end_time, 'unixepoch', 'localtime') AS time
+        FROM run_log ORDER BY id DESC""", fetchall=True)
+    return [dict(row) for row in rows]
 
+if __name__ == '__main__':
+    # In-place migration of an existing resort DB: python db_manager.py [path/to/skidata.db]
+    import sys
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    if not os.path.exists(db_path): sys.exit(f"DB_MANAGER: {db_path} not found.")
+    changed = migrate_resort_schema(db_path)
+    print(f"DB_MANAGER: {db_path} {'migrated' if changed else 'already up to date'}.")
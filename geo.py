@@ -0,0 +1,132 @@
+"""
+Shared geodesy helpers for the whole project.
+
+The resort is small enough (a few km across) that the Earth can be treated as
+flat around it. LocalProjection maps lat/lon onto a local East-North-Up metre
+grid centred on a fixed origin, after which distance and bearing are a couple
+of multiplications instead of half a dozen trig calls.
+
+Accuracy against haversine_distance (the projection keeps the cosine of the
+origin latitude, so only the east-west scale drifts as you move north/south):
+    relative error <= tan(|lat0|) * |lat - lat0| (in radians) + ~1e-6
+At 45 deg N that is under 0.1% for points within 5 km north/south of the
+origin (under 1 cm on a 10 m proximity check), under 0.2% at 10 km and
+under 0.35% at MAX_ORIGIN_DISTANCE_METERS, beyond which the shared
+projection is re-centred.
+"""
+import math
+import numpy as np
+
+# --- Constants ---
+EARTH_RADIUS_METERS = 6371000
+METERS_PER_RADIAN = EARTH_RADIUS_METERS
+MAX_ORIGIN_DISTANCE_METERS = 20000 # Re-centre the shared projection beyond this.
+
+# --- Exact Spherical Formulas ---
+def haversine_distance(p1, p2):
+    """Calculates the great-circle distance in metres between two lat/lon points."""
+    lat1_rad, lon1_rad = math.radians(p1['lat']), math.radians(p1['lon'])
+    lat2_rad, lon2_rad = math.radians(p2['lat']), math.radians(p2['lon'])
+    dlon, dlat = lon2_rad - lon1_rad, lat2_rad - lat1_rad
+    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_METERS * c
+
+def calculate_heading(p1, p2):
+    """Calculates the initial bearing in degrees from point 1 to point 2."""
+    lat1_rad, lon1_rad = math.radians(p1['lat']), math.radians(p1['lon'])
+    lat2_rad, lon2_rad = math.radians(p2['lat']), math.radians(p2['lon'])
+    dLon = lon2_rad - lon1_rad
+    y = math.sin(dLon) * math.cos(lat2_rad)
+    x = math.cos(lat1_rad) * math.sin(lat2_rad) - math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dLon)
+    bearing = math.degrees(math.atan2(y, x))
+    return (bearing + 360) % 360
+
+# --- Local Tangent Plane ---
+class LocalProjection:
+    """
+    Equirectangular projection onto a local ENU grid in metres around an origin.
+    x is metres east of the origin, y metres north.
+    """
+    def __init__(self, origin_lat, origin_lon):
+        self.origin_lat = origin_lat
+        self.origin_lon = origin_lon
+        self.m_per_deg_lat = METERS_PER_RADIAN * math.pi / 180
+        self.m_per_deg_lon = self.m_per_deg_lat * math.cos(math.radians(origin_lat))
+
+    def to_xy(self, lat, lon):
+        """Projects a single lat/lon to (x, y) metres."""
+        return (lon - self.origin_lon) * self.m_per_deg_lon, (lat - self.origin_lat) * self.m_per_deg_lat
+
+    def to_xy_arrays(self, lats, lons):
+        """Projects arrays of lat/lon to NumPy arrays of x and y metres."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        return (lons - self.origin_lon) * self.m_per_deg_lon, (lats - self.origin_lat) * self.m_per_deg_lat
+
+    def to_latlon(self, x, y):
+        """Inverse of to_xy."""
+        return self.origin_lat + y / self.m_per_deg_lat, self.origin_lon + x / self.m_per_deg_lon
+
+    def distance(self, p1, p2):
+        """Planar distance in metres between two lat/lon dicts."""
+        dx = (p2['lon'] - p1['lon']) * self.m_per_deg_lon
+        dy = (p2['lat'] - p1['lat']) * self.m_per_deg_lat
+        return math.hypot(dx, dy)
+
+    def bearing(self, p1, p2):
+        """Grid bearing in degrees (0 = north, clockwise) from p1 to p2."""
+        dx = (p2['lon'] - p1['lon']) * self.m_per_deg_lon
+        dy = (p2['lat'] - p1['lat']) * self.m_per_deg_lat
+        return math.degrees(math.atan2(dx, dy)) % 360
+
+    def covers(self, lat, lon):
+        """True if the point is close enough to the origin for the documented accuracy."""
+        x, y = self.to_xy(lat, lon)
+        return x * x + y * y <= MAX_ORIGIN_DISTANCE_METERS ** 2
+
+_shared_projection = None
+
+def get_projection(lat, lon):
+    """
+    Returns the shared resort projection, creating it around the first point
+    seen (or re-centring it if the point is outside its accurate range).
+    Callers that cache projected coordinates should keep the projection object
+    they used alongside them.
+    """
+    global _shared_projection
+    if _shared_projection is None or not _shared_projection.covers(lat, lon):
+        _shared_projection = LocalProjection(lat, lon)
+    return _shared_projection
+
+def distance_m(p1, p2):
+    """Fast distance in metres between two nearby lat/lon dicts."""
+    return get_projection(p1['lat'], p1['lon']).distance(p1, p2)
+
+def bearing_deg(p1, p2):
+    """Fast bearing in degrees between two nearby lat/lon dicts."""
+    return get_projection(p1['lat'], p1['lon']).bearing(p1, p2)
+
+# --- Vectorized Kernels ---
+def one_to_many(x, y, xs, ys):
+    """Distances in metres from one projected point to arrays of projected points."""
+    return np.hypot(np.asarray(xs) - x, np.asarray(ys) - y)
+
+def many_to_many(xs1, ys1, xs2, ys2):
+    """(len(xs1), len(xs2)) matrix of distances in metres between two projected point sets."""
+    xs1, ys1 = np.asarray(xs1)[:, None], np.asarray(ys1)[:, None]
+    return np.hypot(xs1 - np.asarray(xs2)[None, :], ys1 - np.asarray(ys2)[None, :])
+
+def point_to_segments(x, y, xs0, ys0, xs1, ys1):
+    """Distances in metres from one projected point to arrays of segments (xs0, ys0) -> (xs1, ys1)."""
+    xs0, ys0 = np.asarray(xs0, dtype=np.float64), np.asarray(ys0, dtype=np.float64)
+    dx, dy = np.asarray(xs1) - xs0, np.asarray(ys1) - ys0
+    along = np.clip(((x - xs0) * dx + (y - ys0) * dy) / np.maximum(dx * dx + dy * dy, 1e-9), 0.0, 1.0)
+    return np.hypot(xs0 + along * dx - x, ys0 + along * dy - y)
+
+def haversine_one_to_many(lat, lon, lats, lons):
+    """Exact great-circle distances from one lat/lon to arrays of lat/lons."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lats2, lons2 = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    a = np.sin((lats2 - lat1) / 2)**2 + math.cos(lat1) * np.cos(lats2) * np.sin((lons2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
@@ -0,0 +1,129 @@
+"""
+Ghost racing against the personal best on a run.
+
+The best run's track is kept in the personal bests database (see
+db_manager.get_personal_best_track) as a single track_codec chunk, sampled
+every SAMPLE_SECONDS with times relative to the start of the race, so a few
+bytes per point. To race it, the ghost's points are projected onto the
+run's polyline once with a route_progress.ProgressTracker, giving a
+cumulative along-track distance for every ghost time. During the run the
+skier's own fixes are projected onto the same polyline, and the ghost's
+time at the skier's along-track position is a binary search (bisect) plus
+an interpolation, so each fix costs O(log n). gap_seconds is then the
+skier's race time minus the ghost's: positive means behind the PB, negative
+ahead.
+
+The race clock starts when the skier crosses START_LINE_METERS along the
+run (interpolated between fixes), not when the run became the next one on
+the route: the ride up and any wait at the top don't count, for the skier
+or the ghost. A run is only raced if it was joined within
+MAX_END_OFFSET_METERS of its start (a fix that far along starts the clock
+at once), and only becomes the new PB if it was also tracked to within as
+much of its end, so a run joined halfway down never replaces a real one.
+"""
+import bisect
+import time
+import db_manager
+import route_progress
+import track_codec
+
+# --- Configuration ---
+SAMPLE_SECONDS = 1.0          # Stored track resolution (the ghost is interpolated between samples)
+START_LINE_METERS = 5.0       # The race clock starts at this far along the run
+MAX_END_OFFSET_METERS = 30.0  # How close to both ends of the run a track must reach to count as complete
+
+class GhostTrack:
+    """A recorded run as parallel lists: along-track metres (non-decreasing) and seconds since the start."""
+    def __init__(self, waypoints, points):
+        """points are (seconds since start, lat, lon, alt, speed) rows, oldest first."""
+        tracker = route_progress.ProgressTracker(waypoints)
+        self.progress, self.times = [], []
+        for point in points:
+            if tracker.update({'lat': point[1], 'lon': point[2], 'time': point[0]}):
+                self.progress.append(tracker.progress_m); self.times.append(point[0])
+
+    def __len__(self):
+        return len(self.progress)
+
+    def time_at(self, progress_m):
+        """Seconds the ghost took to get progress_m along the run (None if it never got that far)."""
+        if not self.progress or progress_m > self.progress[-1]: return None
+        i = bisect.bisect_left(self.progress, progress_m)
+        if i == 0: return self.times[0]
+        before, after = self.progress[i - 1], self.progress[i]
+        fraction = (progress_m - before) / (after - before) if after > before else 1.0
+        return self.times[i - 1] + fraction * (self.times[i] - self.times[i - 1])
+
+class GhostRace:
+    """
+    One run of a route raced against its personal best (if it has one).
+    update() takes every fix of the run and returns the gap to the ghost in
+    seconds (None without a ghost or before the race has started);
+    finish() saves the race as the new PB if it beat the old one.
+    """
+    def __init__(self, run, waypoints):
+        self.run = run
+        self.tracker = route_progress.ProgressTracker(waypoints)
+        self.best_time, self.ghost = None, None
+        best = db_manager.get_personal_best_track(run['id'])
+        if best:
+            self.best_time = best[0]
+            if best[1]:
+                try:
+                    self.ghost = GhostTrack(waypoints, track_codec.decode_chunk(best[1]).tolist())
+                except track_codec.TrackFormatError as e:
+                    print(f"GHOST: Ignoring the unreadable PB track of '{run['name']}': {e}")
+        self.joined = None     # False if the run was joined too far down to be raced
+        self.last_fix = None   # (time, progress_m) of the last fix before the start line
+        self.start_time = None # Race clock zero: when the start line was crossed
+        self.last_time = None  # Time of the last fix on the run since
+        self.points = [] # Sampled (seconds since start, lat, lon, alt, speed) for a possible new PB
+        self.gap_seconds = None
+
+    @property
+    def has_ghost(self):
+        return self.ghost is not None and len(self.ghost) > 0
+
+    def _start(self, fix_time, progress_m):
+        """Starts the clock on the first fix past the start line (or the first fix at all, if it is)."""
+        if self.joined is None:
+            self.joined = progress_m <= MAX_END_OFFSET_METERS
+        if not self.joined: return
+        if progress_m < START_LINE_METERS:
+            self.last_fix = (fix_time, progress_m)
+            return
+        if self.last_fix is None:
+            self.start_time = fix_time
+        else: # Interpolates the moment the line was crossed
+            before_time, before_progress = self.last_fix
+            fraction = (START_LINE_METERS - before_progress) / (progress_m - before_progress)
+            self.start_time = before_time + fraction * (fix_time - before_time)
+
+    def update(self, location):
+        fix_time = location.get('time') or time.time()
+        if not self.tracker.update(location): return self.gap_seconds
+        if self.start_time is None:
+            self._start(fix_time, self.tracker.progress_m)
+            if self.start_time is None: return None
+        elapsed = fix_time - self.start_time
+        self.last_time = fix_time
+        if not self.points or elapsed - self.points[-1][0] >= SAMPLE_SECONDS:
+            self.points.append((elapsed, location['lat'], location['lon'], location.get('alt_m') or 0.0,
+                                (location.get('speed_kph') or 0.0) / 3.6))
+        ghost_time = self.ghost.time_at(self.tracker.progress_m) if self.has_ghost else None
+        self.gap_seconds = elapsed - ghost_time if ghost_time is not None else None
+        return self.gap_seconds
+
+    @property
+    def race_seconds(self):
+        """Time from the start line to the last fix on the run (None if the race never started)."""
+        return self.last_time - self.start_time if self.start_time is not None else None
+
+    def finish(self):
+        """Stores the race as the new personal best if it is complete and faster. Returns True if it was."""
+        duration = self.race_seconds
+        complete = duration is not None and duration > 0 and self.tracker.remaining_m <= MAX_END_OFFSET_METERS
+        if not complete or (self.best_time is not None and duration >= self.best_time): return False
+        db_manager.update_personal_best(self.run['id'], duration, track_codec.encode_chunk(self.points))
+        print(f"GHOST: New personal best on '{self.run['name']}': {duration:.1f} s ({len(self.points)} track points).")
+        return True
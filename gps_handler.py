@@ -1,90 +1,159 @@
 import time
 import queue
-import gps # Use the system-level 'gps' library that is proven to work
+import threading
+import collections
+import gps_sources
 import math
+import geo
 
 # --- Conversion Constants ---
 MPS_TO_KPH = 3.6
-EARTH_RADIUS_METERS = 6371000
-
-def haversine_distance(p1, p2):
-    """Calculates the distance between two lat/lon points."""
-    lat1_rad, lon1_rad = math.radians(p1['lat']), math.radians(p1['lon'])
-    lat2_rad, lon2_rad = math.radians(p2['lat']), math.radians(p2['lon'])
-    dlon, dlat = lon2_rad - lon1_rad, lat2_rad - lat1_rad
-    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return EARTH_RADIUS_METERS * c
-
-def calculate_heading(p1, p2):
-    """Calculates the bearing from point 1 to point 2."""
-    lat1_rad, lon1_rad = math.radians(p1['lat']), math.radians(p1['lon'])
-    lat2_rad, lon2_rad = math.radians(p2['lat']), math.radians(p2['lon'])
-    dLon = lon2_rad - lon1_rad
-    y = math.sin(dLon) * math.cos(lat2_rad)
-    x = math.cos(lat1_rad) * math.sin(lat2_rad) - math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dLon)
-    bearing = math.degrees(math.atan2(y, x))
-    return (bearing + 360) % 360
-
-def gps_poller(gps_queue):
+
+# --- Configuration ---
+# Heading and incline are measured over a baseline rather than between
+# consecutive fixes, so they stay stable at 10 Hz where fixes are ~1 m apart
+# and GPS noise would otherwise dominate.
+HEADING_BASELINE_METERS = 3.0  # Minimum distance to measure heading/incline over.
+HEADING_WINDOW_SECONDS = 3.0   # Don't look further back than this for a baseline.
+HISTORY_LENGTH = 64            # Recent reports kept for baselines (> window at 10 Hz).
+DECIMATION_TOLERANCE = 0.8     # Accept a packet once 80% of a feed's interval has passed (absorbs timestamp jitter).
+
+def build_packet(fix, recent_reports):
+    """
+    Turns a raw fix from a GPS source into the data packet consumed by the app.
+    Heading and incline are calculated against the newest report in
+    recent_reports (oldest first) that is at least HEADING_BASELINE_METERS away;
+    if the skier hasn't moved that far, the previous values are carried forward.
+    """
+    new_data = {
+        'fix': False, 'speed_kph': 0, 'speed_mps': 0,
+        'heading': 0, 'incline_deg': 0, 'time': fix.get('time')
+    }
+    if fix.get('mode', 1) < 2 or fix.get('lat') is None or fix.get('lon') is None:
+        return new_data
+
+    # We have at least a 2D fix
+    new_data.update({
+        'fix': True,
+        'lat': fix['lat'],
+        'lon': fix['lon'],
+        'alt_m': fix.get('alt_m') or 0.0,
+    })
+
+    last_report = recent_reports[-1] if recent_reports else None
+    if last_report:
+        new_data['heading'] = last_report['heading']
+        new_data['incline_deg'] = last_report['incline_deg']
+
+    # Calculations requiring two points
+    fix_time = new_data['time']
+    for baseline in reversed(recent_reports):
+        if fix_time is not None and baseline.get('time') is not None and fix_time - baseline['time'] > HEADING_WINDOW_SECONDS:
+            break
+        distance = geo.distance_m(baseline, new_data)
+        if distance >= HEADING_BASELINE_METERS:
+            new_data['heading'] = geo.bearing_deg(baseline, new_data)
+            # Clamp incline to prevent extreme values from GPS errors
+            incline_rad = math.atan2(new_data['alt_m'] - baseline['alt_m'], distance)
+            new_data['incline_deg'] = max(-45, min(45, math.degrees(incline_rad)))
+            break
+
+    speed_mps = fix.get('speed_mps')
+    if speed_mps is None:
+        # Sources like GPX tracks don't record speed, so derive it from the last fix.
+        dt = (fix_time or 0) - (last_report.get('time') or 0) if last_report else 0
+        speed_mps = geo.distance_m(last_report, new_data) / dt if dt > 0 else 0.0
+    new_data['speed_mps'] = speed_mps
+    new_data['speed_kph'] = speed_mps * MPS_TO_KPH
+    return new_data
+
+class GpsBroadcaster:
+    """
+    Fans GPS packets out to several consumers, each decimated to its own rate.
+
+    Every subscriber gets a small bounded queue. When a consumer falls behind,
+    the oldest packet is dropped rather than letting the queue grow, so a slow
+    consumer always sees the freshest position and can never stall the poller
+    or the other consumers. Lossless subscribers (used for replays) instead
+    block the poller until they catch up. Has the same put() as a queue, so
+    gps_poller can write to it directly.
     """
-    Continuously polls gpsd, calculates heading and incline, and puts the
-    full data packet into the gps_queue.
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, max_rate_hz=None, maxsize=1, lossless=False):
+        """Returns a queue receiving at most max_rate_hz packets per second of GPS time."""
+        subscriber = {
+            'name': name, 'queue': queue.Queue(maxsize=maxsize), 'lossless': lossless,
+            'min_interval': DECIMATION_TOLERANCE / max_rate_hz if max_rate_hz else 0.0,
+            'last_time': None, 'last_fix': None, 'delivered': 0, 'dropped': 0,
+        }
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber['queue']
+
+    def put(self, packet):
+        # Decimate on the fix's own timestamp so accelerated replays decimate correctly.
+        packet_time = packet.get('time') or time.monotonic()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            fix_changed = packet.get('fix') != sub['last_fix']
+            if not fix_changed and sub['last_time'] is not None and packet_time - sub['last_time'] < sub['min_interval']:
+                continue
+            sub['last_time'], sub['last_fix'] = packet_time, packet.get('fix')
+            if sub['lossless']:
+                sub['queue'].put(packet)
+                sub['delivered'] += 1
+                continue
+            while True:
+                try:
+                    sub['queue'].put_nowait(packet)
+                    sub['delivered'] += 1
+                    break
+                except queue.Full:
+                    try:
+                        sub['queue'].get_nowait()
+                        sub['dropped'] += 1
+                    except queue.Empty:
+                        pass
+
+    def stats(self):
+        """Per-subscriber delivery counters, for diagnostics and benchmarks."""
+        with self._lock:
+            return {sub['name']: {'delivered': sub['delivered'], 'dropped': sub['dropped'], 'depth': sub['queue'].qsize()}
+                    for sub in self._subscribers}
+
+def gps_poller(gps_queue, source=None):
+    """
+    Continuously reads fixes from a GPS source (live gpsd by default, or a
+    replay from gps_sources), calculates heading and incline, and puts the
+    full data packet into the gps_queue (or a GpsBroadcaster).
     """
-    session = None
-    last_valid_report = None
+    if source is None:
+        source = gps_sources.GpsdSource()
+    recent_reports = collections.deque(maxlen=HISTORY_LENGTH)
 
     while True: # Keep trying to connect
         try:
-            session = gps.gps(mode=gps.WATCH_ENABLE)
-            print("GPS_HANDLER: Thread started, successfully connected to gpsd.")
-            
-            while True:
-                report = session.next()
-                if report['class'] == 'TPV':
-                    new_data = {
-                        'fix': False, 'speed_kph': 0, 'speed_mps': 0,
-                        'heading': 0, 'incline_deg': 0
-                    }
-                    
-                    if getattr(report, 'mode', 1) >= 2:
-                        # We have at least a 2D fix
-                        new_data.update({
-                            'fix': True,
-                            'lat': getattr(report, 'lat', None),
-                            'lon': getattr(report, 'lon', None),
-                            'alt_m': getattr(report, 'alt', 0.0),
-                            'speed_mps': getattr(report, 'speed', 0.0),
-                            'speed_kph': getattr(report, 'speed', 0.0) * MPS_TO_KPH
-                        })
-
-                        # Calculations requiring two points
-                        if last_valid_report:
-                            distance = haversine_distance(last_valid_report, new_data)
-                            alt_change = new_data['alt_m'] - last_valid_report['alt_m']
-                            
-                            if distance > 1.0: # Only calculate if we've moved a meter
-                                new_data['heading'] = calculate_heading(last_valid_report, new_data)
-                                # Clamp incline to prevent extreme values from GPS errors
-                                incline_rad = math.atan2(alt_change, distance)
-                                new_data['incline_deg'] = max(-45, min(45, math.degrees(incline_rad)))
-                        
-                        last_valid_report = new_data.copy()
-
-                    gps_queue.put(new_data)
-                
-                time.sleep(0.1)
+            print(f"GPS_HANDLER: Thread started, reading from {type(source).__name__}.")
+
+            for fix in source:
+                new_data = build_packet(fix, recent_reports)
+                if new_data['fix']:
+                    recent_reports.append(new_data)
+                gps_queue.put(new_data)
+
+            if not source.live:
+                print("GPS_HANDLER: Replay finished.")
+                gps_queue.put({'fix': False})
+                break
 
         except Exception as e:
             print(f"GPS_HANDLER: Connection lost or failed: {e}. Retrying in 5 seconds...")
-            if session:
-                session.close()
-            last_valid_report = None
+            recent_reports.clear()
             gps_queue.put({'fix': False}) # Ensure UI updates to 'no fix'
             time.sleep(5)
-        finally:
-            if session:
-                session.close()
-                
-    print("GPS_HANDLER: Thread stopped.")
 
+    print("GPS_HANDLER: Thread stopped.")
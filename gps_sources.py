@@ -0,0 +1,267 @@
+import time
+import sqlite3
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone, timedelta
+import track_codec
+
+# --- Configuration ---
+KNOTS_TO_MPS = 0.514444
+MAX_INTERPOLATION_GAP_SECONDS = 30.0 # Never invent points across a longer gap (e.g. lunch).
+
+# Every source yields "raw fixes": plain dicts with the keys
+#   time      - seconds since the epoch (UTC)
+#   mode      - gpsd fix mode (1 = no fix, 2 = 2D, 3 = 3D)
+#   lat, lon  - degrees
+#   alt_m     - metres, may be None
+#   speed_mps - metres/second, None if the source doesn't record it
+# gps_handler.gps_poller turns these into the packets the rest of the app uses.
+
+def _empty_fix(fix_time, mode=1):
+    return {'time': fix_time, 'mode': mode, 'lat': None, 'lon': None, 'alt_m': None, 'speed_mps': None}
+
+# --- Live Source ---
+class GpsdSource:
+    """
+    Reads TPV reports from a running gpsd. Never ends on its own.
+    If rate_hz is given, asks gpsd to switch the receiver to that update rate.
+    """
+    live = True
+
+    def __init__(self, rate_hz=None):
+        self.rate_hz = rate_hz
+
+    def __iter__(self):
+        import gps # Only needed on the goggles; replay works without gpsd installed.
+        session = gps.gps(mode=gps.WATCH_ENABLE)
+        if self.rate_hz:
+            session.send('?DEVICE={"cycle":%.2f}' % (1.0 / self.rate_hz))
+        try:
+            while True:
+                report = session.next()
+                if report['class'] == 'TPV':
+                    fix = _empty_fix(time.time(), getattr(report, 'mode', 1))
+                    if fix['mode'] >= 2:
+                        fix.update({
+                            'lat': getattr(report, 'lat', None),
+                            'lon': getattr(report, 'lon', None),
+                            'alt_m': getattr(report, 'alt', 0.0),
+                            'speed_mps': getattr(report, 'speed', 0.0),
+                        })
+                    yield fix
+        finally:
+            session.close()
+
+# --- File Sources ---
+class NmeaFileSource:
+    """
+    Reads an NMEA 0183 log (as written by gpspipe -r or most loggers).
+    GGA and RMC sentences sharing a timestamp are merged into a single fix.
+    """
+    live = False
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _checksum_ok(line):
+        if '*' not in line: return True
+        body, _, checksum = line[1:].partition('*')
+        calculated = 0
+        for char in body: calculated ^= ord(char)
+        try:
+            return calculated == int(checksum[:2], 16)
+        except ValueError:
+            return False
+
+    @staticmethod
+    def _parse_coord(value, hemisphere):
+        if not value: return None
+        dot = value.index('.') if '.' in value else len(value)
+        degrees = float(value[:dot - 2]) + float(value[dot - 2:]) / 60.0
+        return -degrees if hemisphere in ('S', 'W') else degrees
+
+    @staticmethod
+    def _time_of_day(hhmmss):
+        return int(hhmmss[0:2]) * 3600 + int(hhmmss[2:4]) * 60 + float(hhmmss[4:])
+
+    def _start_date(self, time_of_day):
+        """
+        Date of sentences logged before the first RMC (GGA carries no date):
+        that of the first dated RMC further on, the day before if the clock
+        passed midnight in between. A log with no dated RMC at all takes the
+        file's modification date.
+        """
+        with open(self.path, 'r', encoding='ascii', errors='ignore') as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith('$') or not self._checksum_ok(line): continue
+                fields = line.split('*')[0].split(',')
+                if fields[0][3:] != 'RMC' or len(fields) < 10 or not fields[1] or not fields[9]: continue
+                try:
+                    date = datetime.strptime(fields[9], '%d%m%y').replace(tzinfo=timezone.utc)
+                    return date - timedelta(days=1) if self._time_of_day(fields[1]) < time_of_day - 1 else date
+                except ValueError:
+                    continue
+        modified = datetime.fromtimestamp(os.path.getmtime(self.path), tz=timezone.utc)
+        return modified.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def __iter__(self):
+        current_date = None
+        last_time_of_day = None
+        pending_key, pending = None, None
+
+        with open(self.path, 'r', encoding='ascii', errors='ignore') as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith('$') or not self._checksum_ok(line): continue
+                fields = line.split('*')[0].split(',')
+                sentence = fields[0][3:]
+                if sentence not in ('GGA', 'RMC') or len(fields) < 10 or not fields[1]: continue
+
+                try:
+                    hhmmss = fields[1]
+                    time_of_day = self._time_of_day(hhmmss)
+                    if sentence == 'RMC' and fields[9]:
+                        current_date = datetime.strptime(fields[9], '%d%m%y').replace(tzinfo=timezone.utc)
+                    elif current_date is None:
+                        current_date = self._start_date(time_of_day)
+                    elif last_time_of_day is not None and time_of_day < last_time_of_day - 1:
+                        current_date += timedelta(days=1) # GGA-only log crossing midnight
+                    last_time_of_day = time_of_day
+
+                    if hhmmss != pending_key:
+                        if pending: yield pending
+                        pending_key = hhmmss
+                        pending = _empty_fix(current_date.timestamp() + time_of_day)
+
+                    if sentence == 'GGA':
+                        if fields[6] and int(fields[6]) > 0:
+                            pending['lat'] = self._parse_coord(fields[2], fields[3])
+                            pending['lon'] = self._parse_coord(fields[4], fields[5])
+                            pending['alt_m'] = float(fields[9]) if fields[9] else None
+                            pending['mode'] = 3 if pending['alt_m'] is not None else 2
+                    else:
+                        pending['time'] = current_date.timestamp() + time_of_day
+                        if fields[2] == 'A':
+                            pending['lat'] = self._parse_coord(fields[3], fields[4])
+                            pending['lon'] = self._parse_coord(fields[5], fields[6])
+                            pending['speed_mps'] = float(fields[7]) * KNOTS_TO_MPS if fields[7] else None
+                            pending['mode'] = max(pending['mode'], 2)
+                except (ValueError, IndexError):
+                    continue # Corrupt sentence, skip it
+
+        if pending: yield pending
+
+class GpxSource:
+    """Reads the track points of a GPX file. Speed is left to gps_poller to derive."""
+    live = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        for _, elem in ET.iterparse(self.path, events=('end',)):
+            if not elem.tag.endswith('trkpt'): continue
+            fix = _empty_fix(None, 2)
+            fix['lat'], fix['lon'] = float(elem.get('lat')), float(elem.get('lon'))
+            for child in elem.iter():
+                tag = child.tag.rsplit('}', 1)[-1]
+                if tag == 'ele' and child.text:
+                    fix['alt_m'] = float(child.text); fix['mode'] = 3
+                elif tag == 'time' and child.text:
+                    fix['time'] = datetime.fromisoformat(child.text.strip().replace('Z', '+00:00')).timestamp()
+                elif tag == 'speed' and child.text:
+                    fix['speed_mps'] = float(child.text)
+            elem.clear()
+            if fix['time'] is not None: yield fix
+
+class TripLogSource:
+    """Reads the track of a daily log database (daily_logs/YYYY-MM-DD.db), in either storage format."""
+    live = False
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def __iter__(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            for point in track_codec.iter_records(conn):
+                yield {'time': point.time, 'mode': 3, 'lat': point.lat, 'lon': point.lon, 'alt_m': point.alt, 'speed_mps': point.speed}
+        finally:
+            conn.close()
+
+# --- Replay ---
+def _interpolate(a, b, t):
+    """Linearly interpolates between two raw fixes at time t."""
+    frac = (t - a['time']) / (b['time'] - a['time'])
+    fix = {'time': t, 'mode': min(a['mode'], b['mode'])}
+    for key in ('lat', 'lon', 'alt_m', 'speed_mps'):
+        va, vb = a.get(key), b.get(key)
+        fix[key] = va + (vb - va) * frac if va is not None and vb is not None else None
+    return fix
+
+def resample(fixes, rate_hz):
+    """
+    Resamples a stream of raw fixes to a fixed rate by linear interpolation.
+    No points are generated across gaps longer than MAX_INTERPOLATION_GAP_SECONDS
+    or between points without a fix; the stream simply resumes at the next fix.
+    """
+    step = 1.0 / rate_hz
+    previous = None
+    next_t = None
+    for fix in fixes:
+        if previous is None or fix['mode'] < 2 or previous['mode'] < 2 \
+                or fix['time'] - previous['time'] > MAX_INTERPOLATION_GAP_SECONDS:
+            if fix['time'] is not None and (next_t is None or fix['time'] >= next_t):
+                yield dict(fix)
+                next_t = fix['time'] + step
+        else:
+            while next_t <= fix['time']:
+                yield _interpolate(previous, fix, next_t)
+                next_t += step
+        previous = fix
+
+class ReplaySource:
+    """
+    Replays a recorded source in (scaled) real time.
+
+    speed  - 1.0 replays at the recorded pace, 10.0 ten times faster and
+             0/None as fast as the consumer can take it.
+    rate_hz - resample to this output rate, or None to keep the recorded rate.
+    """
+    live = False
+
+    def __init__(self, source, speed=1.0, rate_hz=None):
+        self.source = source
+        self.speed = speed
+        self.rate_hz = rate_hz
+
+    def __iter__(self):
+        fixes = iter(self.source)
+        if self.rate_hz: fixes = resample(fixes, self.rate_hz)
+        wall_start, track_start = None, None
+        for fix in fixes:
+            if self.speed and fix['time'] is not None:
+                if wall_start is None:
+                    wall_start, track_start = time.monotonic(), fix['time']
+                delay = wall_start + (fix['time'] - track_start) / self.speed - time.monotonic()
+                if delay > 0: time.sleep(delay)
+            yield fix
+
+def open_source(replay_file=None, speed=1.0, rate_hz=None):
+    """
+    Returns the live gpsd source (asking for rate_hz updates), or a replay of
+    the given file picked by extension and resampled to rate_hz.
+    """
+    if not replay_file:
+        return GpsdSource(rate_hz)
+    extension = os.path.splitext(replay_file)[1].lower()
+    if extension == '.gpx':
+        source = GpxSource(replay_file)
+    elif extension == '.db':
+        source = TripLogSource(replay_file)
+    else:
+        source = NmeaFileSource(replay_file)
+    print(f"GPS_SOURCES: Replaying {replay_file} at {speed or 'max'}x speed.")
+    return ReplaySource(source, speed, rate_hz)
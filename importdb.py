@@ -1,5 +1,7 @@
 import csv
-import os
+import sys
+import time
+from contextlib import nullcontext
 import db_manager
 
 # --- Configuration ---
@@ -7,102 +9,158 @@ import db_manager
 WAYPOINTS_CSV = 'waypoints.csv'
 RUNS_LIFTS_CSV = 'runs_lifts.csv'
 ROUTES_CSV = 'routes.csv'
+MAX_ERRORS_SHOWN = 20 # The rest are only counted
+
+# Each phase streams its CSV straight into executemany() inside a single
+# transaction (one commit instead of one per row), resolving names to ids from
+# in-memory maps. Bad rows are skipped and their errors collected in
+# `errors` as "file:line: message" strings, reported once at the end.
+
+class _DryRun(Exception):
+    """Raised inside the outer transaction to roll back a dry run."""
 
 def clear_all_data():
-    """ Wipes all data from the tables to ensure a clean import. """
+    """ Wipes all resort data from the tables to ensure a clean import. """
     print("IMPORT: Clearing all existing data from the database...")
-    conn = sqlite3.connect(db_manager.DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM waypoints")
-    cursor.execute("DELETE FROM run_lift")
-    cursor.execute("DELETE FROM routes")
-    cursor.execute("DELETE FROM trip_log")
-    conn.commit()
-    conn.close()
+    with db_manager.transaction(db_manager.DB_FILE) as conn:
+        # Children first; the join tables would also go via ON DELETE CASCADE.
+        for table in ('route_runs', 'run_waypoints', 'routes', 'run_lift', 'waypoints'):
+            conn.execute(f"DELETE FROM {table}")
     print("IMPORT: Database cleared.")
 
-def import_waypoints():
-    """ Imports waypoints from a CSV file. """
-    print(f"IMPORT: Reading waypoints from {WAYPOINTS_CSV}...")
+def _csv_rows(path, required_columns, errors):
+    """Yields (line number, row) from a CSV file, checking its header first."""
     try:
-        with open(WAYPOINTS_CSV, mode='r', newline='', encoding='utf-8') as csvfile:
+        with open(path, mode='r', newline='', encoding='utf-8') as csvfile:
             reader = csv.DictReader(csvfile)
+            missing = [column for column in required_columns if column not in (reader.fieldnames or [])]
+            if missing:
+                errors.append(f"{path}: missing column(s) {', '.join(missing)}")
+                return
             for row in reader:
-                db_manager.add_waypoint(row['name'], float(row['lat']), float(row['lon']), float(row['alt']))
-        print(f"IMPORT: Successfully imported waypoints.")
+                yield reader.line_num, row
     except FileNotFoundError:
-        print(f"ERROR: Could not find {WAYPOINTS_CSV}. Please create it.")
-    except Exception as e:
-        print(f"ERROR: An error occurred while importing waypoints: {e}")
+        errors.append(f"{path}: file not found")
 
-def import_runs_lifts():
-    """ 
-    Imports runs and lifts from a CSV file.
-    This function looks up waypoint IDs by their names for convenience.
+def _next_id(conn, table):
+    """First id AUTOINCREMENT would hand out next, so ids can be assigned up front."""
+    row = conn.execute("SELECT MAX(seq) FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    max_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0]
+    return max(row[0] or 0, max_id or 0) + 1
+
+def _name_map(conn, table):
+    return {name: row_id for row_id, name in conn.execute(f"SELECT id, name FROM {table}")}
+
+def _optional_float(value):
+    return float(value) if value and value.strip() else None
+
+def import_waypoints(conn, errors):
+    """ Imports waypoints from a CSV file. Returns the number of rows written. """
+    seen_names = set(_name_map(conn, 'waypoints'))
+
+    def rows():
+        for line, row in _csv_rows(WAYPOINTS_CSV, ('name', 'lat', 'lon', 'alt'), errors):
+            name = (row['name'] or '').strip()
+            try:
+                values = (name, _optional_float(row['lat']), _optional_float(row['lon']), float(row['alt']), (row.get('type') or '').strip() or 'junction')
+            except (TypeError, ValueError) as e:
+                errors.append(f"{WAYPOINTS_CSV}:{line}: bad number in waypoint '{name}' ({e})"); continue
+            if not name or name in seen_names:
+                errors.append(f"{WAYPOINTS_CSV}:{line}: {'duplicate' if name else 'empty'} waypoint name '{name}'"); continue
+            seen_names.add(name)
+            yield values
+
+    return conn.executemany("INSERT INTO waypoints (name, lat, lon, alt, type) VALUES (?, ?, ?, ?, ?)", rows()).rowcount
+
+def _import_ordered(conn, errors, path, table, columns, join_table, join_columns, list_column, item_table):
     """
-    print(f"IMPORT: Reading runs and lifts from {RUNS_LIFTS_CSV}...")
-    # Create a name-to-ID mapping for waypoints
-    waypoints = db_manager.get_all_waypoints()
-    waypoint_map = {wp['name']: wp['id'] for wp in waypoints}
+    Shared by runs and routes: inserts the parent rows with ids assigned up
+    front, collecting their ordered child ids, then fills the join table.
+    """
+    item_ids = _name_map(conn, item_table)
+    seen_names = set(_name_map(conn, table))
+    next_id = _next_id(conn, table)
+    join_rows = []
 
-    try:
-        with open(RUNS_LIFTS_CSV, mode='r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                # Convert semicolon-separated names to a list of IDs
-                waypoint_names = [name.strip() for name in row['waypoints'].split(';')]
-                waypoint_ids = [waypoint_map[name] for name in waypoint_names if name in waypoint_map]
-                
-                if len(waypoint_ids) == len(waypoint_names):
-                    db_manager.add_run_lift(row['name'], waypoint_ids, row['type'], row['difficulty'])
-                else:
-                    print(f"WARNING: Skipping run '{row['name']}' due to missing waypoint names.")
-        print("IMPORT: Successfully imported runs and lifts.")
-    except FileNotFoundError:
-        print(f"ERROR: Could not find {RUNS_LIFTS_CSV}. Please create it.")
-    except Exception as e:
-        print(f"ERROR: An error occurred while importing runs/lifts: {e}")
+    def rows():
+        nonlocal next_id
+        for line, row in _csv_rows(path, ('name', list_column) + columns, errors):
+            name = (row['name'] or '').strip()
+            item_names = [item.strip() for item in (row[list_column] or '').split(';') if item.strip()]
+            unknown = [item for item in item_names if item not in item_ids]
+            if not name or name in seen_names:
+                errors.append(f"{path}:{line}: {'duplicate' if name else 'empty'} name '{name}'"); continue
+            if unknown or not item_names:
+                errors.append(f"{path}:{line}: skipping '{name}', unknown {item_table}: {', '.join(unknown) or '(none listed)'}"); continue
+            seen_names.add(name)
+            join_rows.extend((next_id, seq, item_ids[item]) for seq, item in enumerate(item_names))
+            yield (next_id, name) + tuple(row[column] for column in columns)
+            next_id += 1
 
-def import_routes():
-    """ 
+    placeholders = ', '.join('?' * (len(columns) + 2))
+    written = conn.executemany(f"INSERT INTO {table} (id, name, {', '.join(columns)}) VALUES ({placeholders})", rows()).rowcount
+    conn.executemany(f"INSERT INTO {join_table} ({', '.join(join_columns)}) VALUES (?, ?, ?)", join_rows)
+    return written
+
+def import_runs_lifts(conn, errors):
+    """
+    Imports runs and lifts from a CSV file.
+    Waypoints are listed by name, separated by semicolons.
+    """
+    return _import_ordered(conn, errors, RUNS_LIFTS_CSV, 'run_lift', ('type', 'difficulty'),
+                           'run_waypoints', ('run_id', 'seq', 'waypoint_id'), 'waypoints', 'waypoints')
+
+def import_routes(conn, errors):
+    """
     Imports routes from a CSV file.
-    This function looks up run/lift IDs by their names.
+    Runs/lifts are listed by name, separated by semicolons.
     """
-    print(f"IMPORT: Reading routes from {ROUTES_CSV}...")
-    # Create a name-to-ID mapping for runs/lifts
-    runs_lifts = db_manager.get_all_runs_structured()
-    run_lift_map = {run['name']: run['id'] for run in runs_lifts}
+    return _import_ordered(conn, errors, ROUTES_CSV, 'routes', ('end_area', 'difficulty'),
+                           'route_runs', ('route_id', 'seq', 'run_id'), 'runs', 'run_lift')
 
+def run_import(dry_run=False):
+    """Clears the resort tables and imports all three CSV files. Returns the collected errors."""
+    errors = []
+    phases = (('waypoints', import_waypoints), ('runs/lifts', import_runs_lifts), ('routes', import_routes))
+    started = time.perf_counter()
+    total_rows = 0
     try:
-        with open(ROUTES_CSV, mode='r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                # Convert semicolon-separated names to a list of IDs
-                run_names = [name.strip() for name in row['runs'].split(';')]
-                run_ids = [run_lift_map[name] for name in run_names if name in run_lift_map]
-
-                if len(run_ids) == len(run_names):
-                    db_manager.add_route(row['name'], run_ids, row['end_area'], row['difficulty'])
-                else:
-                    print(f"WARNING: Skipping route '{row['name']}' due to missing run/lift names.")
-        print("IMPORT: Successfully imported routes.")
-    except FileNotFoundError:
-        print(f"ERROR: Could not find {ROUTES_CSV}. Please create it.")
-    except Exception as e:
-        print(f"ERROR: An error occurred while importing routes: {e}")
+        # A dry run wraps everything in one outer transaction (the per-phase
+        # ones join it) and rolls it back at the end.
+        with db_manager.transaction(db_manager.DB_FILE) if dry_run else nullcontext():
+            clear_all_data()
+            for label, import_phase in phases:
+                phase_started = time.perf_counter()
+                with db_manager.transaction(db_manager.DB_FILE) as conn:
+                    rows = import_phase(conn, errors)
+                elapsed = time.perf_counter() - phase_started
+                total_rows += rows
+                print(f"IMPORT: {label:<10} {rows:7d} rows in {elapsed:6.2f} s ({rows / elapsed if elapsed else 0:,.0f} rows/s)")
+            if dry_run: raise _DryRun()
+            db_manager.clear_personal_bests() # Kept in their own database, by the run ids just replaced
+    except _DryRun:
+        print("IMPORT: Dry run, all changes rolled back.")
+    elapsed = time.perf_counter() - started
+    print(f"IMPORT: {total_rows} rows in {elapsed:.2f} s ({total_rows / elapsed if elapsed else 0:,.0f} rows/s overall).")
+
+    if errors:
+        print(f"IMPORT: {len(errors)} row(s) skipped:")
+        for error in errors[:MAX_ERRORS_SHOWN]:
+            print(f"  {error}")
+        if len(errors) > MAX_ERRORS_SHOWN:
+            print(f"  ... and {len(errors) - MAX_ERRORS_SHOWN} more")
+    return errors
 
 if __name__ == "__main__":
-    print("--- Starting Database Import ---")
-    
+    # Usage: python importdb.py [--dry-run]
+    dry_run = '--dry-run' in sys.argv[1:]
+    print(f"--- Starting Database Import{' (dry run)' if dry_run else ''} ---")
+
     # 1. Ensure the database and tables exist
     db_manager.setup_database()
-    
-    # 2. Clear out any old data for a fresh start
-    clear_all_data()
-    
-    # 3. Import data in order of dependency
-    import_waypoints()
-    import_runs_lifts()
-    import_routes()
-    
+
+    # 2. Clear out old data and import in order of dependency
+    errors = run_import(dry_run)
+
     print("\n--- Database Import Complete ---")
+    sys.exit(1 if errors else 0)
@@ -4,16 +4,20 @@ import evdev
 import select
 import queue
 import threading
-import math
 
 # Import project modules
 import db_manager
 import mapper
+import map_matcher
+import resort_model
+import route_tables
 from ui_manager import UIManager
 from recorder import VideoRecorder
 import weather_handler
 import variables # Import the new variables file
 import audio_handler
+import profiler
+from screen_cache import ScreenDataCache
 
 # --- CONFIGURATION ---
 KEYPAD_DEVICE_PATH = "/dev/input/by-id/usb-SEMICO_USB_Keyboard-event-kbd"
@@ -23,6 +27,9 @@ AUTO_SCROLL_DELAY = 3.0
 AUTO_SCROLL_INTERVAL = 2.0
 ANALYTICS_DISPLAY_DURATION = 5.0
 AUTO_RETURN_SECONDS = 10.0 # Time before returning from a sub-page
+DISPLAY_RATE_HZ = 10 # Max GPS packets per second handed to the main loop
+RECORDER_RATE_HZ = 5 # Max GPS packets per second handed to the video overlay
+LOOP_STAGES = ('gps', 'position', 'input', 'db', 'render', 'flush', 'idle', 'frame')
 
 KEY_MAP = {
     79: '1', 80: '2', 81: '3', 75: '4', 76: '5', 77: '6',
@@ -30,9 +37,11 @@ KEY_MAP = {
     73: 'RECORD_TOGGLE', 98: 'SKIP_WAYPOINT'
 }
 
-def main(disp, gps_queue, gps_data, data_lock, ui):
+def main(disp, gps_queue, gps_data, data_lock, ui, recorder_gps_queue=None):
     """
     Main application with enhanced UI features.
+    gps_queue should be a GpsBroadcaster subscription; the video recorder gets
+    its own (recorder_gps_queue) so the two never steal each other's packets.
     """
     # --- Initialization ---
     try:
@@ -43,10 +52,13 @@ def main(disp, gps_queue, gps_data, data_lock, ui):
         
     recorder_data = {}
     recorder_data_lock = threading.Lock()
-    recorder = VideoRecorder(gps_queue, recorder_data, recorder_data_lock)
+    recorder = VideoRecorder(recorder_gps_queue or gps_queue, recorder_data, recorder_data_lock)
+    screen_data = ScreenDataCache(LOGBOOK_ITEMS_PER_PAGE) # DB-backed pages are served from memory
+    screen_data.start()
+    route_tables.prepare(resort_model.get_model()) # Load the resort and its route tables up front rather than on the first route request
     
     # --- Application State ---
-    main_pages = ['HOME', 'COMPASS', 'ACHIEVEMENTS', 'WEATHER', 'STATS', 'LOGBOOK', 'NAVIGATION', 'DIRECTIONS']
+    main_pages = ['HOME', 'COMPASS', 'ACHIEVEMENTS', 'WEATHER', 'STATS', 'LOGBOOK', 'NAVIGATION', 'DIRECTIONS', 'DIAGNOSTICS']
     main_page_index = 0
     
     weather_sub_page_index = 0
@@ -55,40 +67,66 @@ def main(disp, gps_queue, gps_data, data_lock, ui):
 
     wizard_state = 'IDLE'; wizard_choices = {}; menu_items = []; full_menu_items = []; menu_page = 0
     active_route = None; next_waypoint_info = None; active_poi = None
+    matcher = map_matcher.MapMatcher(); run_detector = map_matcher.RunDetector(); current_run_name = None
     last_run_analytics = None; analytics_display_end_time = 0
     
     dirty = True 
     last_full_second_update = 0
     
     gps_data_cache = {}
+    last_fix_received = None
+    loop_profiler = profiler.StageProfiler(LOOP_STAGES)
     time_to_last_lift_seconds = None
     last_lift_warning_active = False
 
     try:
         while True:
+            frame_start = stage_start = time.perf_counter()
             current_time = time.time()
             if current_time - last_full_second_update >= 1.0:
                 dirty = True
                 last_full_second_update = current_time
 
             # --- GPS Update & Position Tracking ---
-            try:
-                new_gps_data = gps_queue.get_nowait()
+            # Drain everything that arrived since the last loop and keep the newest.
+            new_gps_data = None
+            while True:
+                try:
+                    new_gps_data = gps_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if new_gps_data is not None:
                 gps_data_cache = new_gps_data.copy()
                 dirty = True
                 with data_lock:
                     gps_data.update(new_gps_data)
-            except queue.Empty:
-                pass
+                if new_gps_data.get('fix'): last_fix_received = time.monotonic()
+            stage_start = loop_profiler.lap('gps', stage_start)
             
             # Extract latest data for use
-            current_location = {'lat': gps_data_cache.get('lat'), 'lon': gps_data_cache.get('lon'), 'alt_m': gps_data_cache.get('alt_m')}
+            current_location = {'lat': gps_data_cache.get('lat'), 'lon': gps_data_cache.get('lon'), 'alt_m': gps_data_cache.get('alt_m'),
+                                'speed_kph': gps_data_cache.get('speed_kph', 0), 'incline_deg': gps_data_cache.get('incline_deg', 0),
+                                'time': gps_data_cache.get('time')}
             speed_kph = gps_data_cache.get('speed_kph', 0)
             alt_m = gps_data_cache.get('alt_m', 0)
             gps_fix = gps_data_cache.get('fix', False)
             heading = gps_data_cache.get('heading', 0)
             incline_deg = gps_data_cache.get('incline_deg', 0)
 
+            if new_gps_data is not None and gps_fix:
+                match = matcher.update(current_location)
+                matched_name = match['run_name'] if match and match['confidence'] >= map_matcher.MIN_CONFIDENCE else None
+                if matched_name != current_run_name:
+                    current_run_name = matched_name
+                    with recorder_data_lock:
+                        recorder_data['current_run_name'] = current_run_name or 'N/A'
+                # Routes log their own runs; otherwise runs are picked up from the match.
+                finished_run = None if active_route else run_detector.update(match, current_location)
+                if active_route: run_detector.cancel()
+                if finished_run:
+                    db_manager.log_completed_run(finished_run)
+                    last_run_analytics = finished_run; analytics_display_end_time = current_time + ANALYTICS_DISPLAY_DURATION
+
             if active_route:
                 update_result = mapper.update_position(active_route, current_location)
                 if update_result:
@@ -99,9 +137,11 @@ def main(disp, gps_queue, gps_data, data_lock, ui):
                     ui.display_message("Route Finished!", 2000); active_route = None
                 dirty = True
             elif active_poi and gps_fix:
-                active_poi['distance_m'] = mapper.haversine_distance(current_location, active_poi)
+                active_poi['distance_m'] = mapper.distance_m(current_location, active_poi)
                 dirty = True
 
+            stage_start = loop_profiler.lap('position', stage_start)
+
             if last_run_analytics and current_time > analytics_display_end_time:
                 last_run_analytics = None; dirty = True
 
@@ -111,6 +151,8 @@ def main(disp, gps_queue, gps_data, data_lock, ui):
 
             # --- Input Handling ---
             r, w, x = select.select([keypad], [], [], 0.05)
+            idle_end = time.perf_counter()
+            idle_seconds, stage_start = idle_end - stage_start, idle_end
             if r:
                 for event in keypad.read():
                     if event.type == evdev.ecodes.EV_KEY and event.value == 1:
@@ -146,9 +188,13 @@ def main(disp, gps_queue, gps_data, data_lock, ui):
                                     ui.display_message("Waypoint Saved!", 1500)
                                 else: ui.display_message("No GPS Fix!", 1500)
                             elif current_page_name == 'DIRECTIONS' and button == '5': wizard_state = 'SELECT_TYPE'
+                            elif current_page_name == 'DIAGNOSTICS' and button == '5':
+                                loop_profiler.dump({'queue_depth': gps_queue.qsize(), 'fix_age_s': time.monotonic() - last_fix_received if last_fix_received else None})
+                                ui.display_message("Saved!", 1000)
                             continue
 
                         # ... (Wizard logic remains here) ...
+            stage_start = loop_profiler.lap('input', stage_start)
 
             # --- Display & State Logic ---
             if dirty:
@@ -179,33 +225,51 @@ def main(disp, gps_queue, gps_data, data_lock, ui):
                 elif wizard_state != 'IDLE':
                     ui.display_menu(wizard_state.replace('_', ' ').title(), menu_items, gps_fix, time_str, is_recording)
                 elif current_page_name == 'HOME':
-                    ui.display_home_screen(speed_kph, alt_m, gps_fix, time_str, is_recording, incline_deg, time_to_last_lift_seconds)
+                    ui.display_home_screen(speed_kph, alt_m, gps_fix, time_str, is_recording, incline_deg, time_to_last_lift_seconds, current_run_name)
                 elif current_page_name == 'COMPASS':
                     ui.display_compass_screen(heading, gps_fix, time_str, is_recording)
                 elif current_page_name == 'ACHIEVEMENTS':
-                    ui.display_achievements_screen(db_manager.get_days_bests(), gps_fix, time_str, is_recording)
+                    bests = screen_data.get_days_bests()
+                    stage_start = loop_profiler.lap('db', stage_start)
+                    ui.display_achievements_screen(bests, gps_fix, time_str, is_recording)
                 elif current_page_name == 'WEATHER':
                     latest_weather = weather_handler.get_latest_weather()
                     if weather_sub_page_index == 0: ui.display_current_weather_screen(latest_weather, gps_fix, time_str, is_recording)
                     else: ui.display_snow_report_screen(latest_weather, gps_fix, time_str, is_recording)
                 elif current_page_name == 'STATS':
-                    ui.display_summary_screen(db_manager.get_trip_summary(), gps_fix, time_str, is_recording)
+                    summary = screen_data.get_trip_summary()
+                    stage_start = loop_profiler.lap('db', stage_start)
+                    ui.display_summary_screen(summary, gps_fix, time_str, is_recording)
                 elif current_page_name == 'LOGBOOK':
-                    log_entries = db_manager.get_run_log_entries()
-                    total_pages = math.ceil(len(log_entries) / LOGBOOK_ITEMS_PER_PAGE) if log_entries else 0
-                    start = logbook_page * LOGBOOK_ITEMS_PER_PAGE
-                    paginated = log_entries[start : start + LOGBOOK_ITEMS_PER_PAGE]
+                    paginated, total_pages = screen_data.get_logbook_page(logbook_page)
+                    logbook_page = max(0, min(logbook_page, total_pages - 1)) # The page the cache served
+                    stage_start = loop_profiler.lap('db', stage_start)
                     ui.display_run_logbook_screen(paginated, logbook_page + 1, total_pages, gps_fix, time_str, is_recording)
                 elif current_page_name == 'NAVIGATION':
                     ui.display_navigation_screen(None, time_str, is_recording, is_main_page=True, gps_fix=gps_fix)
                 elif current_page_name == 'DIRECTIONS':
                     ui.display_menu("Find Directions", [{'name': "Press 5 to start"}], gps_fix, time_str, is_recording, page_indicator="DIRECTIONS")
+                elif current_page_name == 'DIAGNOSTICS':
+                    mean_frame = loop_profiler.mean('frame')
+                    diagnostics = {
+                        'loop_hz': 1.0 / mean_frame if mean_frame else 0.0,
+                        'p95_frame_ms': loop_profiler.percentile('frame', 0.95) * 1000,
+                        'queue_depth': gps_queue.qsize(),
+                        'fix_age_s': time.monotonic() - last_fix_received if last_fix_received else None,
+                    }
+                    ui.display_diagnostics_screen(diagnostics, gps_fix, time_str, is_recording)
 
+                stage_start = loop_profiler.lap('render', stage_start, ui.last_flush_seconds)
+                loop_profiler.record('flush', ui.last_flush_seconds)
                 dirty = False
             time.sleep(0.02)
+            loop_end = time.perf_counter()
+            loop_profiler.record('idle', idle_seconds + loop_end - stage_start)
+            loop_profiler.record('frame', loop_end - frame_start)
             
     finally:
         if recorder.is_recording(): recorder.stop()
+        screen_data.stop()
         keypad.close()
 
 
@@ -0,0 +1,168 @@
+"""
+Online map matching: which run or lift the skier is on, from the GPS alone.
+
+Every leg of every run and lift (consecutive waypoints of its
+waypoints_list) is a segment in a spatial_index.SegmentGrid. Each fix
+takes the MAX_CANDIDATES nearest segments within SEARCH_RADIUS_METERS as
+the states of a hidden Markov model and advances it by one step:
+
+    emission    Gaussian in the distance to the segment (GPS_SIGMA_METERS),
+                times how well the direction of travel agrees with the
+                segment's (runs are skied and lifts ridden in waypoint order)
+    transition  staying on a segment, moving on to one that starts where it
+                ends, or (rarely) jumping anywhere else
+
+Viterbi scores pick the current segment, and the forward probabilities,
+summed over the candidates on that segment's run, give the confidence. Both
+only look at the previous fix's candidates, so a fix costs at most
+MAX_CANDIDATES squared steps whatever the size of the resort. With no
+segment in range (off piste, in a lodge) the state is cleared and nothing is
+published until the skier is back on the map.
+"""
+import math
+import geo
+import mapper
+import resort_model
+import spatial_index
+
+# --- Configuration ---
+SEARCH_RADIUS_METERS = 50.0 # Segments further than this from a fix aren't candidates
+MAX_CANDIDATES = 8          # Bounds the state (and the per-fix work)
+GPS_SIGMA_METERS = 10.0
+MIN_HEADING_METERS = 2.0    # Direction of travel is only trusted over at least this much movement
+HEADING_FLOOR = 0.05        # Likelihood of going against a segment's direction, relative to along it
+LOG_STAY = math.log(0.9)    # Transition log-probabilities
+LOG_CONNECT = math.log(0.09)
+LOG_JUMP = math.log(0.01)
+MIN_CONFIDENCE = 0.6        # Below this the match isn't published to the HUD and overlay
+MIN_LOGGED_RUN_SECONDS = 20.0 # Shorter stretches on a run aren't logged as runs
+
+class ResortSegments:
+    """The legs of a ResortModel's runs and lifts, projected and indexed for matching."""
+    def __init__(self, model):
+        located = [wp for wp in model.waypoints if wp.get('lat') is not None and wp.get('lon') is not None]
+        self.projection = geo.LocalProjection(located[0]['lat'], located[0]['lon']) if located else None
+        self.runs, self.start_ids, self.end_ids = [], [], []
+        xs0, ys0, xs1, ys1 = [], [], [], []
+        for run in model.runs:
+            ids = [wp_id for wp_id in run['waypoints_list'] if wp_id in model.waypoints_by_id
+                   and model.waypoints_by_id[wp_id].get('lat') is not None and model.waypoints_by_id[wp_id].get('lon') is not None]
+            for start_id, end_id in zip(ids, ids[1:]):
+                start, end = model.waypoints_by_id[start_id], model.waypoints_by_id[end_id]
+                x0, y0 = self.projection.to_xy(start['lat'], start['lon'])
+                x1, y1 = self.projection.to_xy(end['lat'], end['lon'])
+                self.runs.append(run); self.start_ids.append(start_id); self.end_ids.append(end_id)
+                xs0.append(x0); ys0.append(y0); xs1.append(x1); ys1.append(y1)
+        self.grid = spatial_index.SegmentGrid(xs0, ys0, xs1, ys1)
+        self.directions = [(x1 - x0, y1 - y0) for x0, y0, x1, y1 in zip(xs0, ys0, xs1, ys1)]
+
+    def transition(self, previous, segment):
+        if previous == segment: return LOG_STAY
+        if self.start_ids[segment] == self.end_ids[previous]: return LOG_CONNECT
+        return LOG_JUMP
+
+def get_segments(model):
+    return model.derived(('map_matcher_segments',), ResortSegments)
+
+class MapMatcher:
+    """
+    Tracks the skier's run or lift fix by fix; see the module docstring.
+    update() returns the current match as a dict (run, run_name, confidence,
+    distance_m) or None when nothing is in range.
+    """
+    def __init__(self):
+        self.segments = None
+        self.reset()
+
+    def reset(self):
+        self.viterbi = {} # segment -> best log-probability of any path ending on it
+        self.forward = {} # segment -> probability (normalised) of being on it
+        self.last_xy = None
+        self.match = None
+
+    def _emission(self, segment, distance, movement):
+        log_p = -0.5 * (distance / GPS_SIGMA_METERS) ** 2
+        if movement is not None:
+            dx, dy = self.segments.directions[segment]
+            length = math.hypot(dx, dy)
+            if length > 0:
+                cosine = (movement[0] * dx + movement[1] * dy) / (math.hypot(*movement) * length)
+                log_p += math.log(HEADING_FLOOR + (1 - HEADING_FLOOR) * (1 + cosine) / 2)
+        return log_p
+
+    def update(self, location, model=None):
+        """
+        Advances the model by one fix (a dict with lat and lon) and returns
+        the current match. model defaults to the shared ResortModel.
+        """
+        if not mapper.has_gps_data(location): return self.match
+        segments = get_segments(model or resort_model.get_model())
+        if segments is not self.segments: # The resort changed: segment numbers mean something else now
+            self.segments = segments
+            self.reset()
+        if segments.projection is None: return None
+        x, y = segments.projection.to_xy(location['lat'], location['lon'])
+        movement = None
+        if self.last_xy is not None and math.hypot(x - self.last_xy[0], y - self.last_xy[1]) >= MIN_HEADING_METERS:
+            movement = (x - self.last_xy[0], y - self.last_xy[1])
+        if movement is not None or self.last_xy is None:
+            self.last_xy = (x, y)
+
+        candidates, distances = segments.grid.near(x, y, SEARCH_RADIUS_METERS)
+        if not len(candidates):
+            self.reset()
+            return None
+        nearest = sorted(zip(distances.tolist(), candidates.tolist()))[:MAX_CANDIDATES]
+        distance_to = {segment: distance for distance, segment in nearest}
+
+        viterbi, forward = {}, {}
+        for distance, segment in nearest:
+            emission = self._emission(segment, distance, movement)
+            if self.viterbi:
+                viterbi[segment] = emission + max(score + segments.transition(previous, segment) for previous, score in self.viterbi.items())
+                forward[segment] = math.exp(emission) * sum(p * math.exp(segments.transition(previous, segment)) for previous, p in self.forward.items())
+            else:
+                viterbi[segment], forward[segment] = emission, math.exp(emission)
+        best_score = max(viterbi.values())
+        self.viterbi = {segment: score - best_score for segment, score in viterbi.items()} # Keeps the numbers in range
+        total = sum(forward.values())
+        self.forward = {segment: p / total if total > 0 else 1 / len(forward) for segment, p in forward.items()}
+
+        best = max(self.viterbi, key=lambda segment: (self.viterbi[segment], -segment))
+        run = segments.runs[best]
+        self.match = {
+            'run': run, 'run_name': run['name'],
+            'confidence': sum(p for segment, p in self.forward.items() if segments.runs[segment] is run),
+            'distance_m': distance_to[best],
+        }
+        return self.match
+
+class RunDetector:
+    """
+    Turns matches into logged runs when no route is being followed: a run
+    starts when the matcher is confident the skier is on a run (not a
+    lift), and ends when it is confident they are on something else or
+    nothing is in range at all (an uncertain moment at a junction doesn't
+    end it). Its statistics come from a mapper.RunAccumulator; update()
+    returns the analytics of a run that just ended (if it lasted at least
+    MIN_LOGGED_RUN_SECONDS), else None.
+    """
+    def __init__(self):
+        self.current = None # (run, RunAccumulator)
+
+    def update(self, match, location):
+        confident = match['run'] if match and match['confidence'] >= MIN_CONFIDENCE else None
+        finished = None
+        if self.current and (match is None or (confident is not None and confident['id'] != self.current[0]['id'])):
+            analytics = self.current[1].analytics()
+            if analytics['duration_seconds'] >= MIN_LOGGED_RUN_SECONDS: finished = analytics
+            self.current = None
+        if self.current is None and confident is not None and confident.get('type') != 'Lift':
+            self.current = (confident, mapper.RunAccumulator(confident['id'], confident['name'], confident['waypoints_list'][-1]))
+        if self.current is not None:
+            self.current[1].add(location)
+        return finished
+
+    def cancel(self):
+        """Forgets the run in progress (a route took over logging)."""
+        self.current = None
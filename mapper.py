@@ -1,13 +1,22 @@
 import db_manager
-from math import radians, sin, cos, sqrt, atan2
-import heapq 
+import geo
+import resort_model
+import router
+import route_tables
+import route_progress
+import spatial_index
+import numpy as np
 import time
 import audio_handler
-import random
+import ghost
 
 # --- Configuration ---
 PROXIMITY_RADIUS_METERS = 10
-EARTH_RADIUS_METERS = 6371000
+ROUTE_ALTERNATIVES = 3 # Routes offered per directions request (the best plus alternatives)
+OFF_ROUTE_METERS = 40 # Further than this from the planned route counts as off it...
+OFF_ROUTE_FIXES = 3 # ...for this many fixes in a row before rerouting (rides out GPS glitches).
+DESCENT_HYSTERESIS_M = 3.0 # Altitude changes smaller than this are GPS noise, not descent (as in trip_logger).
+MAX_SAMPLE_GAP_SECONDS = 30.0 # Don't credit distance across longer gaps (GPS loss).
 
 # --- Helper Functions ---
 def has_gps_data(point):
@@ -15,139 +24,308 @@ def has_gps_data(point):
     lat, lon = point.get('lat'), point.get('lon')
     return isinstance(lat, (int, float)) and isinstance(lon, (int, float))
 
-def haversine_distance(p1, p2):
+def distance_m(p1, p2):
+    """Distance in metres on the shared resort grid, or inf if either point has no GPS data."""
     if not has_gps_data(p1) or not has_gps_data(p2):
         return float('inf') 
-    lat1_rad, lon1_rad = radians(p1['lat']), radians(p1['lon'])
-    lat2_rad, lon2_rad = radians(p2['lat']), radians(p2['lon'])
-    dlon, dlat = lon2_rad - lon1_rad, lat2_rad - lat1_rad
-    a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return EARTH_RADIUS_METERS * c
-
-# --- A* Pathfinding Algorithm (unchanged) ---
-def a_star_search(nodes, graph, start_node_id, end_node_id):
-    open_set = [(0, start_node_id)] 
-    came_from = {}
-    g_score = {node_id: float('inf') for node_id in nodes}
-    g_score[start_node_id] = 0
-    f_score = {node_id: float('inf') for node_id in nodes}
-    f_score[start_node_id] = haversine_distance(nodes[start_node_id], nodes[end_node_id])
-    while open_set:
-        _, current_id = heapq.heappop(open_set)
-        if current_id == end_node_id:
-            path = []
-            while current_id in came_from:
-                path.append(nodes[current_id]); current_id = came_from[current_id]
-            path.append(nodes[start_node_id]); return path[::-1]
-        for neighbor_id, cost in graph.get(current_id, {}).items():
-            tentative_g_score = g_score[current_id] + cost
-            if tentative_g_score < g_score[neighbor_id]:
-                came_from[neighbor_id] = current_id; g_score[neighbor_id] = tentative_g_score
-                f_score[neighbor_id] = tentative_g_score + haversine_distance(nodes[neighbor_id], nodes[end_node_id])
-                heapq.heappush(open_set, (f_score[neighbor_id], neighbor_id))
-    return None
+    return geo.distance_m(p1, p2)
+
+# --- Pathfinding ---
+def find_path(model, difficulty, start_wp_id, dest_wp_id):
+    """
+    Shortest path between two waypoint ids at a difficulty: a walk down the
+    precomputed route table if it's ready, else A* over the model's compiled
+    graph (see router.RoutingEngine). Returns the path's waypoint dicts, or
+    None if there is none.
+    """
+    graph = model.graph(difficulty)
+    start, goal = graph.index.get(start_wp_id), graph.index.get(dest_wp_id)
+    if start is None or goal is None: return None
+    table = route_tables.get_table(model, difficulty)
+    if table is not None:
+        path = table.path(start, goal)
+    else:
+        result = router.engine_for(model, difficulty).shortest_path(start, goal)
+        path = result[1] if result else None
+    return graph.path_waypoints(path) if path else None
+
+def reachable_destinations(start_wp_id, difficulty):
+    """Set of waypoint ids that can be reached from a waypoint at a difficulty (for filtering destination menus)."""
+    model = resort_model.get_model()
+    graph = model.graph(difficulty)
+    start = graph.index.get(start_wp_id)
+    if start is None: return set()
+    table = route_tables.get_table(model, difficulty)
+    if table is not None:
+        return {graph.ids[node] for node in np.flatnonzero(table.reachable_from(start))}
+    return {graph.ids[node] for node in router.engine_for(model, difficulty).distances_from(start)}
 
 # --- Main Mapper Functions ---
 def build_resort_graph(difficulty_filter):
-    all_waypoints = db_manager.get_all_waypoints()
-    all_runs = db_manager.get_all_runs_structured() 
-    nodes = {wp['id']: wp for wp in all_waypoints}
-    graph = {wp['id']: {} for wp in all_waypoints}
-    difficulty_map = {'Green': 1, 'Blue': 2, 'Black': 3, 'Lift': 0}
-    max_difficulty = difficulty_map.get(difficulty_filter, 1)
-    for run in all_runs:
-        run_difficulty = difficulty_map.get(run.get('difficulty'), 4)
-        if run_difficulty > max_difficulty and run.get('type') == 'Run': continue
-        waypoint_ids = run['waypoints_list']
-        for i in range(len(waypoint_ids) - 1):
-            start_node, end_node = nodes.get(waypoint_ids[i]), nodes.get(waypoint_ids[i+1])
-            if start_node and end_node:
-                cost = haversine_distance(start_node, end_node)
-                graph[start_node['id']][end_node['id']] = cost
-                if run.get('type') == 'Lift': graph[end_node['id']][start_node['id']] = cost 
-    return nodes, graph
+    """Returns the CompiledGraph for a difficulty; it is compiled once per resort model version."""
+    return resort_model.get_model().graph(difficulty_filter)
 
 def check_path_existence(start_wp_id, dest_wp_id, difficulty):
-    nodes, graph = build_resort_graph(difficulty)
-    if start_wp_id not in nodes or dest_wp_id not in nodes: return False
-    return a_star_search(nodes, graph, start_wp_id, dest_wp_id) is not None
+    model = resort_model.get_model()
+    graph = model.graph(difficulty)
+    start, goal = graph.index.get(start_wp_id), graph.index.get(dest_wp_id)
+    if start is None or goal is None: return False
+    table = route_tables.get_table(model, difficulty)
+    if table is not None: return bool(table.reachable(start, goal))
+    return router.engine_for(model, difficulty).shortest_path(start, goal) is not None
 
 def find_n_closest_waypoints(current_location, n=5):
-    all_waypoints = db_manager.get_all_waypoints()
-    if not all_waypoints or not has_gps_data(current_location): return []
-    for wp in all_waypoints: wp['distance'] = haversine_distance(current_location, wp)
-    return sorted(all_waypoints, key=lambda x: x['distance'])[:n]
+    if not has_gps_data(current_location): return []
+    found = spatial_index.get_index(resort_model.get_model()).nearest(current_location['lat'], current_location['lon'], n)
+    # Copies, so the shared model's waypoints are never modified
+    return [dict(wp, distance=distance) for distance, wp in found]
 
 def find_closest_poi(current_location, poi_type):
-    all_waypoints = db_manager.get_all_waypoints()
-    if not all_waypoints or not has_gps_data(current_location): return None
-    
-    poi_waypoints = [wp for wp in all_waypoints if wp.get('type') == poi_type]
-    if not poi_waypoints: return None
+    if not has_gps_data(current_location): return None
+    found = spatial_index.get_index(resort_model.get_model()).nearest(current_location['lat'], current_location['lon'], 1, poi_type)
+    if not found: return None
+    distance, wp = found[0]
+    return dict(wp, distance_m=distance)
 
-    for wp in poi_waypoints: wp['distance_m'] = haversine_distance(current_location, wp)
-    return min(poi_waypoints, key=lambda x: x['distance_m'])
+def find_waypoints_within(current_location, radius_m, wp_type=None):
+    """Waypoints (optionally of one type) within radius_m of the current location, closest first."""
+    if not has_gps_data(current_location): return []
+    found = spatial_index.get_index(resort_model.get_model()).within(current_location['lat'], current_location['lon'], radius_m, wp_type)
+    return [dict(wp, distance_m=distance) for distance, wp in found]
+
+def find_routes(start_wp_id, dest_wp_id, difficulty, k=None):
+    """
+    Up to k routes (ROUTE_ALTERNATIVES by default) ranked by length, each
+    different enough from the ones above it; see
+    router.RoutingEngine.k_shortest_paths. Deterministic: the same request
+    always gives the same routes in the same order. Each route carries the
+    destination's shortest-path tree, for rerouting (see update_position).
+    """
+    model = resort_model.get_model()
+    graph = model.graph(difficulty)
+    start, goal = graph.index.get(start_wp_id), graph.index.get(dest_wp_id)
+    if start is None or goal is None: return []
+    tree = router.tree_to(model, difficulty, goal)
+    paths = router.engine_for(model, difficulty).k_shortest_paths(start, goal, k or ROUTE_ALTERNATIVES, tree.cost)
+    return [{'waypoints': graph.path_waypoints(path), 'current_wp_index': 0, 'is_smart_route': True, 'distance_m': cost,
+             'tree': tree, 'off_route_fixes': 0}
+            for cost, path in paths]
 
 def find_smart_route_to_waypoint(start_waypoint_id, dest_wp_id, difficulty):
-    print(f"MAPPER: Finding multiple routes from WP ID {start_waypoint_id} to WP ID {dest_wp_id} with difficulty {difficulty}")
-    nodes, graph = build_resort_graph(difficulty)
-    if not nodes or start_waypoint_id not in nodes: return None
-    all_runs = db_manager.get_all_runs_structured()
-    difficulty_map = {'Green': 1, 'Blue': 2, 'Black': 3, 'Lift': 0}
-    max_difficulty_val = difficulty_map.get(difficulty, 1)
-    potential_first_steps = []
-    for run in all_runs:
-        if run['waypoints_list'][0] == start_waypoint_id:
-            run_difficulty_val = difficulty_map.get(run['difficulty'], 4)
-            if run_difficulty_val <= max_difficulty_val or run['type'] == 'Lift':
-                potential_first_steps.append(run)
-    if not potential_first_steps: print("MAPPER: No valid starting runs found."); return None
-    all_possible_routes = []
-    for first_step_run in potential_first_steps:
-        intermediate_start_wp_id = first_step_run['waypoints_list'][-1]
-        if intermediate_start_wp_id == dest_wp_id:
-            path_waypoints = [nodes[wp_id] for wp_id in first_step_run['waypoints_list']]
-            all_possible_routes.append({'waypoints': path_waypoints, 'current_wp_index': 0})
-            continue
-        remaining_path = a_star_search(nodes, graph, intermediate_start_wp_id, dest_wp_id)
-        if remaining_path:
-            first_step_waypoints = [nodes[wp_id] for wp_id in first_step_run['waypoints_list']]
-            full_path = first_step_waypoints + remaining_path[1:]
-            all_possible_routes.append({'waypoints': full_path, 'current_wp_index': 0})
-    if not all_possible_routes: print("MAPPER: No complete paths found."); return None
-    random.shuffle(all_possible_routes)
-    top_routes = all_possible_routes[:5]
-    selected_route = random.choice(top_routes)
-    selected_route['is_smart_route'] = True
+    """The best route, with the next best ones under 'alternatives'."""
+    print(f"MAPPER: Finding routes from WP ID {start_waypoint_id} to WP ID {dest_wp_id} with difficulty {difficulty}")
+    routes = find_routes(start_waypoint_id, dest_wp_id, difficulty)
+    if not routes: print("MAPPER: No complete paths found."); return None
+    selected_route = routes[0]
+    selected_route['alternatives'] = routes[1:]
     return selected_route
 
-def start_route(route_id, all_runs_by_id):
-    route_details = db_manager.get_route_by_id(route_id)
+class RunAccumulator:
+    """
+    Statistics for one run of a route, updated in O(1) per fix from the
+    latest fix alone, so memory stays the same however long the run is.
+
+    Descent counts every drop with DESCENT_HYSTERESIS_M of hysteresis (like
+    trip_logger.TripAggregates), distance is summed between consecutive fixes
+    and max_incline_deg is the steepest incline seen either way. end_wp_id,
+    the waypoint that finishes the run, is resolved once at start_route.
+    """
+    def __init__(self, run_id, run_name, end_wp_id):
+        self.run_id = run_id
+        self.run_name = run_name
+        self.end_wp_id = end_wp_id
+        self.start_time = self.last_time = None
+        self.start_alt = self.last_alt = self.reference_alt = None
+        self.last_location = None
+        self.top_speed_kph = self.descent_m = self.distance_m = self.max_incline_deg = 0.0
+
+    def add(self, location):
+        """Folds in one fix: a location dict with lat, lon and optionally alt_m, speed_kph, incline_deg and time."""
+        fix_time = location.get('time') or time.time()
+        alt = location.get('alt_m')
+        if self.start_time is None:
+            self.start_time, self.start_alt = fix_time, alt
+        elif self.last_time is not None and 0 < fix_time - self.last_time <= MAX_SAMPLE_GAP_SECONDS:
+            self.distance_m += distance_m(self.last_location, location)
+        self.top_speed_kph = max(self.top_speed_kph, location.get('speed_kph') or 0.0)
+        self.max_incline_deg = max(self.max_incline_deg, abs(location.get('incline_deg') or 0.0))
+        if alt is not None:
+            if self.reference_alt is None or alt > self.reference_alt + DESCENT_HYSTERESIS_M:
+                self.reference_alt = alt
+            elif alt < self.reference_alt - DESCENT_HYSTERESIS_M:
+                self.descent_m += self.reference_alt - alt
+                self.reference_alt = alt
+            self.last_alt = alt
+        self.last_time, self.last_location = fix_time, location
+
+    def analytics(self):
+        """The finished run's analytics dict (as shown on the HUD and logged by db_manager.log_completed_run)."""
+        duration = (self.last_time - self.start_time) if self.start_time is not None else 0.0
+        return {
+            'run_id': self.run_id, 'run_name': self.run_name,
+            'start_time': self.start_time, 'end_time': self.last_time,
+            'duration_seconds': duration,
+            'vertical_m': (self.start_alt - self.last_alt) if self.start_alt is not None and self.last_alt is not None else 0,
+            'descent_m': self.descent_m,
+            'distance_m': self.distance_m,
+            'top_speed_kph': self.top_speed_kph,
+            'avg_speed_kph': self.distance_m / duration * 3.6 if duration > 0 else 0.0,
+            'max_incline_deg': self.max_incline_deg,
+        }
+
+def _route_tree(model, run_ids, all_runs_by_id, dest_wp_id):
+    """
+    Shortest-path tree to the end of a predefined route, at the lowest
+    difficulty that allows all of its runs (so rerouting never sends the
+    skier down anything harder than the route itself). None if the end
+    isn't on that graph.
+    """
+    levels = [resort_model.DIFFICULTY_LEVELS.get(all_runs_by_id[run_id].get('difficulty'), 3)
+              for run_id in run_ids if run_id in all_runs_by_id and all_runs_by_id[run_id].get('type') == 'Run']
+    level = min(max(levels + [1]), 3)
+    difficulty = next(name for name, value in resort_model.DIFFICULTY_LEVELS.items() if value == level)
+    goal = model.graph(difficulty).index.get(dest_wp_id)
+    return router.tree_to(model, difficulty, goal) if goal is not None else None
+
+def _ghost_race(model, run):
+    return ghost.GhostRace(run, [model.waypoints_by_id[wp_id] for wp_id in run['waypoints_list'] if wp_id in model.waypoints_by_id])
+
+def start_route(route_id, all_runs_by_id=None):
+    model = resort_model.get_model()
+    all_runs_by_id = all_runs_by_id or model.runs_by_id
+    route_details, initial_waypoints = model.routes_by_id.get(route_id), model.route_waypoints(route_id)
     if not route_details or not route_details.get('runs_list'): return None
-    
-    initial_waypoints = db_manager.get_waypoints_for_route(route_id)
     if not initial_waypoints: return None
     
-    run_log_data = []
+    run_log_data, ghost_races = [], [] # One of each per run, in order
     for run_id in route_details.get('runs_list', []):
         run_info = all_runs_by_id.get(run_id)
-        if run_info:
-            run_log_data.append({
-                'run_id': run_id,
-                'run_name': run_info['name'],
-                'start_time': None, 'end_time': None,
-                'start_alt': None, 'end_alt': None,
-                'points': []
-            })
+        if run_info and run_info.get('waypoints_list'):
+            run_log_data.append(RunAccumulator(run_id, run_info['name'], run_info['waypoints_list'][-1]))
+            ghost_races.append(_ghost_race(model, run_info))
 
     return {
         'waypoints': initial_waypoints, 'current_wp_index': 0,
         'runs_in_route': route_details['runs_list'],
         'run_log_data': run_log_data,
-        'current_run_log_index': 0
+        'ghost_races': ghost_races,
+        'is_ghost_race': any(race.has_ghost for race in ghost_races),
+        'current_run_log_index': 0,
+        'tree': _route_tree(model, route_details['runs_list'], all_runs_by_id, initial_waypoints[-1]['id']),
+        'off_route_fixes': 0,
     }
 
+def _distance_from_route(projection, active_route, x, y):
+    """
+    Metres from a projected position to the leg being skied and the one
+    after it (the next waypoint may have been passed without coming within
+    PROXIMITY_RADIUS_METERS of it).
+    """
+    index = active_route['current_wp_index']
+    legs = [wp for wp in active_route['waypoints'][max(index - 1, 0):index + 2] if has_gps_data(wp)]
+    if not legs: return 0.0
+    xs, ys = projection.to_xy_arrays([wp['lat'] for wp in legs], [wp['lon'] for wp in legs])
+    if len(legs) == 1: return float(geo.one_to_many(x, y, xs, ys)[0])
+    return float(geo.point_to_segments(x, y, xs[:-1], ys[:-1], xs[1:], ys[1:]).min())
+
+def _reroute_if_off_route(active_route, current_location):
+    """
+    Replaces the rest of a route when the skier has left it for
+    OFF_ROUTE_FIXES fixes in a row: snaps them onto the nearest segment that
+    still leads to the destination and walks up the route's shortest-path
+    tree from its end, so no new search is needed. Returns the new route as
+    node indices from the start of that segment (the skier is on its first
+    edge, not yet at the route's first waypoint), or None if it didn't change.
+    """
+    tree = active_route['tree']
+    projection = tree.graph.projection
+    if projection is None: return None
+    x, y = projection.to_xy(current_location['lat'], current_location['lon'])
+    if _distance_from_route(projection, active_route, x, y) <= OFF_ROUTE_METERS:
+        active_route['off_route_fixes'] = 0
+        return None
+    active_route['off_route_fixes'] = active_route.get('off_route_fixes', 0) + 1
+    if active_route['off_route_fixes'] < OFF_ROUTE_FIXES: return None
+    active_route['off_route_fixes'] = 0
+
+    snapped = tree.nearest_edge(x, y)
+    if snapped is None: return None
+    start, end, _ = snapped
+    path = tree.path_from(end)
+    remaining = [wp['id'] for wp in active_route['waypoints'][active_route['current_wp_index']:]]
+    if [tree.graph.ids[node] for node in path] == remaining: return None # Nearest to the planned route after all
+    active_route['waypoints'] = tree.graph.path_waypoints(path)
+    active_route['current_wp_index'] = 0
+    active_route['distance_m'] = tree.cost[end]
+    active_route.pop('alternatives', None) # They started from where the skier no longer is
+    print(f"MAPPER: Off route, rerouting via '{active_route['waypoints'][0]['name']}'.")
+    audio_handler.speak("Rerouting")
+    return [start] + path
+
+def _runs_along(graph, path):
+    """The runs a path of node indices follows, in order, as (run, index of the node where the path leaves it)."""
+    runs = []
+    for i, (start, end) in enumerate(zip(path, path[1:]), 1):
+        run = graph.edge_run(start, end)
+        if run is None: continue
+        if runs and runs[-1][0]['id'] == run['id']:
+            runs[-1] = (run, i)
+        else:
+            runs.append((run, i))
+    return runs
+
+def _finish_run(run_log, run_ghost):
+    """Logs a run of a route as completed (and saves its ghost race as the PB if it beat it); returns its analytics."""
+    analytics = run_log.analytics()
+    if run_ghost and run_ghost.finish():
+        analytics['new_personal_best'] = True
+        audio_handler.speak("New personal best!")
+    db_manager.log_completed_run(analytics) # Log to daily DB
+    return analytics
+
+def _replan_runs(active_route, path):
+    """
+    Rebuilds a rerouted route's per-run state from its new path (node
+    indices, see _reroute_if_off_route), so every run on the new way down
+    is logged and raced when the path leaves it. The run being skied
+    carries on if the new path continues down it; otherwise it is closed
+    where the skier left it (logged like a run RunDetector ends early, and
+    only a PB if it was skied to the end). Returns the closed run's
+    analytics, or None.
+    """
+    model, graph = resort_model.get_model(), active_route['tree'].graph
+    current_run_log, current_ghost = _current_run(active_route)
+    run_log_data, ghost_races, closed = [], [], None
+    for run, end in _runs_along(graph, path):
+        end_wp_id = graph.ids[path[end]]
+        if not run_log_data and current_run_log and current_run_log.run_id == run['id']:
+            current_run_log.end_wp_id = end_wp_id
+            run_log_data.append(current_run_log)
+            ghost_races.append(current_ghost)
+            continue
+        run_log_data.append(RunAccumulator(run['id'], run['name'], end_wp_id))
+        ghost_races.append(_ghost_race(model, run))
+    if current_run_log and current_run_log not in run_log_data and current_run_log.start_time is not None:
+        closed = _finish_run(current_run_log, current_ghost)
+    active_route['run_log_data'], active_route['ghost_races'] = run_log_data, ghost_races
+    active_route['current_run_log_index'] = 0
+    active_route['is_ghost_race'] = any(race is not None and race.has_ghost for race in ghost_races)
+    return closed
+
+def _current_run(active_route):
+    """(RunAccumulator, GhostRace or None) for the run being skied on a route, or (None, None)."""
+    index = active_route.get('current_run_log_index', 0)
+    if index >= len(active_route.get('run_log_data', ())): return None, None
+    ghost_races = active_route.get('ghost_races')
+    return active_route['run_log_data'][index], ghost_races[index] if ghost_races else None
+
+def _route_progress(active_route):
+    """The route's ProgressTracker, rebuilt whenever its waypoints are replaced (a new route or a reroute)."""
+    tracker = active_route.get('progress')
+    if tracker is None or tracker.waypoints is not active_route['waypoints']:
+        tracker = active_route['progress'] = route_progress.ProgressTracker(active_route['waypoints'])
+    return tracker
+
 def update_position(active_route, current_location):
     if not active_route or not has_gps_data(current_location):
         return {'waypoint_info': get_current_waypoint_info(active_route)}
@@ -155,53 +333,54 @@ def update_position(active_route, current_location):
     if active_route['current_wp_index'] >= len(active_route['waypoints']):
         return None 
     
-    current_run_log = None
-    if 'run_log_data' in active_route and active_route['current_run_log_index'] < len(active_route['run_log_data']):
-        current_run_log = active_route['run_log_data'][active_route['current_run_log_index']]
-        if current_run_log['start_time'] is None:
-            current_run_log['start_time'] = time.time()
-            current_run_log['start_alt'] = current_location.get('alt_m')
-        current_run_log['points'].append(current_location)
+    current_run_log, current_ghost = _current_run(active_route)
+    ghost_gap = None
+    if current_run_log:
+        current_run_log.add(current_location)
+    if current_ghost:
+        ghost_gap = current_ghost.update(current_location)
 
-    next_wp = active_route['waypoints'][active_route['current_wp_index']]
-    distance_to_wp = haversine_distance(current_location, next_wp)
     return_data = {}
+    rerouted = _reroute_if_off_route(active_route, current_location) if active_route.get('tree') is not None else None
+    if rerouted:
+        return_data['rerouted'] = True
+        if 'run_log_data' in active_route: # A predefined route: its runs changed with it
+            closed = _replan_runs(active_route, rerouted)
+            if closed: return_data['analytics'] = closed
+            current_run_log, current_ghost = _current_run(active_route)
+            ghost_gap = current_ghost.gap_seconds if current_ghost else None
 
-    if distance_to_wp < PROXIMITY_RADIUS_METERS:
-        active_route['current_wp_index'] += 1
-        
-        # Check if the just-completed waypoint was the end of a run
-        if current_run_log:
-            run_info = db_manager.get_all_runs_structured() # Inefficient, better to pass this in
-            run_info_map = {r['id']: r for r in run_info}
-            current_run_definition = run_info_map.get(current_run_log['run_id'])
-            
-            if current_run_definition and next_wp['id'] == current_run_definition['waypoints_list'][-1]:
-                current_run_log['end_time'] = time.time()
-                current_run_log['end_alt'] = current_location.get('alt_m')
-                
-                # --- Calculate Analytics ---
-                analytics = {
-                    'run_name': current_run_log['run_name'],
-                    'duration_seconds': current_run_log['end_time'] - current_run_log['start_time'],
-                    'vertical_m': (current_run_log['start_alt'] - current_run_log['end_alt']) if current_run_log['start_alt'] and current_run_log['end_alt'] else 0,
-                    'top_speed_kph': max(p.get('speed_kph', 0) for p in current_run_log['points']) if current_run_log['points'] else 0
-                }
-                return_data['analytics'] = analytics
-                db_manager.log_completed_run(analytics) # Log to daily DB
-                
+    progress = _route_progress(active_route)
+    progress.update(current_location)
+    waypoints, index = active_route['waypoints'], active_route['current_wp_index']
+    next_wp = waypoints[index]
+    distance_to_wp = distance_m(current_location, next_wp)
+
+    # Waypoints are passed by coming within PROXIMITY_RADIUS_METERS or by being overtaken along the track.
+    passed_to = max(progress.next_index, index + 1 if distance_to_wp < PROXIMITY_RADIUS_METERS else index)
+    if passed_to > index:
+        for passed_wp in waypoints[index:passed_to]:
+            # Check if the passed waypoint was the end of a run
+            if current_run_log and passed_wp['id'] == current_run_log.end_wp_id:
+                return_data['analytics'] = _finish_run(current_run_log, current_ghost)
                 active_route['current_run_log_index'] += 1
+                current_run_log, current_ghost = _current_run(active_route)
+                ghost_gap = None
+        active_route['current_wp_index'] = passed_to
 
-        if active_route['current_wp_index'] >= len(active_route['waypoints']):
+        if passed_to >= len(waypoints):
             audio_handler.speak("Route finished.")
             return None 
 
-        new_next_wp = active_route['waypoints'][active_route['current_wp_index']]
-        audio_handler.speak(f"Next, {new_next_wp['name']}")
-        distance_to_wp = haversine_distance(current_location, new_next_wp)
-        next_wp = new_next_wp
+        next_wp = waypoints[passed_to]
+        audio_handler.speak(f"Next, {next_wp['name']}")
+        distance_to_wp = distance_m(current_location, next_wp)
 
-    return_data['waypoint_info'] = {'name': next_wp['name'], 'distance_m': distance_to_wp}
+    return_data['waypoint_info'] = {
+        'name': next_wp['name'], 'distance_m': distance_to_wp,
+        'remaining_m': progress.remaining_m, 'percent_complete': progress.fraction_complete * 100, 'eta_seconds': progress.eta_seconds,
+        'ghost_gap_seconds': ghost_gap,
+    }
     return return_data
 
 def get_current_waypoint_info(active_route):
@@ -0,0 +1,76 @@
+import time
+import json
+import os
+from array import array
+from datetime import datetime
+
+# --- Configuration ---
+WINDOW_SIZE = 512 # Samples kept per stage (~30 s of main loop at ~15 Hz).
+DUMP_DIRECTORY = 'diagnostics'
+
+class StageProfiler:
+    """
+    Lightweight timing of the main loop's stages.
+
+    Each stage keeps its last WINDOW_SIZE durations in a fixed-size ring
+    buffer (array of doubles), so memory is constant and recording a sample
+    is one perf_counter() call plus an array store. Percentiles are only
+    computed when someone asks (the DIAGNOSTICS page or a dump).
+    """
+    def __init__(self, stages, window=WINDOW_SIZE):
+        self.window = window
+        self._samples = {stage: array('d', bytes(8 * window)) for stage in stages}
+        self._counts = {stage: 0 for stage in stages}
+        self.started = time.time()
+
+    def record(self, stage, seconds):
+        """Stores one duration for a stage."""
+        count = self._counts[stage]
+        self._samples[stage][count % self.window] = seconds
+        self._counts[stage] = count + 1
+
+    def lap(self, stage, since, excluded=0.0):
+        """Records the time from `since` to now (minus `excluded`) and returns now, to chain stages."""
+        now = time.perf_counter()
+        self.record(stage, now - since - excluded)
+        return now
+
+    def _window(self, stage):
+        count = self._counts[stage]
+        samples = self._samples[stage]
+        return samples[:count] if count < self.window else samples
+
+    def percentile(self, stage, fraction):
+        """Duration in seconds below which `fraction` of the recent samples fall."""
+        samples = sorted(self._window(stage))
+        if not samples: return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+    def mean(self, stage):
+        samples = self._window(stage)
+        return sum(samples) / len(samples) if len(samples) else 0.0
+
+    def summary(self):
+        """Per-stage count, mean, p50, p95 and max in milliseconds."""
+        summary = {}
+        for stage in self._samples:
+            window = self._window(stage)
+            summary[stage] = {
+                'count': self._counts[stage],
+                'mean_ms': self.mean(stage) * 1000,
+                'p50_ms': self.percentile(stage, 0.50) * 1000,
+                'p95_ms': self.percentile(stage, 0.95) * 1000,
+                'max_ms': max(window) * 1000 if len(window) else 0.0,
+            }
+        return summary
+
+    def dump(self, extra=None):
+        """Writes the summary (plus any extra live values) to a timestamped JSON file and returns its path."""
+        os.makedirs(DUMP_DIRECTORY, exist_ok=True)
+        path = os.path.join(DUMP_DIRECTORY, f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json")
+        report = {'uptime_s': time.time() - self.started, 'stages': self.summary()}
+        if extra: report.update(extra)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"PROFILER: Diagnostics written to {path}")
+        return path
@@ -0,0 +1,229 @@
+import hashlib
+import math
+import threading
+import time
+from array import array
+import db_manager
+import geo
+
+# --- Configuration ---
+VERSION_CHECK_INTERVAL = 1.0 # Seconds between checks for edits made by other processes (web_manager).
+DIFFICULTY_LEVELS = {'Green': 1, 'Blue': 2, 'Black': 3, 'Lift': 0}
+
+def _segment_length(p1, p2):
+    """Metres between two waypoints, or inf if either has no coordinates."""
+    if p1.get('lat') is None or p1.get('lon') is None or p2.get('lat') is None or p2.get('lon') is None:
+        return math.inf
+    return geo.distance_m(p1, p2)
+
+class CompiledGraph:
+    """
+    The segment graph for one difficulty, compiled to integer node indices in
+    compressed sparse row form: node i is waypoint ids[i] and its outgoing
+    edges are positions offsets[i] to offsets[i + 1] of targets (node
+    indices), costs (metres) and edge_runs (the run each segment belongs to).
+
+    Parallel segments keep the shortest one; segments touching a waypoint
+    without coordinates are left out, as they could never be routed over.
+    xs and ys are the nodes' projected coordinates (0 if unlocated), and
+    heuristic_scale the largest factor that keeps scaled straight-line
+    distance a lower bound on path cost (every edge costs at least
+    heuristic_scale times its straight-line length), for admissible A*.
+    Built once per ResortModel snapshot (see ResortModel.graph) and never
+    modified afterwards. reversed() gives the same graph with every edge
+    turned around, for searches towards a goal.
+    """
+    def __init__(self, difficulty, waypoints, edges, is_reversed=False):
+        """waypoints in node order; edges is {(start index, end index): (metres, run)}."""
+        self.difficulty = difficulty
+        self.is_reversed = is_reversed
+        self.waypoints = waypoints
+        self.ids = [wp['id'] for wp in waypoints]
+        self.index = {wp_id: i for i, wp_id in enumerate(self.ids)}
+        self._reversed = None
+
+        self.offsets = array('l', [0] * (len(self.ids) + 1))
+        self.targets, self.costs, self.edge_runs = array('l'), array('d'), []
+        for (start, end), (length, run) in sorted(edges.items(), key=lambda item: item[0]):
+            self.offsets[start + 1] += 1
+            self.targets.append(end); self.costs.append(length); self.edge_runs.append(run)
+        for i in range(len(self.ids)):
+            self.offsets[i + 1] += self.offsets[i]
+
+        located = [wp for wp in self.waypoints if wp.get('lat') is not None and wp.get('lon') is not None]
+        self.projection = geo.LocalProjection(located[0]['lat'], located[0]['lon']) if located else None
+        self.xs, self.ys = array('d', [0.0] * len(self.ids)), array('d', [0.0] * len(self.ids))
+        for i, wp in enumerate(self.waypoints):
+            if self.projection and wp.get('lat') is not None and wp.get('lon') is not None:
+                self.xs[i], self.ys[i] = self.projection.to_xy(wp['lat'], wp['lon'])
+        self.heuristic_scale = 1.0
+        for start in range(len(self.ids)):
+            for edge in range(self.offsets[start], self.offsets[start + 1]):
+                end = self.targets[edge]
+                straight = math.hypot(self.xs[end] - self.xs[start], self.ys[end] - self.ys[start])
+                if straight > 0:
+                    self.heuristic_scale = min(self.heuristic_scale, self.costs[edge] / straight)
+
+    @classmethod
+    def compile(cls, model, difficulty):
+        """Builds the graph of a ResortModel at a difficulty."""
+        waypoints = list(model.waypoints_by_id.values())
+        index = {wp['id']: i for i, wp in enumerate(waypoints)}
+        shortest = {} # (start index, end index) -> (metres, run)
+        for start_id, edges in model.adjacency.items():
+            for end_id, length, run in edges:
+                if not math.isfinite(length) or not model.run_allowed(run, difficulty): continue
+                key = (index[start_id], index[end_id])
+                if key not in shortest or length < shortest[key][0]:
+                    shortest[key] = (length, run)
+        return cls(difficulty, waypoints, shortest)
+
+    def reversed(self):
+        """This graph with every edge turned around, built on first use."""
+        if self._reversed is None:
+            edges = {(self.targets[edge], start): (self.costs[edge], self.edge_runs[edge])
+                     for start in range(self.node_count) for edge in range(self.offsets[start], self.offsets[start + 1])}
+            self._reversed = CompiledGraph(self.difficulty, self.waypoints, edges, not self.is_reversed)
+        return self._reversed
+
+    @property
+    def fingerprint(self):
+        """Digest of the graph's structure and costs, to tell whether data derived from it is still valid."""
+        digest = hashlib.sha1(f"{self.difficulty}{' reversed' if self.is_reversed else ''}".encode())
+        digest.update(array('l', self.ids).tobytes())
+        for part in (self.offsets, self.targets, self.costs):
+            digest.update(part.tobytes())
+        return digest.hexdigest()
+
+    @property
+    def node_count(self):
+        return len(self.ids)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    def edges(self, node):
+        """(target index, cost) pairs leaving a node index."""
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return zip(self.targets[start:end], self.costs[start:end])
+
+    def edge_index(self, start, end):
+        """Position of the start -> end edge (node indices) in the edge arrays, or None if there is no such edge."""
+        for edge in range(self.offsets[start], self.offsets[start + 1]):
+            if self.targets[edge] == end: return edge
+        return None
+
+    def edge_run(self, start, end):
+        """The run a start -> end segment (node indices) belongs to, or None if there is no such edge."""
+        edge = self.edge_index(start, end)
+        return self.edge_runs[edge] if edge is not None else None
+
+    def path_cost(self, path):
+        """Metres along a path of node indices (which must follow existing edges)."""
+        return sum(self.costs[self.edge_index(start, end)] for start, end in zip(path, path[1:]))
+
+    def path_waypoints(self, path):
+        """Node indices -> waypoint dicts."""
+        return [self.waypoints[node] for node in path]
+
+class ResortModel:
+    """
+    An in-memory snapshot of the resort in skidata.db: waypoints, runs and
+    routes by id plus the segment adjacency the router works on.
+
+    Snapshots are never modified after loading (treat the dicts as
+    read-only); get_model() swaps in a fresh one when the database changes.
+    Anything derived from a snapshot can be cached on it with derived(), and
+    is thrown away together with it.
+    """
+    def __init__(self, waypoints, runs, routes, version=None):
+        self.version = version
+        self.waypoints = waypoints # Ordered by name
+        self.waypoints_by_id = {wp['id']: wp for wp in waypoints}
+        self.waypoints_by_type = {}
+        for wp in waypoints:
+            self.waypoints_by_type.setdefault(wp.get('type'), []).append(wp)
+        self.runs = runs # Ordered by name
+        self.runs_by_id = {run['id']: run for run in runs}
+        self.routes = routes
+        self.routes_by_id = {route['id']: route for route in routes}
+
+        # adjacency[wp_id] = [(next wp_id, length_m, run), ...]; lifts can be ridden (walked) both ways.
+        self.runs_starting_at = {}
+        self.adjacency = {wp['id']: [] for wp in waypoints}
+        for run in runs:
+            waypoint_ids = [wp_id for wp_id in run['waypoints_list'] if wp_id in self.waypoints_by_id]
+            if waypoint_ids:
+                self.runs_starting_at.setdefault(waypoint_ids[0], []).append(run)
+            for start_id, end_id in zip(waypoint_ids, waypoint_ids[1:]):
+                length = _segment_length(self.waypoints_by_id[start_id], self.waypoints_by_id[end_id])
+                self.adjacency[start_id].append((end_id, length, run))
+                if run.get('type') == 'Lift':
+                    self.adjacency[end_id].append((start_id, length, run))
+        self._derived = {}
+        self._derived_lock = threading.RLock() # Builders may use other derived values
+
+    @staticmethod
+    def run_allowed(run, difficulty):
+        """True if the run may be used at this difficulty (lifts always may)."""
+        if run.get('type') != 'Run': return True
+        return DIFFICULTY_LEVELS.get(run.get('difficulty'), 4) <= DIFFICULTY_LEVELS.get(difficulty, 1)
+
+    def derived(self, key, build):
+        """Returns build(self), computed once per snapshot and cached under key."""
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = build(self)
+            return self._derived[key]
+
+    def graph(self, difficulty):
+        """
+        The CompiledGraph over the runs allowed at this difficulty ('Green',
+        'Blue', 'Black', or 'Lift' for lifts only), built on first use.
+        """
+        return self.derived(('graph', difficulty), lambda model: CompiledGraph.compile(model, difficulty))
+
+    def route_waypoints(self, route_id):
+        """A route's waypoints in order; a waypoint shared by several of its runs appears once."""
+        route = self.routes_by_id.get(route_id)
+        if not route: return []
+        final_waypoints, processed_wp_ids = [], set()
+        for run_id in route['runs_list']:
+            run = self.runs_by_id.get(run_id)
+            for wp_id in run['waypoints_list'] if run else ():
+                if wp_id not in processed_wp_ids and wp_id in self.waypoints_by_id:
+                    final_waypoints.append(self.waypoints_by_id[wp_id]); processed_wp_ids.add(wp_id)
+        return final_waypoints
+
+def load_model(version=None):
+    """Reads the whole resort from skidata.db into a new ResortModel."""
+    return ResortModel(db_manager.get_all_waypoints(), db_manager.get_all_runs_structured(),
+                       db_manager.get_all_routes_structured(), version)
+
+# --- Shared Instance ---
+# The version stamp combines this process's own write counter (checked on
+# every call, so our own edits show up immediately) with SQLite's
+# data_version (checked every VERSION_CHECK_INTERVAL, for other processes).
+_model = None
+_model_lock = threading.Lock()
+_data_version = None
+_last_version_check = 0.0
+_seen_generation = None
+
+def get_model():
+    """Returns the shared ResortModel, reloading it first if skidata.db has changed."""
+    global _model, _data_version, _last_version_check, _seen_generation
+    with _model_lock:
+        now = time.monotonic()
+        generation = db_manager.get_resort_generation()
+        if _model is None or generation != _seen_generation or now - _last_version_check >= VERSION_CHECK_INTERVAL:
+            _data_version = db_manager.get_resort_data_version()
+            _last_version_check, _seen_generation = now, generation
+        version = (db_manager.DB_FILE, _data_version, generation)
+        if _model is None or _model.version != version:
+            started = time.perf_counter()
+            _model = load_model(version)
+            print(f"RESORT_MODEL: Loaded {len(_model.waypoints)} waypoints, {len(_model.runs)} runs/lifts "
+                  f"and {len(_model.routes)} routes in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        return _model
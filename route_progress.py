@@ -0,0 +1,105 @@
+"""
+Progress along a route's polyline.
+
+The route's waypoints are projected once and their cumulative along-track
+distance precomputed. Each fix is then projected onto the closest segment
+among the WINDOW_SEGMENTS starting at the one the skier was last on, so a
+query never looks back (progress only moves forward) and never looks far
+ahead (a route that doubles back on itself can't skip its middle). The
+window's start only ever advances, so each fix costs O(1) amortised.
+
+From the progress come the distance remaining, the fraction complete, an
+ETA from the along-track speed over the last ETA_WINDOW_SECONDS, and which
+waypoints have been overtaken, so navigation moves on even when a fix never
+lands within PROXIMITY_RADIUS_METERS of a waypoint.
+"""
+import collections
+import math
+import time
+import geo
+
+# --- Configuration ---
+WINDOW_SEGMENTS = 4         # Segments looked at per fix, from the current one on
+MAX_OFF_TRACK_METERS = 40.0 # Fixes further than this from the route don't move progress
+ETA_WINDOW_SECONDS = 30.0   # Speed for the ETA is measured over this much recent time
+MIN_ETA_SPEED_MPS = 0.5     # Slower than this (queuing for a lift) there's no ETA
+
+class ProgressTracker:
+    """
+    Monotone progress along the polyline through a list of waypoint dicts.
+    cumulative[i] is the along-track metres from the first waypoint to
+    waypoint i; waypoints without coordinates are skipped over.
+    """
+    def __init__(self, waypoints):
+        self.waypoints = waypoints
+        located = [wp for wp in waypoints if wp.get('lat') is not None and wp.get('lon') is not None]
+        self.projection = geo.LocalProjection(located[0]['lat'], located[0]['lon']) if located else None
+        self.xs, self.ys, self.cumulative = [], [], []
+        distance = 0.0
+        for wp in waypoints:
+            if wp.get('lat') is not None and wp.get('lon') is not None:
+                x, y = self.projection.to_xy(wp['lat'], wp['lon'])
+                if self.xs: distance += math.hypot(x - self.xs[-1], y - self.ys[-1])
+            else: # Takes the position of the waypoint before it
+                x, y = (self.xs[-1], self.ys[-1]) if self.xs else (0.0, 0.0)
+            self.xs.append(x); self.ys.append(y); self.cumulative.append(distance)
+        self.total_m = distance
+        self.segment = 0 # The segment (from waypoint segment to segment + 1) last projected onto
+        self.progress_m = 0.0
+        self.started = False # Nothing counts as passed until a fix has been projected
+        self.recent = collections.deque() # (time, progress_m) over the last ETA_WINDOW_SECONDS
+
+    def update(self, location):
+        """Projects a fix (a dict with lat, lon and optionally time) onto the route. Returns True if it was near enough to count."""
+        if self.projection is None or len(self.xs) < 2: return False
+        x, y = self.projection.to_xy(location['lat'], location['lon'])
+        best = None
+        for segment in range(self.segment, min(self.segment + WINDOW_SEGMENTS, len(self.xs) - 1)):
+            x0, y0, dx, dy = self.xs[segment], self.ys[segment], self.xs[segment + 1] - self.xs[segment], self.ys[segment + 1] - self.ys[segment]
+            length_sq = dx * dx + dy * dy
+            along = min(1.0, max(0.0, ((x - x0) * dx + (y - y0) * dy) / length_sq)) if length_sq > 0 else 0.0
+            distance = math.hypot(x0 + along * dx - x, y0 + along * dy - y)
+            if best is None or distance < best[0]:
+                best = (distance, segment, along)
+        distance, segment, along = best
+        if distance > MAX_OFF_TRACK_METERS: return False
+
+        position = self.cumulative[segment] + along * (self.cumulative[segment + 1] - self.cumulative[segment])
+        if position >= self.progress_m:
+            self.progress_m, self.segment = position, segment
+        self.started = True
+        fix_time = location.get('time') or time.time()
+        self.recent.append((fix_time, self.progress_m))
+        while len(self.recent) > 2 and fix_time - self.recent[1][0] >= ETA_WINDOW_SECONDS:
+            self.recent.popleft()
+        return True
+
+    @property
+    def next_index(self):
+        """Index of the first waypoint not yet overtaken (len(waypoints) once the end has been reached)."""
+        if not self.started: return 0
+        if self.progress_m >= self.total_m: return len(self.cumulative)
+        index = self.segment # Everything before the current segment has been passed
+        while self.cumulative[index] < self.progress_m:
+            index += 1
+        return index
+
+    @property
+    def remaining_m(self):
+        return max(0.0, self.total_m - self.progress_m)
+
+    @property
+    def fraction_complete(self):
+        return self.progress_m / self.total_m if self.total_m > 0 else 1.0
+
+    @property
+    def speed_mps(self):
+        """Along-track speed over the recent window (None until there are two fixes)."""
+        if len(self.recent) < 2: return None
+        (first_time, first_progress), (last_time, last_progress) = self.recent[0], self.recent[-1]
+        return (last_progress - first_progress) / (last_time - first_time) if last_time > first_time else None
+
+    @property
+    def eta_seconds(self):
+        speed = self.speed_mps
+        return self.remaining_m / speed if speed is not None and speed >= MIN_ETA_SPEED_MPS else None
@@ -0,0 +1,254 @@
+"""
+Precomputed all-pairs routing tables.
+
+For each difficulty, a RouteTable holds the shortest distance and the next
+hop between every pair of waypoints, from one Dijkstra per node over the
+CompiledGraph. A route is then a walk down next_hop and "can I get there?"
+a single array lookup, with no search at all.
+
+Tables are saved beside the resort DB as
+skidata.routes.<difficulty>.<graph fingerprint>.v<format>.npy, so a file is
+only ever used for exactly the graph it was computed from. Files are
+memory-mapped rather than read: opening one costs next to nothing, and only
+the pages a query touches are ever brought into RAM (and can be dropped
+again by the OS). The build writes straight into a memory-mapped temporary
+file too, so it doesn't hold a table in RAM either.
+
+When the resort changes the old files are ignored and new ones are built in
+the background, one build per difficulty at a time: a build for a graph
+that has since changed again is abandoned for the newest one, and the files
+of superseded graphs are deleted once it is saved. Routing falls back to A*
+(router.RoutingEngine) until a table is ready. To build them offline, e.g.
+after an import:
+
+    python route_tables.py [path/to/skidata.db]
+"""
+import glob
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import db_manager
+import resort_model
+import router
+
+# --- Configuration ---
+DIFFICULTIES = ('Green', 'Blue', 'Black', 'Lift')
+# Disk budget for the tables of all difficulties together (6 bytes per pair
+# of nodes each): about 2000 nodes when every difficulty has every waypoint.
+# Bigger resorts just use A*. RAM use is only the pages queries touch.
+MAX_TABLE_BYTES = 96 * 1024 * 1024
+TABLE_FORMAT_VERSION = 2
+
+def _dtype(node_count):
+    """One record per (start, goal) pair, so a row of the file is everything about one start node."""
+    return np.dtype([('distance', np.float32), ('next_hop', np.int16 if node_count <= np.iinfo(np.int16).max else np.int32)])
+
+def table_bytes(node_count):
+    return node_count * node_count * _dtype(node_count).itemsize
+
+class BuildCancelled(Exception):
+    """Raised inside RouteTable.compute when the graph being built for has been superseded."""
+
+class RouteTable:
+    """
+    distance[i, j] is the cost in metres of the shortest path from node i to
+    node j of a CompiledGraph (inf if there is none), and next_hop[i, j] the
+    node after i on that path (-1 if there is none, j itself if i == j).
+    Both are fields of one (n, n) record array, usually memory-mapped.
+    """
+    def __init__(self, difficulty, fingerprint, pairs):
+        self.difficulty = difficulty
+        self.fingerprint = fingerprint
+        self.pairs = pairs
+        self.distance = pairs['distance']
+        self.next_hop = pairs['next_hop']
+
+    @classmethod
+    def compute(cls, graph, out=None, cancelled=None):
+        """
+        Computes a graph's table into out (an (n, n) array of _dtype(n),
+        e.g. a memory-mapped file; a new in-memory array by default).
+        cancelled is checked between start nodes; BuildCancelled is raised
+        if it returns True.
+        """
+        n = graph.node_count
+        engine = router.RoutingEngine(graph) # Private engine: doesn't hold up the shared one
+        pairs = np.empty((n, n), dtype=_dtype(n)) if out is None else out
+        row = np.empty(n, dtype=_dtype(n))
+        first_hop = [-1] * n
+        for start in range(n):
+            if cancelled is not None and cancelled(): raise BuildCancelled()
+            nodes, costs, parents = engine.shortest_path_tree(start)
+            # Parents are settled before their children, so each node's first hop is known by then.
+            for node, parent in zip(nodes, parents):
+                first_hop[node] = node if parent in (-1, start) else first_hop[parent]
+            row['distance'], row['next_hop'] = np.inf, -1
+            row['distance'][nodes] = costs
+            row['next_hop'][nodes] = [first_hop[node] for node in nodes]
+            pairs[start] = row # One sequential write per row
+        return cls(graph.difficulty, graph.fingerprint, pairs)
+
+    def reachable(self, start, goal):
+        return self.next_hop[start, goal] >= 0
+
+    def reachable_from(self, start):
+        """Boolean array over all nodes: which can be reached from start."""
+        return self.next_hop[start] >= 0
+
+    def path(self, start, goal):
+        """Node indices of the shortest path from start to goal, or None if there is none."""
+        if self.next_hop[start, goal] < 0: return None
+        path = [start]
+        while start != goal:
+            start = int(self.next_hop[start, goal])
+            path.append(start)
+        return path
+
+    @classmethod
+    def load(cls, path, graph):
+        """Memory-maps the table saved at path for graph; None if it doesn't hold a table of that graph's size."""
+        pairs = np.load(path, mmap_mode='r')
+        if pairs.dtype != _dtype(graph.node_count) or pairs.shape != (graph.node_count, graph.node_count): return None
+        return cls(graph.difficulty, graph.fingerprint, pairs)
+
+def table_path(graph, db_path=None):
+    base = os.path.splitext(db_path or db_manager.DB_FILE)[0]
+    return f"{base}.routes.{graph.difficulty.lower()}.{graph.fingerprint}.v{TABLE_FORMAT_VERSION}.npy"
+
+def _stale_paths(graph, db_path=None):
+    """Saved tables of the same difficulty for other graphs (or formats)."""
+    base = os.path.splitext(db_path or db_manager.DB_FILE)[0]
+    current = table_path(graph, db_path)
+    return [path for path in glob.glob(f"{glob.escape(base)}.routes.{graph.difficulty.lower()}.*.npy") if path != current]
+
+def _load_valid(graph):
+    """The saved table of exactly this graph, memory-mapped, else None."""
+    path = table_path(graph)
+    if not os.path.exists(path): return None
+    try:
+        return RouteTable.load(path, graph)
+    except (OSError, ValueError, EOFError) as e: # Truncated or corrupt files
+        print(f"ROUTE_TABLES: Ignoring unreadable {path}: {e}")
+        return None
+
+def build_table(graph, cancelled=None, db_path=None):
+    """
+    Computes a graph's table into a uniquely named temporary file beside
+    its final path and moves it into place (a reader never sees half a
+    file), then deletes the tables of superseded graphs. Returns the
+    memory-mapped table; raises BuildCancelled if cancelled() said so.
+    db_path defaults to the resort DB the tables are saved beside.
+    """
+    started = time.perf_counter()
+    path = table_path(graph, db_path)
+    n = graph.node_count
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path) or '.')
+    os.close(fd)
+    try:
+        out = np.lib.format.open_memmap(temp_path, mode='w+', dtype=_dtype(n), shape=(n, n))
+        RouteTable.compute(graph, out, cancelled)
+        out.flush()
+        del out
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path): os.remove(temp_path)
+        raise
+    for stale in _stale_paths(graph, db_path):
+        try:
+            os.remove(stale)
+        except OSError as e:
+            print(f"ROUTE_TABLES: Could not remove {stale}: {e}")
+    print(f"ROUTE_TABLES: Built the {graph.difficulty} table ({n} nodes) in {time.perf_counter() - started:.2f} s.")
+    return RouteTable.load(path, graph)
+
+# --- Background Builds ---
+# One builder thread per difficulty at most. A snapshot that needs a table
+# queues its graph in _wanted (replacing any older request); the builder
+# abandons a build as soon as a different graph is wanted and moves on to
+# it, so a burst of resort edits costs one build, not one per edit.
+_build_lock = threading.Lock()
+_building = {} # difficulty -> (fingerprint, [slots waiting for it]) being built
+_wanted = {}   # difficulty -> (graph, [slots waiting for it]) to build next
+_built = {}    # difficulty -> the last table built, for slots that ask just after it was saved
+
+def _request_build(slot, graph):
+    difficulty = graph.difficulty
+    with _build_lock:
+        built = _built.get(difficulty)
+        if built is not None and built.fingerprint == graph.fingerprint:
+            slot.table = built
+            return
+        running = _building.get(difficulty)
+        if running is not None and running[0] == graph.fingerprint:
+            running[1].append(slot)
+            _wanted.pop(difficulty, None) # Back to the graph in progress: don't cancel it
+            return
+        queued = _wanted.get(difficulty)
+        if queued is not None and queued[0].fingerprint == graph.fingerprint:
+            queued[1].append(slot)
+            return
+        _wanted[difficulty] = (graph, [slot])
+        if difficulty in _building: return # The running builder picks it up
+        _building[difficulty] = None
+    threading.Thread(target=_builder, args=(difficulty,), daemon=True).start()
+
+def _builder(difficulty):
+    while True:
+        with _build_lock:
+            if difficulty not in _wanted:
+                del _building[difficulty]
+                return
+            graph, slots = _wanted.pop(difficulty)
+            _building[difficulty] = (graph.fingerprint, slots)
+        try:
+            table = build_table(graph, cancelled=lambda: difficulty in _wanted)
+        except BuildCancelled:
+            print(f"ROUTE_TABLES: Abandoned the {difficulty} table build, the resort changed.")
+            continue
+        except Exception as e:
+            print(f"ROUTE_TABLES: Building the {difficulty} table failed: {e}")
+            continue
+        with _build_lock:
+            _built[difficulty] = table
+            for slot in _building[difficulty][1]: # Including slots that joined during the build
+                slot.table = table
+
+class _TableSlot:
+    """Holds a model's table for one difficulty; table stays None until it has been loaded or built."""
+    def __init__(self, model, difficulty):
+        graph = model.graph(difficulty)
+        self.table = _load_valid(graph)
+        if self.table is None and graph.node_count > 0 and _within_budget(model):
+            _request_build(self, graph)
+
+def _within_budget(model):
+    return sum(table_bytes(model.graph(difficulty).node_count) for difficulty in DIFFICULTIES) <= MAX_TABLE_BYTES
+
+def get_table(model, difficulty):
+    """
+    The RouteTable for a ResortModel snapshot and difficulty, or None while
+    it is being built in the background (or if the resort is too big).
+    """
+    return model.derived(('route_table', difficulty), lambda model: _TableSlot(model, difficulty)).table
+
+def prepare(model):
+    """Loads (or starts building) the tables for every difficulty, so they're ready before the first query."""
+    for difficulty in DIFFICULTIES:
+        get_table(model, difficulty)
+
+if __name__ == '__main__':
+    # Usage: python route_tables.py [path/to/skidata.db]
+    if len(sys.argv) > 1:
+        db_manager.DB_FILE = sys.argv[1]
+    model = resort_model.get_model()
+    if not _within_budget(model):
+        print(f"ROUTE_TABLES: The tables need more than {MAX_TABLE_BYTES / 2**20:.0f} MB; the goggles won't build them, building anyway.")
+    for difficulty in DIFFICULTIES:
+        graph = model.graph(difficulty)
+        if _load_valid(graph) is not None:
+            print(f"ROUTE_TABLES: {table_path(graph)} is up to date.")
+        else:
+            build_table(graph)
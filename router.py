@@ -0,0 +1,262 @@
+import heapq
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+import geo
+
+# --- Configuration ---
+HEURISTIC_CACHE_SIZE = 32 # Goals whose heuristic tables are kept per engine.
+MAX_SHARED_FRACTION = 0.8 # An alternative route may share at most this much of its length with any better one.
+MAX_CANDIDATES_PER_ROUTE = 10 # Give up looking for diverse alternatives after k * this many paths.
+MAX_DETOUR_FACTOR = 1.5 # Alternatives longer than this times the best route aren't offered.
+SNAP_TIE_METERS = 0.5 # Segments this close to equally near count as a tie when snapping a position.
+
+class RoutingEngine:
+    """
+    A* (or Dijkstra, without a goal) over one resort_model.CompiledGraph,
+    working purely on integer node indices.
+
+    The per-node search state (distance, parent, and the generation it was
+    written in) lives in lists allocated once with the engine. Each query
+    bumps the generation instead of clearing them, so a node's entries only
+    count if they were written by the current query and a search costs
+    nothing for the parts of the resort it never touches. Settled nodes are
+    marked with the generation too, and stale heap entries (a node pushed
+    again after its distance improved) are skipped when popped.
+
+    The A* heuristic for a goal is a table of heuristic_scale times the
+    straight-line distance from every node, computed with NumPy in one go
+    the first time that goal is asked for and kept for the next
+    HEURISTIC_CACHE_SIZE goals. It never overestimates, so paths are optimal.
+
+    One query runs at a time per engine (queries take a lock); use
+    engine_for() to get the shared engine of a model and difficulty.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        n = graph.node_count
+        self.distance = [math.inf] * n
+        self.parent = [-1] * n
+        self.visited = [0] * n # Generation that wrote distance/parent
+        self.settled = [0] * n # Generation that settled the node
+        self.generation = 0
+        self._heuristics = OrderedDict()
+        self._lock = threading.Lock()
+        self.settled_nodes = [] # Nodes settled by the last query, in order
+        self._no_heuristic = [0.0] * n # Dijkstra
+
+    def heuristic(self, goal):
+        """Lower bound on the cost from every node to goal, as a list indexed by node."""
+        table = self._heuristics.get(goal)
+        if table is None:
+            xs, ys = np.frombuffer(self.graph.xs), np.frombuffer(self.graph.ys)
+            table = (np.hypot(xs - xs[goal], ys - ys[goal]) * self.graph.heuristic_scale).tolist()
+            self._heuristics[goal] = table
+            if len(self._heuristics) > HEURISTIC_CACHE_SIZE:
+                self._heuristics.popitem(last=False)
+        else:
+            self._heuristics.move_to_end(goal)
+        return table
+
+    def _search(self, start, goal, max_cost, heuristic=None, blocked_nodes=(), blocked_first_hops=()):
+        """
+        The search itself. heuristic overrides the straight-line table (any
+        consistent lower bound works), and nodes whose cost plus heuristic
+        exceeds max_cost are pruned. blocked_nodes are never entered, and
+        blocked_first_hops are the start's neighbours it may not step to.
+        """
+        self.generation += 1
+        generation = self.generation
+        distance, parent, visited, settled = self.distance, self.parent, self.visited, self.settled
+        offsets, targets, costs = self.graph.offsets, self.graph.targets, self.graph.costs
+        if heuristic is None:
+            heuristic = self.heuristic(goal) if goal is not None else self._no_heuristic
+        push, pop = heapq.heappush, heapq.heappop
+        for node in blocked_nodes: # Pre-settled nodes are never relaxed
+            settled[node] = generation
+        distance[start], parent[start], visited[start] = 0.0, -1, generation
+        heap = [(heuristic[start], start)]
+        if blocked_first_hops:
+            settled[start] = generation
+            heap = []
+            for edge in range(offsets[start], offsets[start + 1]):
+                neighbour = targets[edge]
+                if neighbour in blocked_first_hops or settled[neighbour] == generation: continue
+                cost = costs[edge]
+                estimate = cost + heuristic[neighbour]
+                if estimate <= max_cost and (visited[neighbour] != generation or cost < distance[neighbour]):
+                    distance[neighbour], parent[neighbour], visited[neighbour] = cost, start, generation
+                    push(heap, (estimate, neighbour))
+        self.settled_nodes = settled_nodes = [start] if blocked_first_hops else []
+        while heap:
+            _, node = pop(heap)
+            if settled[node] == generation: continue # Stale entry
+            settled[node] = generation
+            settled_nodes.append(node)
+            if node == goal: break
+            base = distance[node]
+            for edge in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[edge]
+                if settled[neighbour] == generation: continue
+                cost = base + costs[edge]
+                estimate = cost + heuristic[neighbour]
+                if estimate > max_cost: continue
+                if visited[neighbour] != generation or cost < distance[neighbour]:
+                    distance[neighbour], parent[neighbour], visited[neighbour] = cost, node, generation
+                    push(heap, (estimate, neighbour))
+
+    def _path_to(self, node):
+        path = []
+        while node != -1:
+            path.append(node)
+            node = self.parent[node]
+        return path[::-1]
+
+    def shortest_path(self, start, goal):
+        """(cost in metres, [node indices from start to goal]) by A*, or None if goal can't be reached."""
+        with self._lock:
+            self._search(start, goal, math.inf)
+            if self.settled[goal] != self.generation: return None
+            return self.distance[goal], self._path_to(goal)
+
+    def distances_from(self, start, max_cost=math.inf):
+        """{node index: cost} for every node reachable from start within max_cost metres (Dijkstra)."""
+        with self._lock:
+            self._search(start, None, max_cost)
+            return {node: self.distance[node] for node in self.settled_nodes}
+
+    def shortest_path_tree(self, start, max_cost=math.inf):
+        """
+        Dijkstra's shortest-path tree from start: (nodes, costs, parents) as
+        parallel lists in the order the nodes were settled, so every node's
+        parent comes before it (the start's parent is -1).
+        """
+        with self._lock:
+            self._search(start, None, max_cost)
+            nodes = self.settled_nodes
+            return nodes, [self.distance[node] for node in nodes], [self.parent[node] for node in nodes]
+
+    def k_shortest_paths(self, start, goal, k, to_goal, max_shared=MAX_SHARED_FRACTION, max_detour=MAX_DETOUR_FACTOR):
+        """
+        Up to k loopless start -> goal paths as (cost, [node indices]),
+        cheapest first, each sharing at most max_shared of its length with
+        every path ranked above it and at most max_detour times as long as
+        the first (Yen's algorithm with a diversity filter).
+
+        to_goal is the cost from every node to goal (inf if none), i.e. the
+        cost of the goal's TreeToGoal (see tree_to()). It is an exact
+        heuristic for the first path and stays a consistent lower bound when
+        edges are blocked, so each spur search only expands nodes that can
+        still be on a path within the detour limit. Lawler's refinement
+        applies: a path only spurs from where it left the path it was
+        derived from, as earlier spurs were already searched. Ties are broken
+        by the node sequence, so the result is deterministic.
+        """
+        if to_goal[start] == math.inf: return []
+        with self._lock:
+            self._search(start, goal, math.inf, heuristic=to_goal)
+            if self.settled[goal] != self.generation: return []
+            first = self._path_to(goal)
+        graph = self.graph
+        chosen = [(self.distance[goal] if start != goal else 0.0, first)]
+        cost_limit = chosen[0][0] * max_detour
+        enumerated = [first] # Every path taken from the candidates, diverse enough or not
+        candidates, seen = [], {tuple(first)}
+        edge_sets = [self._edge_costs(first)]
+        previous, deviation = first, 0
+        while len(chosen) < k and len(enumerated) < k * MAX_CANDIDATES_PER_ROUTE:
+            root_cost = graph.path_cost(previous[:deviation + 1])
+            for i in range(deviation, len(previous) - 1):
+                root, spur = previous[:i + 1], previous[i]
+                blocked_hops = {path[i + 1] for path in enumerated if len(path) > i + 1 and path[:i + 1] == root}
+                with self._lock:
+                    self._search(spur, goal, cost_limit - root_cost, heuristic=to_goal, blocked_nodes=root[:-1], blocked_first_hops=blocked_hops)
+                    if self.settled[goal] == self.generation:
+                        path = root[:-1] + self._path_to(goal)
+                        if tuple(path) not in seen:
+                            seen.add(tuple(path))
+                            heapq.heappush(candidates, (root_cost + self.distance[goal], path, i))
+                root_cost += graph.costs[graph.edge_index(previous[i], previous[i + 1])]
+            if not candidates: break
+            cost, path, deviation = heapq.heappop(candidates)
+            enumerated.append(path)
+            previous = path
+            edges = self._edge_costs(path)
+            if all(sum(length for edge, length in edges.items() if edge in other) <= max_shared * cost for other in edge_sets):
+                chosen.append((cost, path)); edge_sets.append(edges)
+        return chosen
+
+    def _edge_costs(self, path):
+        """{(start, end): metres} for the edges along a path."""
+        return {(a, b): self.graph.costs[self.graph.edge_index(a, b)] for a, b in zip(path, path[1:])}
+
+def engine_for(model, difficulty, reverse=False):
+    """
+    The shared RoutingEngine for a ResortModel snapshot and difficulty (or for
+    its reversed graph, for trees towards a goal), built on first use.
+    """
+    if reverse:
+        return model.derived(('router', difficulty, 'reverse'), lambda model: RoutingEngine(model.graph(difficulty).reversed()))
+    return model.derived(('router', difficulty), lambda model: RoutingEngine(model.graph(difficulty)))
+
+class TreeToGoal:
+    """
+    Shortest-path tree towards one goal: cost[node] is the metres from a
+    node index to the goal (inf if it can't get there) and next_hop[node]
+    the node after it on that path (-1 if none; the goal's is itself).
+    Computed once per navigation with a single Dijkstra on the reversed
+    graph; after that the best route from anywhere is a walk up the tree in
+    O(path length), with no search.
+
+    nearest_edge() snaps a projected position onto the closest segment that
+    can still reach the goal, so a skier who has left the planned route can
+    be given a new one straight away (see mapper.update_position).
+    """
+    def __init__(self, graph, goal, nodes, costs, parents):
+        self.graph = graph
+        self.goal = goal
+        self.cost = [math.inf] * graph.node_count
+        self.next_hop = [-1] * graph.node_count
+        for node, cost, parent in zip(nodes, costs, parents):
+            # A parent in the reversed graph is the next hop in the real one.
+            self.cost[node], self.next_hop[node] = cost, parent if parent != -1 else node
+        # Segments whose end can reach the goal, as arrays for nearest_edge().
+        starts, ends = [], []
+        for start in range(graph.node_count):
+            for edge in range(graph.offsets[start], graph.offsets[start + 1]):
+                if self.next_hop[graph.targets[edge]] != -1:
+                    starts.append(start); ends.append(graph.targets[edge])
+        self._starts, self._ends = np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+        xs, ys = np.frombuffer(graph.xs), np.frombuffer(graph.ys)
+        self._segments = (xs[self._starts], ys[self._starts], xs[self._ends], ys[self._ends])
+        self._end_cost = np.array([self.cost[end] for end in ends], dtype=np.float64)
+
+    def reachable(self, node):
+        return self.next_hop[node] != -1
+
+    def path_from(self, node):
+        """Node indices of the shortest path from node to the goal, or None if there is none."""
+        if self.next_hop[node] == -1: return None
+        path = [node]
+        while node != self.goal:
+            node = self.next_hop[node]
+            path.append(node)
+        return path
+
+    def nearest_edge(self, x, y):
+        """
+        (start node, end node, metres away) of the segment closest to a
+        projected position, among those that can reach the goal; of (nearly)
+        equally close ones, the one whose end is nearest the goal. None if
+        there are no segments.
+        """
+        if not len(self._starts): return None
+        distances = geo.point_to_segments(x, y, *self._segments)
+        best = int(np.argmin(np.where(distances <= distances.min() + SNAP_TIE_METERS, self._end_cost, np.inf)))
+        return int(self._starts[best]), int(self._ends[best]), float(distances[best])
+
+def tree_to(model, difficulty, goal):
+    """The TreeToGoal of a goal node index at a difficulty (one Dijkstra on the reversed graph)."""
+    nodes, costs, parents = engine_for(model, difficulty, reverse=True).shortest_path_tree(goal)
+    return TreeToGoal(model.graph(difficulty), goal, nodes, costs, parents)
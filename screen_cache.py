@@ -0,0 +1,77 @@
+import threading
+from datetime import date
+import db_manager
+
+# --- Configuration ---
+IDLE_RECHECK_SECONDS = 30.0 # Refresh anyway this often (catches the midnight rollover).
+MIN_REFRESH_INTERVAL = 2.0  # Coalesce bursts of writes into one refresh.
+
+class ScreenDataCache:
+    """
+    Keeps the DB-backed screen data (day's bests, trip summary and the
+    logbook, pre-sliced into pages) in memory.
+
+    A background thread recomputes everything when the daily log version in
+    db_manager changes, i.e. only after the trip logger or run logging has
+    written something. The getters are plain dictionary lookups, so page
+    renders on the UI thread never touch SQLite.
+    """
+    def __init__(self, items_per_page):
+        self.items_per_page = items_per_page
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._bests = {}
+        self._summary = {}
+        self._logbook_pages = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def refresh(self):
+        """Recomputes everything from the daily DB. Runs on the cache thread."""
+        try:
+            bests = db_manager.get_days_bests()
+            summary = db_manager.get_trip_summary()
+            entries = db_manager.get_run_log_entries()
+        except Exception as e:
+            print(f"SCREEN_CACHE: Refresh failed: {e}")
+            return
+        pages = [entries[i:i + self.items_per_page] for i in range(0, len(entries), self.items_per_page)]
+        with self._lock:
+            self._bests, self._summary, self._logbook_pages = bests, summary, pages
+
+    def _refresh_loop(self):
+        version = db_manager.get_daily_log_version()
+        current_day = date.today()
+        self.refresh()
+        while not self._stop_event.is_set():
+            new_version = db_manager.wait_for_daily_log_change(version, IDLE_RECHECK_SECONDS)
+            if new_version == version and date.today() == current_day:
+                continue
+            if self._stop_event.wait(MIN_REFRESH_INTERVAL):
+                break
+            version = db_manager.get_daily_log_version()
+            current_day = date.today()
+            self.refresh()
+
+    # --- Getters (UI thread) ---
+    def get_days_bests(self):
+        with self._lock:
+            return self._bests
+
+    def get_trip_summary(self):
+        with self._lock:
+            return self._summary
+
+    def get_logbook_page(self, page):
+        """Returns (entries on that page, total pages)."""
+        with self._lock:
+            pages = self._logbook_pages
+        if not pages: return [], 0
+        page = max(0, min(page, len(pages) - 1))
+        return pages[page], len(pages)
@@ -0,0 +1,202 @@
+"""
+Spatial index over the resort's waypoints.
+
+Waypoints are projected onto a local metre grid (geo.LocalProjection) and
+bucketed into square cells of CELL_METERS. A nearest-neighbour query
+searches rings of cells outwards from the query point and stops as soon as
+the next ring can't hold anything closer than the k-th point found, and a
+radius query only looks at the cells the circle overlaps, so both cost
+about the same whatever the size of the resort. A point far outside the
+resort starts at the first ring that reaches it.
+
+Each waypoint type has its own grid as well, so "closest lift" doesn't
+wade through every junction. Adding a waypoint is a dict append, so when
+the resort only gains waypoints (the SAVE_WAYPOINT button, a web edit) the
+index is carried over to the new ResortModel snapshot instead of rebuilt;
+see get_index().
+
+SegmentGrid does the same for line segments (the legs of every run and
+lift), for the map matcher: each segment is listed in every cell its
+bounding box touches.
+"""
+import heapq
+import math
+import threading
+import numpy as np
+import geo
+
+# --- Configuration ---
+CELL_METERS = 100.0 # About the spacing of waypoints on a busy part of the mountain
+
+class GridIndex:
+    """Uniform grid of (x, y, item) points; items must be comparable (ties are broken on them)."""
+    def __init__(self, cell_meters=CELL_METERS):
+        self.cell = cell_meters
+        self.cells = {} # (column, row) -> [(x, y, item), ...]
+        self.count = 0
+        self.bounds = None # (min column, min row, max column, max row)
+
+    def __len__(self):
+        return self.count
+
+    def _cell_of(self, x, y):
+        return math.floor(x / self.cell), math.floor(y / self.cell)
+
+    def add(self, x, y, item):
+        column, row = self._cell_of(x, y)
+        self.cells.setdefault((column, row), []).append((x, y, item))
+        self.count += 1
+        if self.bounds is None:
+            self.bounds = (column, row, column, row)
+        else:
+            min_column, min_row, max_column, max_row = self.bounds
+            self.bounds = (min(min_column, column), min(min_row, row), max(max_column, column), max(max_row, row))
+
+    def _ring(self, column, row, radius):
+        """Cells at Chebyshev distance radius from (column, row), clipped to the occupied bounds."""
+        min_column, min_row, max_column, max_row = self.bounds
+        cells = self.cells
+        for c in range(max(column - radius, min_column), min(column + radius, max_column) + 1):
+            on_edge = c in (column - radius, column + radius)
+            rows = range(max(row - radius, min_row), min(row + radius, max_row) + 1) if on_edge else \
+                [r for r in (row - radius, row + radius) if min_row <= r <= max_row]
+            for r in rows:
+                points = cells.get((c, r))
+                if points: yield points
+
+    def nearest(self, x, y, k=1):
+        """Up to k (metres, item) pairs, closest first."""
+        if not self.count or k <= 0: return []
+        column, row = self._cell_of(x, y)
+        min_column, min_row, max_column, max_row = self.bounds
+        # Rings closer than this don't touch an occupied cell; beyond the last one every cell has been seen.
+        first = max(min_column - column, column - max_column, min_row - row, row - max_row, 0)
+        last = max(column - min_column, max_column - column, row - min_row, max_row - row)
+        best = []
+        for radius in range(first, last + 1):
+            for points in self._ring(column, row, radius):
+                best.extend((math.hypot(px - x, py - y), item) for px, py, item in points)
+            if len(best) >= k:
+                best = heapq.nsmallest(k, best)
+                # Anything in ring radius + 1 is at least radius whole cells away.
+                if best[-1][0] <= radius * self.cell: break
+        return heapq.nsmallest(k, best)
+
+    def within(self, x, y, radius_meters):
+        """All (metres, item) pairs within radius_meters, closest first."""
+        if not self.count: return []
+        min_column, min_row = self._cell_of(x - radius_meters, y - radius_meters)
+        max_column, max_row = self._cell_of(x + radius_meters, y + radius_meters)
+        bounds_min_column, bounds_min_row, bounds_max_column, bounds_max_row = self.bounds
+        found = []
+        for c in range(max(min_column, bounds_min_column), min(max_column, bounds_max_column) + 1):
+            for r in range(max(min_row, bounds_min_row), min(max_row, bounds_max_row) + 1):
+                for px, py, item in self.cells.get((c, r), ()):
+                    distance = math.hypot(px - x, py - y)
+                    if distance <= radius_meters: found.append((distance, item))
+        found.sort()
+        return found
+
+class WaypointIndex:
+    """
+    Grids over a resort's located waypoints: one over all of them and one
+    per type. Queries take lat/lon and return (metres, waypoint dict) pairs;
+    ties are broken by the order the waypoints were added in (the model's
+    name order), like a stable sort of a linear scan would.
+    """
+    def __init__(self, waypoints, cell_meters=CELL_METERS):
+        self.cell_meters = cell_meters
+        self.projection = None
+        self.all = GridIndex(cell_meters)
+        self.by_type = {}
+        self.ids = set()
+        self._lock = threading.Lock() # add() may run while the UI thread queries
+        for wp in waypoints:
+            self.add(wp)
+
+    def add(self, wp):
+        """Indexes one more waypoint (ignored if it has no coordinates or is already indexed)."""
+        if wp.get('lat') is None or wp.get('lon') is None or wp['id'] in self.ids: return
+        with self._lock:
+            if self.projection is None:
+                self.projection = geo.LocalProjection(wp['lat'], wp['lon'])
+            x, y = self.projection.to_xy(wp['lat'], wp['lon'])
+            item = (len(self.ids), wp) # The rank breaks distance ties, so dicts are never compared
+            self.all.add(x, y, item)
+            self.by_type.setdefault(wp.get('type'), GridIndex(self.cell_meters)).add(x, y, item)
+            self.ids.add(wp['id'])
+
+    def _grid(self, wp_type):
+        return self.all if wp_type is None else self.by_type.get(wp_type)
+
+    def nearest(self, lat, lon, k=1, wp_type=None):
+        """Up to k (metres, waypoint) pairs closest to lat/lon, optionally only of one type."""
+        grid = self._grid(wp_type)
+        if grid is None or self.projection is None: return []
+        with self._lock:
+            found = grid.nearest(*self.projection.to_xy(lat, lon), k)
+        return [(distance, wp) for distance, (_, wp) in found]
+
+    def within(self, lat, lon, radius_meters, wp_type=None):
+        """Every (metres, waypoint) pair within radius_meters of lat/lon, closest first."""
+        grid = self._grid(wp_type)
+        if grid is None or self.projection is None: return []
+        with self._lock:
+            found = grid.within(*self.projection.to_xy(lat, lon), radius_meters)
+        return [(distance, wp) for distance, (_, wp) in found]
+
+class SegmentGrid:
+    """
+    Uniform grid over projected segments (x0, y0) -> (x1, y1), numbered in
+    the order they were given. Built once; near() returns the segments
+    within a radius of a point with their distances.
+    """
+    def __init__(self, xs0, ys0, xs1, ys1, cell_meters=CELL_METERS):
+        self.cell = cell_meters
+        self.xs0, self.ys0 = np.asarray(xs0, dtype=np.float64), np.asarray(ys0, dtype=np.float64)
+        self.xs1, self.ys1 = np.asarray(xs1, dtype=np.float64), np.asarray(ys1, dtype=np.float64)
+        self.cells = {} # (column, row) -> [segment, ...]
+        for segment, (x0, y0, x1, y1) in enumerate(zip(self.xs0.tolist(), self.ys0.tolist(), self.xs1.tolist(), self.ys1.tolist())):
+            for column in range(math.floor(min(x0, x1) / self.cell), math.floor(max(x0, x1) / self.cell) + 1):
+                for row in range(math.floor(min(y0, y1) / self.cell), math.floor(max(y0, y1) / self.cell) + 1):
+                    self.cells.setdefault((column, row), []).append(segment)
+
+    def __len__(self):
+        return len(self.xs0)
+
+    def near(self, x, y, radius_meters):
+        """(segment numbers, metres away) as arrays, for every segment within radius_meters of a point."""
+        candidates = set()
+        for column in range(math.floor((x - radius_meters) / self.cell), math.floor((x + radius_meters) / self.cell) + 1):
+            for row in range(math.floor((y - radius_meters) / self.cell), math.floor((y + radius_meters) / self.cell) + 1):
+                candidates.update(self.cells.get((column, row), ()))
+        segments = np.fromiter(sorted(candidates), dtype=np.int64, count=len(candidates))
+        distances = geo.point_to_segments(x, y, self.xs0[segments], self.ys0[segments], self.xs1[segments], self.ys1[segments])
+        close = distances <= radius_meters
+        return segments[close], distances[close]
+
+# --- Shared Instance ---
+_last_index = None # (waypoints_by_id, index) most recently built, to carry over to the next snapshot
+
+def _build(model):
+    global _last_index
+    index = None
+    if _last_index is not None:
+        old_waypoints, old_index = _last_index
+        # Only waypoints added (none moved or removed): keep the grids and index the new ones.
+        if all(model.waypoints_by_id.get(wp_id) == wp for wp_id, wp in old_waypoints.items()):
+            index = old_index
+            for wp in model.waypoints:
+                index.add(wp)
+    if index is None:
+        index = WaypointIndex(model.waypoints)
+    _last_index = (model.waypoints_by_id, index)
+    return index
+
+def get_index(model):
+    """
+    The WaypointIndex of a ResortModel snapshot, built on first use. If the
+    snapshot only adds waypoints to the previous one, that snapshot's index
+    is extended and shared instead (the old snapshot is on its way out).
+    """
+    return model.derived(('spatial_index',), _build)
@@ -75,8 +75,9 @@ def main():
     if not start_waypoint:
         return
 
-    # 3. Get the destination waypoint from the user
-    dest_waypoint = get_user_choice("Select a Destination Waypoint", all_waypoints)
+    # 3. Get the destination waypoint from the user (only those reachable at all; Black allows every run)
+    reachable_ids = mapper.reachable_destinations(start_waypoint['id'], 'Black') - {start_waypoint['id']}
+    dest_waypoint = get_user_choice("Select a Destination Waypoint", [wp for wp in all_waypoints if wp['id'] in reachable_ids])
     if not dest_waypoint:
         return
         
@@ -114,6 +115,9 @@ def main():
         print("Path found! The route is:")
         for i, waypoint in enumerate(final_route['waypoints']):
             print(f"  {i + 1}. {waypoint['name']}")
+        for rank, alternative in enumerate(final_route.get('alternatives', []), 1):
+            print(f"Alternative {rank} ({alternative['distance_m']:.0f} m vs {final_route['distance_m']:.0f} m): "
+                  + " -> ".join(waypoint['name'] for waypoint in alternative['waypoints']))
     else:
         print("No path could be found with the selected criteria.")
         
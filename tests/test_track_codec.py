@@ -0,0 +1,169 @@
+"""
+Lossless round-trip tests for track_codec. Run from the repository root with
+    python -m unittest discover tests
+(or pytest). Lossless means at the format's precision: decoding gives back
+dequantize(quantize(points)) exactly, and re-encoding gives the same bytes.
+"""
+import os
+import sqlite3
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_manager
+import track_codec
+import trip_logger
+
+START = 1736848800.0 # 2025-01-14 10:00:00 UTC, on a minute boundary
+
+def _schema(table):
+    return next(statement for statement in db_manager.DAILY_LOG_SCHEMA if f"EXISTS {table} (" in statement)
+
+def _descent(count, start=START, step=1.0):
+    """A skier going south-west and downhill: lat, lon and alt all fall (negative deltas) while speed varies."""
+    return [(start + i * step, 45.1 - i * 2.1e-5, -0.5 - i * 3.3e-5, 2100.0 - i * 0.7, 8.0 + 3.0 * np.sin(i / 5.0))
+            for i in range(count)]
+
+def _expected(points):
+    return track_codec.dequantize(track_codec.quantize(points))
+
+class ChunkTest(unittest.TestCase):
+    def assertRoundTrip(self, points):
+        blob = track_codec.encode_chunk(points)
+        decoded = track_codec.decode_chunk(blob)
+        np.testing.assert_array_equal(decoded, _expected(points))
+        self.assertEqual(track_codec.encode_chunk(decoded), blob)
+        return blob
+
+    def test_smooth_track(self):
+        self.assertRoundTrip(_descent(120))
+
+    def test_negative_deltas(self):
+        points = _descent(30)
+        points += [(p[0] + 30, p[1] + 1e-3, p[2] + 1e-3, p[3] + 50, 0.0) for p in points[::-1]] # And back up
+        self.assertRoundTrip(points)
+
+    def test_large_gaps(self):
+        points = _descent(5)
+        points.append((points[-1][0] + 5 * 3600.0, -33.9, 151.2, 8848.0, 250.0)) # Hours later, across the world
+        points.append((points[-1][0] + 0.001, 90.0, -180.0, -400.0, 0.0))
+        self.assertRoundTrip(points)
+
+    def test_single_point(self):
+        blob = self.assertRoundTrip([(START, 45.0, 7.0, 1500.0, 0.0)])
+        self.assertEqual(track_codec.decode_chunk(blob).shape, (1, len(track_codec.COLUMNS)))
+
+    def test_no_points(self):
+        self.assertEqual(track_codec.decode_chunk(track_codec.encode_chunk(np.zeros((0, 5)))).shape, (0, 5))
+
+    def test_precision(self):
+        decoded = track_codec.decode_chunk(track_codec.encode_chunk(_descent(50)))
+        error = np.abs(decoded - np.array(_descent(50))).max(axis=0)
+        self.assertTrue((error <= 0.5 / track_codec.SCALES + 1e-9).all(), error)
+
+    def test_decode_many(self):
+        chunks = [_descent(10), _descent(1, START + 60), _descent(25, START + 120)]
+        decoded = track_codec.decode_chunks([track_codec.encode_chunk(c) for c in chunks], [len(c) for c in chunks])
+        np.testing.assert_array_equal(decoded, _expected(sum(chunks, [])))
+
+    def test_corrupt_chunks(self):
+        blob = track_codec.encode_chunk(_descent(10))
+        for bad in (b'', bytes([track_codec.FORMAT_VERSION + 1]) + blob[1:], blob[:-1] + bytes([blob[-1] | 0x80]), blob + b'\x00'):
+            with self.assertRaises(track_codec.TrackFormatError):
+                track_codec.decode_chunk(bad)
+
+class DailyDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute(_schema('track_chunks'))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _chunk_rows(self):
+        return self.conn.execute("SELECT minute, point_count FROM track_chunks ORDER BY minute").fetchall()
+
+    def test_appender_across_minutes(self):
+        points = _descent(200, START + 15) # 15 s into a minute, through 4 minutes
+        appender = track_codec.ChunkAppender()
+        for start in range(0, len(points), 7): # Batches straddling the minute boundaries
+            with self.conn:
+                appender.write(self.conn, points[start:start + 7])
+        minute = track_codec.chunk_minute(START)
+        self.assertEqual(self._chunk_rows(), [(minute, 45), (minute + 1, 60), (minute + 2, 60), (minute + 3, 35)])
+        np.testing.assert_array_equal(track_codec.load_track(self.conn), _expected(points))
+        np.testing.assert_array_equal(np.concatenate(list(track_codec.iter_track(self.conn))), _expected(points))
+
+    def test_appender_carries_on_after_restart(self):
+        points = _descent(90)
+        with self.conn:
+            track_codec.ChunkAppender().write(self.conn, points[:30])
+        with self.conn: # A new appender (the logger restarted) halfway through the same minute
+            track_codec.ChunkAppender().write(self.conn, points[30:])
+        minute = track_codec.chunk_minute(START)
+        self.assertEqual(self._chunk_rows(), [(minute, 60), (minute + 1, 30)])
+        np.testing.assert_array_equal(track_codec.load_track(self.conn), _expected(points))
+
+    def test_appender_discard(self):
+        points = _descent(15)
+        appender = track_codec.ChunkAppender()
+        with self.conn:
+            appender.write(self.conn, points[:10])
+        try:
+            with self.conn:
+                appender.write(self.conn, points[10:])
+                raise sqlite3.OperationalError("disk I/O error")
+        except sqlite3.OperationalError:
+            appender.discard()
+        with self.conn: # Retried after the rollback: written once, not twice
+            appender.write(self.conn, points[10:])
+        np.testing.assert_array_equal(track_codec.load_track(self.conn), _expected(points))
+
+    def test_mixed_rows_and_chunks(self):
+        # The day started in the row format and switched to chunks after a restart.
+        self.conn.execute(_schema('trip_log'))
+        rows, chunked = _descent(100), _descent(100, START + 100)
+        with self.conn:
+            self.conn.executemany("INSERT INTO trip_log (timestamp, lat, lon, alt, speed) VALUES (?, ?, ?, ?, ?)",
+                                  ((trip_logger._utc_timestamp(p[0]),) + p[1:] for p in rows))
+            track_codec.ChunkAppender().write(self.conn, chunked)
+
+        blocks = list(track_codec.iter_track(self.conn)) # Merged by time: the rows, then the chunks
+        self.assertEqual(sum(len(block) for block in blocks), 200)
+        streamed = np.concatenate(blocks)
+        np.testing.assert_allclose(streamed[:100], np.array(rows), rtol=0, atol=1e-9)
+        np.testing.assert_array_equal(streamed[100:], _expected(chunked))
+
+        loaded = track_codec.load_track(self.conn) # Sorted by time
+        np.testing.assert_allclose(loaded, np.concatenate((np.array(rows), _expected(chunked))), rtol=0, atol=1e-9)
+        np.testing.assert_array_equal(streamed, loaded)
+        records = list(track_codec.iter_records(self.conn))
+        self.assertEqual(len(records), 200)
+        self.assertEqual(records[0], track_codec.TrackPoint(*rows[0]))
+
+    def test_interleaved_rows_and_chunks(self):
+        # Restarts switching formats back and forth within the same minutes.
+        self.conn.execute(_schema('trip_log'))
+        points = _descent(300, START, step=0.5)
+        rows = [p for i, p in enumerate(points) if (i // 40) % 2]
+        with self.conn:
+            self.conn.executemany("INSERT INTO trip_log (timestamp, lat, lon, alt, speed) VALUES (?, ?, ?, ?, ?)",
+                                  ((trip_logger._utc_timestamp(p[0]),) + p[1:] for p in rows))
+            track_codec.ChunkAppender().write(self.conn, [p for i, p in enumerate(points) if not (i // 40) % 2])
+        streamed = np.concatenate(list(track_codec.iter_track(self.conn)))
+        self.assertTrue((np.diff(streamed[:, 0]) > 0).all())
+        np.testing.assert_array_equal(streamed, track_codec.load_track(self.conn))
+
+    def test_rows_only(self):
+        self.conn.execute(_schema('trip_log'))
+        points = _descent(track_codec.ROW_FETCH_SIZE + 10) # More than one fetch block
+        with self.conn:
+            self.conn.executemany("INSERT INTO trip_log (timestamp, lat, lon, alt, speed) VALUES (?, ?, ?, ?, ?)",
+                                  ((trip_logger._utc_timestamp(p[0]),) + p[1:] for p in points))
+        blocks = list(track_codec.iter_track(self.conn))
+        self.assertEqual([len(block) for block in blocks], [track_codec.ROW_FETCH_SIZE, 10])
+        np.testing.assert_allclose(track_codec.load_track(self.conn), np.array(points), rtol=0, atol=1e-9)
+
+if __name__ == '__main__':
+    unittest.main()
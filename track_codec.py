@@ -0,0 +1,215 @@
+"""
+Compact storage for the trip log track.
+
+A ski day at 1 Hz is tens of thousands of trip_log rows, each a rowid, a
+TEXT timestamp and four REAL columns. The chunked format instead keeps one
+row per minute in track_chunks, holding that minute's points as a BLOB:
+
+    byte 0      FORMAT_VERSION
+    then        per point, interleaved: time, lat, lon, alt, speed, each the
+                zigzag varint of its second difference, i.e. of how far it is
+                from the value extrapolated from the two previous points
+                (missing previous points count as zero)
+
+Values are fixed point at the precision in SCALES (1 ms, 1e-6 deg ~ 0.1 m,
+0.1 m, 0.01 m/s), which is finer than the GPS itself. Encoding is lossless
+at that precision: decode(encode(points)) == dequantize(quantize(points)),
+and re-encoding decoded points gives the same bytes. A steady fix rate and
+smooth motion extrapolate well, so most fields take a single byte.
+
+Encoding and decoding are vectorised with NumPy; readers stream a minute at
+a time with iter_track() or load a whole day with load_track(), and either
+works on days stored as plain trip_log rows too.
+"""
+import collections
+import numpy as np
+
+# --- Format ---
+FORMAT_VERSION = 1
+CHUNK_SECONDS = 60
+COLUMNS = ('time', 'lat', 'lon', 'alt', 'speed')
+SCALES = np.array([1000.0, 1e6, 1e6, 10.0, 100.0]) # Units per second, degree, degree, metre, m/s
+ROW_FETCH_SIZE = 4096 # trip_log rows converted per array when reading the row format
+
+TrackPoint = collections.namedtuple('TrackPoint', COLUMNS) # time is Unix seconds (UTC)
+
+class TrackFormatError(ValueError):
+    """Raised for a chunk that can't be decoded."""
+
+# --- Fixed Point ---
+def quantize(points):
+    """(n, 5) float array of (time, lat, lon, alt, speed) -> int64 array in SCALES units."""
+    return np.rint(np.asarray(points, dtype=np.float64).reshape(-1, len(COLUMNS)) * SCALES).astype(np.int64)
+
+def dequantize(values):
+    return values / SCALES
+
+def chunk_minute(fix_time):
+    return int(fix_time // CHUNK_SECONDS)
+
+# --- Varints ---
+def _varint_encode(values):
+    """LEB128 of non-negative int64 values, all in one vectorised pass."""
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    out = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    offsets = np.cumsum(lengths) - lengths
+    for k in range(int(lengths.max(initial=0))):
+        has_byte = lengths > k
+        byte = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        byte |= np.where(lengths[has_byte] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[offsets[has_byte] + k] = byte
+    return out.tobytes()
+
+def _varint_decode(data):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw): return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(raw < 0x80)
+    if not len(ends) or ends[-1] != len(raw) - 1:
+        raise TrackFormatError("truncated varint")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = (np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)) * 7
+    if shifts.max() > 63:
+        raise TrackFormatError("varint too long")
+    parts = (raw & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+def _zigzag(values):
+    return (values << 1) ^ (values >> 63)
+
+def _unzigzag(values):
+    return ((values >> np.uint64(1)) ^ (np.uint64(0) - (values & np.uint64(1)))).astype(np.int64)
+
+# --- Chunks ---
+def encode_chunk(points):
+    """Encodes (time, lat, lon, alt, speed) points, oldest first, into a chunk BLOB."""
+    values = quantize(points)
+    zero = np.zeros((1, len(COLUMNS)), dtype=np.int64)
+    residuals = np.diff(np.diff(values, axis=0, prepend=zero), axis=0, prepend=zero)
+    return bytes([FORMAT_VERSION]) + _varint_encode(_zigzag(residuals.ravel()))
+
+def decode_chunk(blob):
+    """Decodes a chunk BLOB into an (n, 5) float64 array of (time, lat, lon, alt, speed)."""
+    if not blob or blob[0] != FORMAT_VERSION:
+        raise TrackFormatError(f"unknown track chunk version {blob[0] if blob else None}")
+    residuals = _unzigzag(_varint_decode(blob[1:]))
+    if len(residuals) % len(COLUMNS):
+        raise TrackFormatError("chunk ends mid-point")
+    return dequantize(np.cumsum(np.cumsum(residuals.reshape(-1, len(COLUMNS)), axis=0), axis=0))
+
+class ChunkAppender:
+    """
+    Appends points to the track_chunks table of one daily database. Only the
+    newest minute is kept in memory: its chunk is rewritten on every write
+    until the points move on to the next minute (a minute is at most a few
+    hundred points, so that costs next to nothing).
+    """
+    def __init__(self):
+        self.minute = None
+        self.points = []
+
+    def write(self, conn, points):
+        """Writes (time, lat, lon, alt, speed) points, oldest first; call inside the caller's transaction."""
+        by_minute = {}
+        for point in points:
+            by_minute.setdefault(chunk_minute(point[0]), []).append(point)
+        for minute, minute_points in by_minute.items():
+            if minute != self.minute:
+                # Carry on a chunk written before a restart instead of replacing it.
+                row = conn.execute("SELECT data FROM track_chunks WHERE minute = ?", (minute,)).fetchone()
+                self.minute, self.points = minute, [tuple(p) for p in decode_chunk(row[0])] if row else []
+            self.points.extend(minute_points)
+            conn.execute("INSERT OR REPLACE INTO track_chunks (minute, point_count, data) VALUES (?, ?, ?)",
+                         (minute, len(self.points), encode_chunk(self.points)))
+
+    def discard(self):
+        """Forgets the in-memory minute after a rolled-back write; the next write reloads it from the database."""
+        self.minute, self.points = None, []
+
+# --- Reading ---
+def _has_table(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+def _segmented_cumsum(values, lengths):
+    """Cumulative sum down the rows of values, restarting every lengths[i] rows."""
+    totals = np.cumsum(values, axis=0)
+    ends = np.cumsum(lengths)
+    before = np.concatenate((np.zeros((1, values.shape[1]), dtype=values.dtype), totals[ends[:-1] - 1]))
+    return totals - np.repeat(before, lengths, axis=0)
+
+def decode_chunks(blobs, point_counts):
+    """Decodes many chunks at once (one varint pass for all of them) into a single (n, 5) array."""
+    if not blobs: return np.zeros((0, len(COLUMNS)))
+    if any(not blob or blob[0] != FORMAT_VERSION for blob in blobs):
+        raise TrackFormatError("unknown track chunk version")
+    residuals = _unzigzag(_varint_decode(b''.join(blob[1:] for blob in blobs)))
+    lengths = np.asarray(point_counts, dtype=np.int64)
+    if len(residuals) != lengths.sum() * len(COLUMNS):
+        raise TrackFormatError("chunk point counts don't match their data")
+    residuals = residuals.reshape(-1, len(COLUMNS))
+    return dequantize(_segmented_cumsum(_segmented_cumsum(residuals, lengths), lengths))
+
+def _iter_rows(conn):
+    """Streams the plain trip_log rows (the default storage format) as arrays."""
+    if _has_table(conn, 'trip_log'):
+        # CURRENT_TIMESTAMP-style UTC text -> Unix seconds, rounded to the stored milliseconds.
+        cursor = conn.execute("SELECT round((julianday(timestamp) - 2440587.5) * 86400.0, 3), lat, lon, alt, speed "
+                              "FROM trip_log ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(ROW_FETCH_SIZE)
+            if not rows: break
+            yield np.array(rows, dtype=np.float64)
+
+def _iter_chunks(conn):
+    """Streams the track_chunks minutes as arrays."""
+    if _has_table(conn, 'track_chunks'):
+        for (blob,) in conn.execute("SELECT data FROM track_chunks ORDER BY minute"):
+            yield decode_chunk(blob)
+
+def _merge_by_time(first, second):
+    """
+    Merges two streams of time-sorted blocks into one, splitting blocks where
+    they interleave. Ties go to first, as in load_track's stable sort.
+    """
+    first, second = (block for block in first if len(block)), (block for block in second if len(block))
+    head, other = next(first, None), next(second, None)
+    while head is not None and other is not None:
+        if head[0, 0] <= other[0, 0]:
+            cut = np.searchsorted(head[:, 0], other[0, 0], side='right')
+            yield head[:cut]
+            head = head[cut:] if cut < len(head) else next(first, None)
+        else:
+            cut = np.searchsorted(other[:, 0], head[0, 0], side='left')
+            yield other[:cut]
+            other = other[cut:] if cut < len(other) else next(second, None)
+    if head is not None: yield head
+    if other is not None: yield other
+    yield from first
+    yield from second
+
+def iter_track(conn):
+    """
+    Streams a daily database's track as (n, 5) float64 arrays, oldest first:
+    a minute chunk or a block of plain trip_log rows at a time, merged by time
+    when a day used both formats.
+    """
+    yield from _merge_by_time(_iter_chunks(conn), _iter_rows(conn))
+
+def load_track(conn):
+    """A daily database's whole track as one (n, 5) float64 array, sorted by time."""
+    chunks = conn.execute("SELECT data, point_count FROM track_chunks ORDER BY minute").fetchall() \
+        if _has_table(conn, 'track_chunks') else []
+    track = np.concatenate([decode_chunks([blob for blob, _ in chunks], [count for _, count in chunks])] + list(_iter_rows(conn)))
+    if len(track) > 1 and (np.diff(track[:, 0]) < 0).any(): # Both formats used on the same day
+        track = track[np.argsort(track[:, 0], kind='stable')]
+    return track
+
+def iter_records(conn):
+    """Streams the track as TrackPoint records, for callers that want rows rather than arrays."""
+    for block in iter_track(conn):
+        for row in block.tolist():
+            yield TrackPoint(*row)
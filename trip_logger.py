@@ -1,38 +1,349 @@
 import threading
 import time
+import queue
 import sqlite3
 import os
-from datetime import date
+import collections
+from datetime import date, datetime, timezone
+import db_manager
+import geo
+import track_codec
 
 # --- Configuration ---
-LOG_INTERVAL_SECONDS = 5  # How often to attempt to write a data point to the log.
+FEED_QUEUE_SIZE = 64      # The logger gets every fix; this absorbs ~6 s of 10 Hz fixes during a flush.
 MIN_SPEED_MPS = 1.0       # Minimum speed in meters/second to be considered "moving".
 LOG_DIRECTORY = 'daily_logs' # Directory to store the daily database files.
+SPEED_ZONES_MPS = (4.2, 11.1) # relaxed < 15 kph <= cruising < 40 kph <= aggressive
+MAX_SAMPLE_GAP_SECONDS = 30.0 # Don't credit time or distance across longer gaps (GPS loss, restarts).
+DESCENT_HYSTERESIS_M = 3.0    # Altitude changes smaller than this are treated as GPS noise.
+
+# --- Track Sampling ---
+# A fix is only stored when the track can't be rebuilt without it to within
+# these tolerances (see TrackSampler); stored points are never further apart
+# than MAX_GAP_SECONDS.
+POSITION_TOLERANCE_M = 5.0 # About the accuracy of a consumer GPS; raised further when the fixes are noisier (see TrackSampler)
+ALTITUDE_TOLERANCE_M = 3.0
+SPEED_TOLERANCE_MPS = 2.0
+MAX_GAP_SECONDS = 30.0
+MAX_WINDOW_POINTS = 300 # Caps the per-fix work (30 s at 10 Hz)
+SMOOTHING_FIXES = 5      # Centred moving average over up to this many fixes before sampling...
+SMOOTHING_SECONDS = 2.0  # ...spanning at most this long (5 fixes at 10 Hz, 3 at 1 Hz)
+NOISE_TOLERANCE_FACTOR = 3.0 # Position tolerance is at least this many times the estimated GPS noise...
+NOISE_WINDOW_FIXES = 120     # ...estimated over this many recent fixes
+
+# --- Write Pipeline ---
+# Points are buffered in memory and written in one transaction per flush:
+# when FLUSH_BATCH_SIZE points are waiting or FLUSH_INTERVAL_SECONDS have
+# passed, on stop, and at the midnight rollover. The daily DB runs in WAL mode
+# with synchronous=NORMAL, so a commit only appends to the WAL; the fsyncs
+# happen at checkpoints, which are forced every CHECKPOINT_INTERVAL_SECONDS.
+# Loss window:
+#   - app crash / killed process: the unflushed buffer, at most FLUSH_INTERVAL_SECONDS of points,
+#     plus the fixes still in the TrackSampler's open window (up to MAX_GAP_SECONDS; the rebuilt
+#     track then runs straight from the last stored point)
+#   - power loss: additionally anything committed since the last checkpoint,
+#     so at most FLUSH_INTERVAL_SECONDS + CHECKPOINT_INTERVAL_SECONDS
+# A failed write keeps its points and is retried FLUSH_INTERVAL_SECONDS
+# later; while writes keep failing, at most MAX_PENDING_POINTS are kept
+# (the oldest go first and are counted in points_dropped).
+FLUSH_BATCH_SIZE = 50
+FLUSH_INTERVAL_SECONDS = 10.0
+MAX_PENDING_POINTS = 3000 # While writes keep failing (disk full, locked DB), older points beyond this are dropped
+CHECKPOINT_INTERVAL_SECONDS = 60.0
+TRACK_FORMAT = 'rows' # 'rows' (the trip_log table) or 'chunks' (track_chunks, ~10x smaller; see track_codec)
 
 def setup_daily_db(cursor):
-    """Creates the necessary table in a new daily database file."""
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS trip_log (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        lat REAL NOT NULL,
-        lon REAL NOT NULL,
-        alt REAL NOT NULL,
-        speed REAL NOT NULL
-    )''')
-
-def trip_logger_thread(gps_data, data_lock, stop_event):
+    """Creates the necessary tables in a new daily database file."""
+    db_manager.setup_daily_db(cursor)
+
+class TripAggregates:
+    """
+    The day's running totals, updated in O(1) per fix so the STATS page never
+    has to aggregate over trip_log.
+
+    Time and distance are credited between consecutive fixes using their real
+    timestamps (gaps over MAX_SAMPLE_GAP_SECONDS are skipped), with each
+    interval going to the speed zone of its average speed. Descent is
+    accumulated with DESCENT_HYSTERESIS_M of hysteresis, so it counts every
+    descent (not just max - min altitude) without adding up altitude jitter.
+    """
+    FIELDS = ('descent_m', 'distance_m', 'top_speed_mps', 'moving_seconds', 'relaxed_seconds', 'cruising_seconds',
+              'aggressive_seconds', 'last_time', 'last_lat', 'last_lon', 'last_alt', 'last_speed', 'reference_alt')
+
+    def __init__(self, row=None):
+        for field in self.FIELDS:
+            setattr(self, field, row[field] if row else (None if field.startswith(('last_', 'reference_')) else 0.0))
+
+    def add(self, fix_time, lat, lon, alt, speed):
+        self.top_speed_mps = max(self.top_speed_mps, speed)
+        if alt is not None:
+            if self.reference_alt is None or alt > self.reference_alt + DESCENT_HYSTERESIS_M:
+                self.reference_alt = alt
+            elif alt < self.reference_alt - DESCENT_HYSTERESIS_M:
+                self.descent_m += self.reference_alt - alt
+                self.reference_alt = alt
+
+        if self.last_time is not None and 0 < fix_time - self.last_time <= MAX_SAMPLE_GAP_SECONDS:
+            dt = fix_time - self.last_time
+            average_speed = (speed + (self.last_speed or 0.0)) / 2
+            if average_speed > MIN_SPEED_MPS:
+                self.moving_seconds += dt
+                self.distance_m += geo.distance_m({'lat': self.last_lat, 'lon': self.last_lon}, {'lat': lat, 'lon': lon})
+                if average_speed < SPEED_ZONES_MPS[0]: self.relaxed_seconds += dt
+                elif average_speed < SPEED_ZONES_MPS[1]: self.cruising_seconds += dt
+                else: self.aggressive_seconds += dt
+        self.last_time, self.last_lat, self.last_lon, self.last_alt, self.last_speed = fix_time, lat, lon, alt, speed
+
+    def as_row(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+def load_trip_aggregates(cursor):
+    """Restores the running totals saved in a daily database (or starts from zero)."""
+    cursor.execute(f"SELECT {', '.join(TripAggregates.FIELDS)} FROM trip_summary WHERE id = 1")
+    row = cursor.fetchone()
+    return TripAggregates(dict(zip(TripAggregates.FIELDS, row)) if row else None)
+
+def save_trip_aggregates(cursor, aggregates):
+    """Writes the running totals; call inside the same transaction as the trip_log inserts."""
+    cursor.execute(f"INSERT OR REPLACE INTO trip_summary (id, {', '.join(TripAggregates.FIELDS)}) "
+                   f"VALUES (1, {', '.join(':' + field for field in TripAggregates.FIELDS)})", aggregates.as_row())
+
+class TrackSampler:
+    """
+    Online line simplification (an opening-window Douglas-Peucker variant)
+    over the full-rate GPS stream.
+
+    The last stored fix is the anchor. Each new fix extends a window, and the
+    window survives as long as every fix in it lies within tolerance of the
+    straight, constant-speed line from the anchor to the new fix: position
+    compared at the same moment in time (so speed changes count, not just
+    shape), plus altitude and speed interpolated the same way. When a fix
+    breaks the window, the previous fix is stored and becomes the anchor.
+    Straight cruising therefore costs a row every MAX_GAP_SECONDS while
+    tight turns keep every fix they need.
+
+    Positions are first smoothed with a short centred moving average (over
+    SMOOTHING_SECONDS, so 1 Hz fixes get averaged too), and the position
+    tolerance grows with the GPS noise, estimated from how far raw fixes sit
+    from their smoothed positions: jitter alone shouldn't break windows, at
+    any fix rate. While stopped, only the start and end of the stop are
+    stored. Decisions lag by a few fixes; call finish() to get the pending ones.
+    """
+    def __init__(self, position_tolerance=POSITION_TOLERANCE_M, altitude_tolerance=ALTITUDE_TOLERANCE_M,
+                 speed_tolerance=SPEED_TOLERANCE_MPS, max_gap=MAX_GAP_SECONDS, max_window=MAX_WINDOW_POINTS):
+        self.position_tolerance = position_tolerance
+        self.altitude_tolerance = altitude_tolerance
+        self.speed_tolerance = speed_tolerance
+        self.max_gap = max_gap
+        self.max_window = max_window
+        self.anchor = None
+        self.window = [] # (time, x, y, alt, speed, fix) since the anchor
+        self.projection = None
+        self.recent = collections.deque(maxlen=SMOOTHING_FIXES)
+        self.unsampled = 0 # Fixes in recent that haven't been through _sample yet
+        self.parked = None # The latest fix of a stop, stored as the departure point when moving resumes
+        self.residuals = collections.deque(maxlen=NOISE_WINDOW_FIXES) # Raw fix -> smoothed fix distances
+
+    def _position_limit(self):
+        """The position tolerance, raised to NOISE_TOLERANCE_FACTOR times the GPS noise seen lately."""
+        if len(self.residuals) < SMOOTHING_FIXES: return self.position_tolerance
+        # For 2D Gaussian noise the median distance is 1.18 sigma
+        sigma = sorted(self.residuals)[len(self.residuals) // 2] / 1.1774
+        return max(self.position_tolerance, NOISE_TOLERANCE_FACTOR * sigma)
+
+    def _point(self, fix):
+        x, y = self.projection.to_xy(fix['lat'], fix['lon'])
+        return fix['time'], x, y, fix.get('alt_m'), fix.get('speed_mps') or 0.0, fix
+
+    def _set_anchor(self, fix):
+        self.projection = geo.LocalProjection(fix['lat'], fix['lon'])
+        self.anchor, self.window = self._point(fix), []
+
+    def _fits(self, point):
+        """True if every fix in the window is within tolerance of the anchor -> point line."""
+        t0, x0, y0, alt0, speed0, _ = self.anchor
+        t1, x1, y1, alt1, speed1, _ = point
+        span = t1 - t0
+        if span <= 0: return False
+        check_alt = alt0 is not None and alt1 is not None
+        position_limit = self._position_limit() ** 2
+        for t, x, y, alt, speed, _ in self.window:
+            frac = (t - t0) / span
+            dx, dy = x - (x0 + (x1 - x0) * frac), y - (y0 + (y1 - y0) * frac)
+            if dx * dx + dy * dy > position_limit: return False
+            if check_alt and alt is not None and abs(alt - (alt0 + (alt1 - alt0) * frac)) > self.altitude_tolerance: return False
+            if abs(speed - (speed0 + (speed1 - speed0) * frac)) > self.speed_tolerance: return False
+        return True
+
+    def _smoothed(self, index):
+        """The fix at recent[index], with position and altitude averaged over its neighbours."""
+        center = self.recent[index]
+        neighbours = [fix for fix in self.recent if abs(fix['time'] - center['time']) <= SMOOTHING_SECONDS / 2]
+        if len(neighbours) < 2: return center
+        altitudes = [fix['alt_m'] for fix in neighbours if fix.get('alt_m') is not None]
+        smoothed = dict(center, lat=sum(fix['lat'] for fix in neighbours) / len(neighbours),
+                        lon=sum(fix['lon'] for fix in neighbours) / len(neighbours),
+                        alt_m=sum(altitudes) / len(altitudes) if altitudes else center.get('alt_m'))
+        # The centre fix's own noise is part of the average, which shrinks its residual by sqrt(1 - 1/n)
+        self.residuals.append(geo.distance_m(center, smoothed) / (1.0 - 1.0 / len(neighbours)) ** 0.5)
+        return smoothed
+
+    def _drain(self, keep_unsampled):
+        kept = []
+        while self.unsampled > keep_unsampled:
+            kept.extend(self._sample(self._smoothed(len(self.recent) - self.unsampled)))
+            self.unsampled -= 1
+        return kept
+
+    def add(self, fix):
+        """Feeds one fix (a packet with time, lat, lon, alt_m, speed_mps); returns the fixes to store, oldest first."""
+        self.recent.append(fix)
+        self.unsampled = min(self.unsampled + 1, len(self.recent))
+        return self._drain(SMOOTHING_FIXES // 2) # Wait until a fix has its successors for smoothing
+
+    def _sample(self, fix):
+        if self.anchor is None:
+            self._set_anchor(fix)
+            return [fix]
+        stopped = (fix.get('speed_mps') or 0.0) <= MIN_SPEED_MPS
+        if stopped and not self.window and self.anchor[4] <= MIN_SPEED_MPS:
+            self.parked = fix # Standing still since the anchor: nothing to store but where the stop ends
+            return []
+        if self.parked is not None:
+            parked, self.parked = self.parked, None
+            self._set_anchor(parked)
+            return [parked] + self._sample(fix)
+        point = self._point(fix)
+        if point[0] - self.anchor[0] <= self.max_gap and len(self.window) < self.max_window and self._fits(point):
+            self.window.append(point)
+            return []
+        if not self.window: # Nothing pending (e.g. a gap in the input): store this fix itself
+            self._set_anchor(fix)
+            return [fix]
+        kept = self.window[-1][5]
+        self._set_anchor(kept)
+        return [kept] + self._sample(fix)
+
+    def finish(self):
+        """Returns the remaining fixes to store so the track ends where the skier stopped."""
+        kept = self._drain(0)
+        if self.window: kept.append(self.window[-1][5])
+        if self.parked is not None: kept.append(self.parked)
+        self.anchor, self.window, self.parked = None, [], None
+        self.recent.clear()
+        return kept
+
+def _utc_timestamp(fix_time):
+    """Formats a fix time like SQLite's CURRENT_TIMESTAMP (UTC), keeping milliseconds."""
+    return datetime.fromtimestamp(fix_time, timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+class TripLogWriter:
+    """
+    Owns one daily database: keeps the running TripAggregates and buffers
+    track points, writing both in batched transactions (see Write Pipeline)
+    to trip_log or, with track_format='chunks', to track_chunks.
+    clock is only replaced by benchmarks.
+    """
+    def __init__(self, db_path, batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SECONDS,
+                 checkpoint_interval=CHECKPOINT_INTERVAL_SECONDS, clock=time.monotonic, track_format=TRACK_FORMAT):
+        self.db_path = db_path
+        self.batch_size, self.flush_interval, self.checkpoint_interval = batch_size, flush_interval, checkpoint_interval
+        self.clock = clock
+        self.chunks = track_codec.ChunkAppender() if track_format == 'chunks' else None
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        for pragma in db_manager.CONNECTION_PRAGMAS: # WAL + synchronous=NORMAL
+            self.conn.execute(pragma)
+        setup_daily_db(self.conn)
+        self.conn.commit()
+        self.aggregates = load_trip_aggregates(self.conn.cursor())
+        self.sampler = TrackSampler()
+        self.pending = []
+        self.dirty = False
+        self.write_failed = False # Retries then wait for the flush interval instead of every batch_size points
+        self.last_flush = self.last_checkpoint = clock()
+        self.flushes, self.points_written, self.points_dropped = 0, 0, 0
+
+    def add(self, packet):
+        """Folds a GPS packet into the aggregates and buffers it if the track sampler keeps it."""
+        if not packet.get('fix'): return
+        lat, lon = packet.get('lat'), packet.get('lon')
+        alt, speed = packet.get('alt_m'), packet.get('speed_mps') or 0.0
+        if packet.get('time') is None: packet = dict(packet, time=time.time())
+        self.aggregates.add(packet['time'], lat, lon, alt, speed)
+        self.dirty = True
+        if all(v is not None for v in [lat, lon, alt]):
+            self._buffer(self.sampler.add(packet))
+        if len(self.pending) >= self.batch_size and not self.write_failed:
+            self.flush()
+
+    def _buffer(self, fixes):
+        for fix in fixes:
+            self.pending.append((fix['time'], fix['lat'], fix['lon'], fix['alt_m'], fix.get('speed_mps') or 0.0))
+        if len(self.pending) > MAX_PENDING_POINTS:
+            dropped = len(self.pending) - MAX_PENDING_POINTS
+            del self.pending[:dropped]
+            self.points_dropped += dropped
+
+    def seconds_until_flush(self):
+        return max(0.0, self.last_flush + self.flush_interval - self.clock())
+
+    def flush_if_due(self):
+        if self.clock() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered points and the aggregates in one transaction."""
+        now = self.clock()
+        self.last_flush = now
+        if self.dirty:
+            try:
+                with self.conn: # Commits, or rolls back on error
+                    if self.chunks:
+                        self.chunks.write(self.conn, self.pending)
+                    else:
+                        self.conn.executemany("INSERT INTO trip_log (timestamp, lat, lon, alt, speed) VALUES (?, ?, ?, ?, ?)",
+                                              ((_utc_timestamp(point[0]),) + point[1:] for point in self.pending))
+                    save_trip_aggregates(self.conn.cursor(), self.aggregates)
+            except sqlite3.Error as e:
+                if self.chunks: self.chunks.discard()
+                self.write_failed = True # Next try in flush_interval (flush_if_due)
+                print(f"TRIP_LOGGER: Database write error, keeping {len(self.pending)} points for the next flush"
+                      f" ({self.points_dropped} dropped so far): {e}")
+                return
+            self.write_failed = False
+            self.flushes += 1
+            self.points_written += len(self.pending)
+            self.pending, self.dirty = [], False
+            db_manager.notify_daily_log_changed()
+        if now - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Copies the WAL into the database file (the only time data is fsynced)."""
+        self.last_checkpoint = self.clock()
+        try:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.Error as e:
+            print(f"TRIP_LOGGER: Checkpoint failed: {e}")
+
+    def close(self):
+        self._buffer(self.sampler.finish())
+        self.flush()
+        self.checkpoint()
+        self.conn.close()
+
+def trip_logger_thread(gps_feed, stop_event):
     """
     This function runs in a separate thread to automatically log trip data
-    into a new database file created each day.
+    into a new database file created each day. gps_feed is a GpsBroadcaster
+    subscription receiving every fix; TrackSampler decides what is stored.
     """
     print("TRIP_LOGGER: Thread started.")
     
     # Ensure the log directory exists
     os.makedirs(LOG_DIRECTORY, exist_ok=True)
     
-    conn = None
-    cursor = None
+    writer = None
     current_db_date = None
 
     try:
@@ -40,8 +351,8 @@ def trip_logger_thread(gps_data, data_lock, stop_event):
             today = date.today()
             # --- Check if the date has changed or if it's the first run ---
             if today != current_db_date:
-                if conn:
-                    conn.close()
+                if writer:
+                    writer.close() # Flushes yesterday's buffer into yesterday's file
                     print(f"TRIP_LOGGER: Closed DB for {current_db_date}. New day detected.")
 
                 current_db_date = today
@@ -49,41 +360,22 @@ def trip_logger_thread(gps_data, data_lock, stop_event):
                 db_path = os.path.join(LOG_DIRECTORY, db_filename)
                 
                 print(f"TRIP_LOGGER: Connecting to daily database: {db_path}")
-                conn = sqlite3.connect(db_path, check_same_thread=False)
-                cursor = conn.cursor()
-                setup_daily_db(cursor)
+                writer = TripLogWriter(db_path)
                 print(f"TRIP_LOGGER: Database connection for {current_db_date} is active.")
 
-            # The wait() function will block but returns early if the event is set
-            if stop_event.wait(LOG_INTERVAL_SECONDS):
-                break  # Exit loop if stop event was set during wait
-
-            lat, lon, alt, speed = None, None, None, None
-            log_this_point = False
-
-            with data_lock:
-                if gps_data.get('fix') and gps_data.get('speed', 0) > MIN_SPEED_MPS:
-                    lat, lon = gps_data.get('lat'), gps_data.get('lon')
-                    alt, speed = gps_data.get('alt_m'), gps_data.get('speed')
-                    if all(v is not None for v in [lat, lon, alt, speed]):
-                        log_this_point = True
-
-            if log_this_point and cursor:
-                try:
-                    cursor.execute(
-                        "INSERT INTO trip_log (lat, lon, alt, speed) VALUES (?, ?, ?, ?)",
-                        (lat, lon, alt, speed)
-                    )
-                    conn.commit()
-                except sqlite3.Error as e:
-                    print(f"TRIP_LOGGER: Database write error: {e}")
+            try:
+                # Short timeout keeps stop/midnight checks and time-based flushes responsive
+                packet = gps_feed.get(timeout=min(1.0, writer.seconds_until_flush()) or 0.01)
+                writer.add(packet)
+            except queue.Empty:
+                pass
+            writer.flush_if_due()
 
     except Exception as e:
         print(f"TRIP_LOGGER: An unexpected error occurred: {e}")
     finally:
-        if conn:
-            conn.close()
+        if writer:
+            writer.close()
             print("TRIP_LOGGER: Final database connection closed.")
     
     print("TRIP_LOGGER: Thread stopped.")
-
@@ -15,6 +15,7 @@ class UIManager:
         self.disp = disp
         self.width = disp.width
         self.height = disp.height
+        self.last_flush_seconds = 0.0 # Time the last frame spent being pushed to the display
         
         try:
             self.font_small = ImageFont.truetype(FONT_PATH, 12)
@@ -32,7 +33,9 @@ class UIManager:
 
     def _display_image(self, image):
         """Rotates and displays the image buffer on the physical screen."""
+        flush_start = time.perf_counter()
         self.disp.ShowImage(self.disp.getbuffer(image.rotate(180)))
+        self.last_flush_seconds = time.perf_counter() - flush_start
 
     def _draw_persistent_header(self, draw, gps_fix, time_str, is_recording):
         """Draws the top status bar, now used on all screens."""
@@ -72,7 +75,7 @@ class UIManager:
         self._display_image(image)
         time.sleep(2.5)
 
-    def display_home_screen(self, speed_kph, alt_m, gps_fix, time_str, is_recording, incline_deg, time_to_last_lift_seconds):
+    def display_home_screen(self, speed_kph, alt_m, gps_fix, time_str, is_recording, incline_deg, time_to_last_lift_seconds, current_run_name=None):
         """Displays the main home screen with all primary data points."""
         image = self._create_base_image()
         draw = ImageDraw.Draw(image)
@@ -85,6 +88,10 @@ class UIManager:
         
         draw.text((self.width - 50, 20), f"{alt_m:.0f}", font=self.font_large, fill=0)
         draw.text((self.width - 50, 40), "m", font=self.font_small, fill=0)
+
+        # --- Current Run (from the map matcher) ---
+        if current_run_name:
+            draw.text((30, 40), current_run_name[:9], font=self.font_small, fill=0)
         
         # --- Incline Meter ---
         draw.text((5, 55), f"SLOPE: {incline_deg:.0f} deg", font=self.font_small, fill=0)
@@ -200,6 +207,15 @@ class UIManager:
             if 'distance_m' in target_info and gps_fix:
                 wp_dist_m = target_info['distance_m']
                 draw.text((5, 35), f"{wp_dist_m:.0f} m", font=self.font_large, fill=0)
+                if target_info.get('ghost_gap_seconds') is not None:
+                    # Ghost race: + behind the personal best, - ahead of it
+                    draw.text((self.width - 55, 35), f"{target_info['ghost_gap_seconds']:+.1f}s", font=self.font_large, fill=0)
+                if target_info.get('remaining_m') is not None:
+                    # Whole route: distance left, percentage done and ETA
+                    eta = target_info.get('eta_seconds')
+                    eta_text = f" {int(eta) // 60}:{int(eta) % 60:02d}" if eta is not None else ""
+                    draw.text((5, 52), f"{target_info['remaining_m'] / 1000:.1f}km {target_info.get('percent_complete', 0):.0f}%{eta_text}",
+                              font=self.font_small, fill=0)
             elif not gps_fix:
                 draw.text((5, 35), "No GPS Signal", font=self.font_small, fill=0)
             else:
@@ -259,15 +275,30 @@ class UIManager:
         run_name = analytics.get('run_name', 'Run')
         draw.text((2, 18), f"{run_name[:16]} Stats", font=self.font_small, fill=0)
         
-        duration = analytics.get('duration', 0)
-        vert = analytics.get('vertical', 0)
-        top_speed = analytics.get('top_speed', 0)
+        duration = analytics.get('duration_seconds', 0)
+        vert = analytics.get('vertical_m', 0)
+        top_speed = analytics.get('top_speed_kph', 0)
 
         draw.text((5, 30), f"Time: {duration/60:.0f}m {duration%60:.0f}s", font=self.font_small, fill=0)
         draw.text((5, 42), f"Vertical: {vert:.0f} m", font=self.font_small, fill=0)
         draw.text((5, 54), f"Top Speed: {top_speed:.1f} kph", font=self.font_small, fill=0)
         self._display_image(image)
         
+    def display_diagnostics_screen(self, diagnostics, gps_fix, time_str, is_recording):
+        """Displays main loop health: loop rate, p95 frame time, GPS queue depth and fix age."""
+        image = self._create_base_image()
+        draw = ImageDraw.Draw(image)
+        self._draw_persistent_header(draw, gps_fix, time_str, is_recording)
+
+        fix_age = diagnostics.get('fix_age_s')
+        fix_age_text = f"{fix_age:.1f}s" if fix_age is not None else "--"
+        draw.text((2, 18), f"LOOP: {diagnostics.get('loop_hz', 0):.1f} Hz", font=self.font_small, fill=0)
+        draw.text((2, 29), f"P95:  {diagnostics.get('p95_frame_ms', 0):.0f} ms", font=self.font_small, fill=0)
+        draw.text((2, 40), f"Q: {diagnostics.get('queue_depth', 0)}  FIX: {fix_age_text}", font=self.font_small, fill=0)
+
+        self._draw_page_indicator(draw, "DIAGNOSTICS")
+        self._display_image(image)
+
     def display_menu(self, title, items, gps_fix, time_str, is_recording, page_indicator=None):
         image = self._create_base_image()
         draw = ImageDraw.Draw(image)
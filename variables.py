@@ -10,3 +10,21 @@ SKI_PATROL_NUMBER = "555-123-4567"
 LAST_LIFT_TIME = (16, 00) # Default is 4:00 PM
 
 
+
+# Replay a recorded track instead of reading the live GPS (for development and
+# benchmarking). Set to the path of an NMEA log, a GPX file or a daily log
+# database (daily_logs/YYYY-MM-DD.db). Leave as None to use gpsd.
+GPS_REPLAY_FILE = None
+# Replay speed: 1.0 is real time, 10.0 is ten times faster, 0 is as fast as possible.
+GPS_REPLAY_SPEED = 1.0
+
+# GPS update rate in fixes per second. 1 suits any receiver; set to 10 for
+# high-rate telemetry if your receiver supports it (better speed peaks and
+# turn detection). Replays are resampled to this rate; None keeps the
+# receiver's (or the recording's) own rate.
+GPS_RATE_HZ = None
+
+# Open the resort database (skidata.db) read-only/immutable on the goggles for
+# the fastest lookups. Only enable this if you never edit the resort with
+# web_manager.py while the goggles are running.
+RESORT_DB_IMMUTABLE = False
@@ -296,16 +296,12 @@ def index():
                     flash("Start and End waypoints cannot be the same.", "danger")
                 else:
                     # Reverse lookup map for run names from waypoint pairs
-                    run_lookup = {}
-                    for run in all_runs:
-                        for i in range(len(run['waypoints_list']) - 1):
-                            wp_pair = (run['waypoints_list'][i], run['waypoints_list'][i+1])
-                            run_lookup[wp_pair] = run['name']
+                    run_lookup = db_manager.get_run_names_by_segment()
 
                     found_paths_str = []
                     for diff in ['Green', 'Blue', 'Black']:
-                        path_obj = mapper.find_smart_route_to_waypoint(start_wp_id, end_wp_id, diff)
-                        if path_obj and path_obj.get('waypoints'):
+                        # The best route and its alternatives, ranked by length
+                        for rank, path_obj in enumerate(mapper.find_routes(start_wp_id, end_wp_id, diff)):
                             path_waypoints = path_obj['waypoints']
                             path_run_names = []
                             for i in range(len(path_waypoints) - 1):
@@ -315,7 +311,8 @@ def index():
                                     path_run_names.append(run_name)
                             
                             path_str = " --> ".join(path_run_names)
-                            found_paths_str.append(f"<b>{diff}:</b> {path_str}")
+                            label = diff if rank == 0 else f"{diff} alternative {rank}"
+                            found_paths_str.append(f"<b>{label}</b> ({path_obj['distance_m'] / 1000:.1f} km): {path_str}")
 
                     if found_paths_str:
                         flash("<br>".join(found_paths_str), "success")
@@ -363,23 +360,16 @@ def index():
     all_routes = db_manager.get_all_routes_structured()
     
     # --- Prepare data for collapsible details ---
-    waypoints_by_id = {wp['id']: wp for wp in all_waypoints}
-    runs_by_id = {run['id']: run for run in all_runs}
+    run_waypoint_names = db_manager.get_run_waypoint_names()
+    route_run_names = db_manager.get_route_run_names()
+    route_start_names = db_manager.get_route_start_waypoint_names()
 
     for run in all_runs:
-        run['waypoint_names'] = [waypoints_by_id.get(wp_id, {}).get('name', 'Unknown WP') for wp_id in run['waypoints_list']]
+        run['waypoint_names'] = run_waypoint_names.get(run['id'], [])
     
     for route in all_routes:
-        route['run_names'] = [runs_by_id.get(run_id, {}).get('name', 'Unknown Run') for run_id in route['runs_list']]
-        route['start_waypoint_name'] = "N/A"
-        if route.get('runs_list'):
-            first_run_id = route['runs_list'][0]
-            first_run = runs_by_id.get(first_run_id)
-            if first_run and first_run.get('waypoints_list'):
-                first_waypoint_id = first_run['waypoints_list'][0]
-                first_waypoint = waypoints_by_id.get(first_waypoint_id)
-                if first_waypoint:
-                    route['start_waypoint_name'] = first_waypoint['name']
+        route['run_names'] = route_run_names.get(route['id'], [])
+        route['start_waypoint_name'] = route_start_names.get(route['id'], "N/A")
 
     return render_template_string(HTML_TEMPLATE, waypoints=all_waypoints, runs=all_runs, routes=all_routes)
 